@@ -0,0 +1,533 @@
+import os
+import sys
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, QTimer, Signal
+from basic_function.change_tracker import ChangeTracker
+from basic_function.utils import PageUtils
+
+# 后台任务：数据库读写在线程池中执行，结果通过信号回到界面线程，避免界面卡顿
+JOURNAL_DELAY = 500  # 编辑停顿多少毫秒后把修改写入本地日志
+# 登录后预取的表格 (集合, 行标识的保存方式)，与打开这些表格的页面使用的 PageUtils 设置相同
+PREFETCH_SHEETS = (('kpi_process_plan', None), ('second_page', None), ('page3', 'source'), ('page3_display', 'reference'))
+PREFETCH_THREADS = int(os.environ.get('KPI_PREFETCH_THREADS', 2))  # 同时预取的表格数
+PREFETCH_MEMORY_LIMIT = int(os.environ.get('KPI_PREFETCH_MEMORY_MB', 64)) * 1024 * 1024  # 预取的数据占用内存的上限（字节）
+CELL_COST = 100  # 预取的每个单元格（不含文本）和每个单元格样式估计占用的内存
+
+
+class TaskCancelled(Exception):
+    # 任务被取消时由 report_progress 抛出，用于中断正在进行的读取
+    pass
+
+
+class TaskSignals(QObject):
+    progress = Signal(int, int)  # 已完成数量, 总数量
+    finished = Signal(object, object)  # 任务, 任务结果
+    failed = Signal(object, str)  # 任务, 错误信息
+
+
+class BackgroundTask(QRunnable):
+    def __init__(self, fn, *args):
+        super().__init__()
+        self.setAutoDelete(False)  # 任务对象由 SheetTaskRunner 持有，结束后再释放
+        self.fn = fn  # 要执行的函数，第一个参数为任务本身，可用于汇报进度和检查取消
+        self.args = args
+        self.signals = TaskSignals()
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def report_progress(self, done, total):
+        # 在工作线程中调用：汇报进度，任务已取消时中断执行
+        if self.cancelled:
+            raise TaskCancelled()
+        self.signals.progress.emit(done, total)
+
+    def run(self):
+        try:
+            result = self.fn(self, *self.args)
+        except TaskCancelled:
+            result = None
+        except Exception as e:
+            self.signals.failed.emit(self, str(e))
+            return
+        self.signals.finished.emit(self, result)
+
+
+class SheetEvents(QObject):
+    # 进程内的表格事件：一个窗口对表格做的修改通知打开同一表格的其他窗口
+    rows_appended = Signal(str, int, object, object, int)  # 表格, 第一个新行的数据行号, 新行, 新行的行标识, 追加后的版本号
+    sheet_changed = Signal(str)  # 表格在数据库中被修改（例如引用的源表格行已更新）
+
+
+_sheet_events = None
+
+
+def sheet_events():
+    global _sheet_events
+    if _sheet_events is None:
+        _sheet_events = SheetEvents()
+    return _sheet_events
+
+
+def estimate_size(result):
+    # load_data_from_db 返回值占用内存的估计
+    table_data, colors, fonts, alignments, row_heights, col_widths = result
+    size = sum(CELL_COST + sys.getsizeof(text) for row in table_data for text in row)
+    return size + CELL_COST * (len(colors) + len(fonts) + len(alignments) + len(row_heights) + len(col_widths))
+
+
+class SheetPrefetcher(QObject):
+    # 登录后预取：在线程池中同时读取各页面的表格并解码为可以直接填充表格的数据（load_data_from_db 的返回值），
+    # 页面第一次打开时直接显示，不再等待下载；页面在预取完成前打开时，它的表格优先读取。
+    # 预取的数据只保留到页面取走为止，内存估计超过上限的表格不保留；注销时取消尚未完成的预取并释放数据
+    finished = Signal(str)  # 一个表格的预取结束（成功、失败或不保留）
+
+    def __init__(self, sheets=PREFETCH_SHEETS, memory_limit=PREFETCH_MEMORY_LIMIT, parent=None):
+        super().__init__(parent)
+        self.sheets = sheets
+        self.memory_limit = memory_limit
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(PREFETCH_THREADS)
+        self.tasks = {}  # 已开始的预取任务 -> 表格，保持引用直到结束
+        self.pending = {}  # 表格 -> 尚未完成的预取任务
+        self.results = {}  # 表格 -> (解码了表格的 PageUtils, load_data_from_db 的返回值, 内存估计)
+        self.memory = 0  # 保留的预取数据的内存估计
+
+    def start(self):
+        for collection_name, row_ids in self.sheets:
+            utils = PageUtils(collection_name, row_ids=row_ids)
+            task = BackgroundTask(self.fetch, utils)
+            self.pending[utils.sheet_key()] = task
+            self.tasks[task] = utils.sheet_key()
+            task.signals.finished.connect(self.on_task_finished)
+            task.signals.failed.connect(self.on_task_failed)
+            self.pool.start(task)
+
+    def fetch(self, task, utils):
+        # 在工作线程中执行：先只读取表头，估计超过内存上限的表格不下载
+        header = utils.db_client.get_header(utils.collection_name)
+        if header is not None and header.get('rows', 0) * header.get('columns', 0) * CELL_COST > self.memory_limit:
+            return None
+        result = utils.load_data_from_db(progress=task.report_progress)
+        return utils, result, estimate_size(result)
+
+    def is_pending(self, utils):
+        # 页面的表格正在按页面使用的行标识方式预取（方式不同时不必等待）
+        task = self.pending.get(utils.sheet_key())
+        return task is not None and task.args[0].row_id_mode == utils.row_id_mode
+
+    def prioritize(self, sheet):
+        # 页面在预取完成前打开：还在队列中的预取任务移到队列最前面
+        task = self.pending.get(sheet)
+        if task is not None and self.pool.tryTake(task):
+            self.pool.start(task, 1)
+
+    def take(self, utils):
+        # 页面打开时取出预取的表格（只能取一次），把解码的状态复制到页面的 PageUtils；没有可用的预取数据时返回 None
+        # 预取的是服务器上已提交的数据，编辑页面的本地日志中有未提交的修改时照常加载（叠加日志）
+        if utils.editing and utils.journal.has_pending():
+            return None
+        # 按不同行标识方式读取的预取数据留给使用该方式的页面（例如同一表格的只读页面不读取行标识）
+        entry = self.results.get(utils.sheet_key())
+        if entry is None or entry[0].row_id_mode != utils.row_id_mode:
+            return None
+        prefetched, result, size = self.results.pop(utils.sheet_key())
+        self.memory -= size
+        utils.adopt(prefetched)
+        return result
+
+    def stop(self):
+        # 注销：取消尚未完成的预取（队列中的直接移除，正在读取的在下一次汇报进度时中断），释放预取的数据
+        global _sheet_prefetcher
+        for task in list(self.tasks):
+            task.cancel()
+            if self.pool.tryTake(task):
+                del self.tasks[task]
+        self.pending = {}
+        self.results = {}
+        self.memory = 0
+        if _sheet_prefetcher is self:
+            _sheet_prefetcher = None
+
+    def on_task_finished(self, task, result):
+        sheet = self.tasks.pop(task, None)
+        if sheet is None or self.pending.get(sheet) is not task:
+            return
+        del self.pending[sheet]
+        if result is not None and not task.cancelled:
+            utils, data, size = result
+            if self.memory + size <= self.memory_limit:
+                self.results[sheet] = (utils, data, size)
+                self.memory += size
+        self.finished.emit(sheet)
+
+    def on_task_failed(self, task, message):
+        sheet = self.tasks.pop(task, None)
+        if sheet is None or self.pending.get(sheet) is not task:
+            return
+        del self.pending[sheet]
+        print(f"Prefetch failed: {message}")  # 页面打开时照常从服务器加载
+        self.finished.emit(sheet)
+
+
+_sheet_prefetcher = None
+
+
+def start_prefetch(sheets=PREFETCH_SHEETS):
+    # 登录后调用：开始预取，之前的预取（上一次登录）被取消
+    global _sheet_prefetcher
+    if _sheet_prefetcher is not None:
+        _sheet_prefetcher.stop()
+    _sheet_prefetcher = SheetPrefetcher(sheets)
+    _sheet_prefetcher.start()
+    return _sheet_prefetcher
+
+
+def sheet_prefetcher():
+    # 当前登录的预取器，没有预取时为 None
+    return _sheet_prefetcher
+
+
+class SheetTaskRunner(QObject):
+    # 页面使用的后台读写器：加载和保存都不阻塞界面线程
+    loaded = Signal(object)  # load_data_from_db 的返回值
+    unchanged = Signal()  # 刷新时数据库版本未变化，没有重新下载
+    block_loaded = Signal(int, object)  # 块号, load_block 的返回值
+    block_failed = Signal(int)  # 读取失败的块号
+    queried = Signal(object, int)  # 服务器端筛选的一页结果 (query_rows 的返回值), 这一页的起始位置
+    values_queried = Signal(int, object)  # 列号, 服务器端统计的 (不重复值, 计数)
+    size_checked = Signal(object)  # 数据库中表格的数据行数，没有表格时为 None
+    saved = Signal()
+    rows_appended = Signal(int, object, object)  # 追加到本表格的行（可能来自其他窗口）: 第一个新行的数据行号, 新行, 行标识
+    revision_checked = Signal(bool)  # 只查询版本号的结果：数据库中的表格是否与显示的版本相同
+    progress = Signal(int, int)
+    failed = Signal(str)
+
+    def __init__(self, utils, parent=None):
+        super().__init__(parent)
+        self.utils = utils
+        self.load_task = None
+        self.snapshot_task = None  # 正在读取本地快照的任务
+        self.check_task = None  # 正在查询版本号的任务
+        self.query_task = None  # 正在执行的服务器端筛选
+        self.values_task = None  # 正在统计一列取值的任务
+        self.size_task = None  # 正在查询行数的任务
+        self.block_tasks = {}  # 正在读取的行块任务 -> 块号（按需加载的表格）
+        self.status_bar = None  # 用于显示加载/保存状态的状态栏
+        self.tasks = {}  # 运行中的任务 -> 保存任务对应的表格（加载任务为 None），保持引用直到结束
+        # 保存使用单线程的线程池，保证多次保存按顺序写入
+        self.save_pool = QThreadPool(self)
+        self.save_pool.setMaxThreadCount(1)
+        # 被编辑的表格在停顿后把修改写入本地日志
+        self.journal_timer = QTimer(self)
+        self.journal_timer.setSingleShot(True)
+        self.journal_timer.setInterval(JOURNAL_DELAY)
+        self.journal_timer.timeout.connect(self.journal_edits)
+        self.watched = None  # (表格, 是否管理员)
+        self.displaying = False  # 是否已经加载并显示了表格
+        self.append_tasks = {}  # 正在追加的任务 -> 追加的行
+        self.waiting_prefetch = False  # 打开页面时表格正在预取，等预取完成后再显示
+        self.keep_edits = False  # 正在进行的加载是后台同步（不是用户要求的重新加载），表格有未保存的修改时不覆盖
+        sheet_events().rows_appended.connect(self.on_rows_appended)
+        sheet_events().sheet_changed.connect(self.on_sheet_changed)
+        self.prefetcher = sheet_prefetcher()
+        if self.prefetcher is not None:
+            self.prefetcher.finished.connect(self.on_prefetched)
+
+    def attach_status_bar(self, status_bar):
+        # 在页面的状态栏中显示加载进度、保存结果和错误
+        self.status_bar = status_bar
+
+    def show_status(self, message, timeout=0):
+        if self.status_bar is not None:
+            self.status_bar.showMessage(message, timeout)
+
+    def start(self, task, pool, table=None):
+        # 信号连接到本对象的方法，保证回调在界面线程执行
+        self.tasks[task] = table
+        task.signals.progress.connect(self.on_task_progress)
+        task.signals.finished.connect(self.on_task_finished)
+        task.signals.failed.connect(self.on_task_failed)
+        pool.start(task)
+        return task
+
+    def load(self, block_ids=None):
+        # 后台读取并解码表格数据，新的加载会取消尚未完成的旧加载
+        self.cancel()
+        self.show_status('正在加载...')
+        self.keep_edits = False
+        loader = self.utils.detached()
+        self.load_task = BackgroundTask(lambda task: (loader, loader.load_data_from_db(block_ids, task.report_progress)))
+        return self.start(self.load_task, QThreadPool.globalInstance())
+
+    def open(self):
+        # 打开页面：登录后预取的表格直接显示（正在预取时优先读取并等待）；
+        # 否则先显示本地磁盘快照，再在后台与服务器比对版本；没有快照时直接从服务器加载
+        self.cancel()
+        self.show_status('正在加载...')
+        if self.prefetcher is not None and self.prefetcher is sheet_prefetcher():
+            sheet = self.utils.sheet_key()
+            if self.prefetcher.is_pending(self.utils):
+                self.prefetcher.prioritize(sheet)
+                self.waiting_prefetch = True
+                return None
+            result = self.prefetcher.take(self.utils)
+            if result is not None:
+                self.displaying = True
+                self.loaded.emit(result)
+                return self.refresh()  # 预取之后数据可能已变化，只比对版本号
+        loader = self.utils.detached()
+        self.load_task = self.snapshot_task = BackgroundTask(lambda task: (loader, loader.load_snapshot()))
+        return self.start(self.load_task, QThreadPool.globalInstance())
+
+    def refresh(self, table=None, force=False):
+        # 刷新：先比对版本号，数据未变化时不下载也不重建表格
+        # 表格有未保存的修改时，刷新意味着放弃修改（包括本地日志中的），需要强制重新加载
+        if table is not None and self.utils.has_unsaved_changes(table):
+            self.journal_timer.stop()
+            self.utils.discard_unsaved()
+            return self.load()
+        if force:
+            return self.load()
+        self.cancel()
+        self.show_status('正在检查更新...')
+        self.keep_edits = True
+        loader = self.utils.detached()
+        self.load_task = BackgroundTask(lambda task: (loader, loader.load_data_if_changed(task.report_progress)))
+        return self.start(self.load_task, QThreadPool.globalInstance())
+
+    def reopen(self):
+        # 重新显示缓存的页面：关闭时加载被取消、还没有显示数据时重新打开，否则只比对版本号；
+        # 表格有未保存的修改（包括本地日志中的）时保留修改，不重新加载
+        if not self.displaying:
+            return self.open()
+        if self.watched is not None and self.utils.has_unsaved_changes(self.watched[0]):
+            return None
+        return self.refresh()
+
+    def on_prefetched(self, sheet):
+        if self.waiting_prefetch and sheet == self.utils.sheet_key():
+            self.waiting_prefetch = False
+            self.open()
+
+    def check_revision(self):
+        # 在后台只查询版本号，不下载数据（按需加载的表格用来判断是否需要重新加载），结果通过 revision_checked 返回
+        if self.check_task:
+            self.check_task.cancel()
+        self.check_task = BackgroundTask(lambda task: self.utils.is_current())
+        return self.start(self.check_task, QThreadPool.globalInstance())
+
+    def check_size(self):
+        # 在后台只查询表格的数据行数（只读视图据此选择整表加载或服务器端分页），结果通过 size_checked 返回
+        self.cancel()
+        self.show_status('正在加载...')
+        self.size_task = BackgroundTask(lambda task: self.utils.sheet_rows())
+        return self.start(self.size_task, QThreadPool.globalInstance())
+
+    def query(self, filter_conditions, sort_conditions, skip, default_style, is_admin=False):
+        # 在服务器端筛选和排序，只下载一页匹配的行；新的查询会取消尚未完成的旧查询
+        if self.query_task:
+            self.query_task.cancel()
+        self.show_status('正在筛选...')
+        filter_conditions = dict(filter_conditions)
+        sort_conditions = list(sort_conditions)
+        loader = self.utils.detached()
+        self.query_task = BackgroundTask(lambda task: (
+            loader, loader.query_rows(filter_conditions, sort_conditions, skip, default_style, is_admin=is_admin), skip))
+        return self.start(self.query_task, QThreadPool.globalInstance())
+
+    def query_values(self, col, is_admin=False):
+        # 在服务器端统计一列的不重复值和计数（筛选对话框），结果通过 values_queried 返回
+        if self.values_task:
+            self.values_task.cancel()
+        self.values_task = BackgroundTask(lambda task: (col, self.utils.query_values(col, is_admin)))
+        return self.start(self.values_task, QThreadPool.globalInstance())
+
+    def fetch_block(self, block_id, default_style):
+        # 在后台读取一个行块，多个行块可以同时读取
+        loader = self.utils.detached()
+        task = BackgroundTask(lambda task: (loader, loader.load_block(block_id, default_style)))
+        self.block_tasks[task] = block_id
+        return self.start(task, QThreadPool.globalInstance())
+
+    def cancel_blocks(self):
+        # 丢弃尚未返回的行块读取结果（例如重新加载时）
+        for task in self.block_tasks:
+            task.cancel()
+        self.block_tasks = {}
+
+    def is_querying(self):
+        return self.query_task is not None
+
+    def watch(self, table, is_admin):
+        # 表格的每次编辑在停顿 JOURNAL_DELAY 毫秒后写入本地日志，程序崩溃或未保存就关闭时不会丢失
+        self.watched = (table, is_admin)
+        self.utils.editing = True  # 加载时叠加本地日志中尚未提交的修改
+        ChangeTracker.for_table(table).listener = self.journal_timer.start
+
+    def journal_edits(self):
+        self.journal_timer.stop()
+        if self.watched is not None:
+            self.utils.prepare_save(*self.watched)
+
+    def save(self, table, is_admin):
+        # 表格内容只能在界面线程读取，所以先在这里把修改写入本地日志，再在后台提交到数据库
+        self.journal_timer.stop()
+        self.utils.prepare_save(table, is_admin)
+        self.show_status('正在保存...')
+        task = BackgroundTask(lambda task: self.utils.flush_journal())
+        return self.start(task, self.save_pool, table)
+
+    def append_rows(self, rows, row_ids=None):
+        # 在后台把行追加到表格末尾（服务器端一次操作），完成后通知打开该表格的窗口；与保存使用同一个线程池，按顺序写入
+        self.show_status('正在添加...')
+        task = BackgroundTask(lambda task: self.utils.append_rows(rows, row_ids))
+        self.append_tasks[task] = (rows, row_ids)
+        return self.start(task, self.save_pool)
+
+    def on_rows_appended(self, sheet, first_row, rows, row_ids, revision):
+        # 其他窗口向本表格追加了行：表格与数据库的版本连续、且没有未保存的行列变化时直接追加到表格末尾，否则重新加载
+        if sheet != self.utils.sheet_key() or not self.displaying:
+            return
+        if (self.load_task is None and self.utils.revision is not None and revision == self.utils.revision + 1
+                and (self.watched is None or self.utils.can_save_delta(self.watched[0], self.watched[1],
+                                                                      ChangeTracker.for_table(self.watched[0])))):
+            self.utils.revision = revision
+            self.utils.rows = max(self.utils.rows, first_row + len(rows))
+            self.rows_appended.emit(first_row, rows, row_ids)
+        else:
+            self.on_sheet_changed(sheet)
+
+    def on_sheet_changed(self, sheet):
+        # 显示的表格在数据库中被修改：没有未保存的修改时检查版本并重新加载
+        if sheet != self.utils.sheet_key() or not self.displaying:
+            return
+        if self.watched is not None and self.utils.has_unsaved_changes(self.watched[0]):
+            self.show_status('表格已被其他窗口更新，保存或刷新后显示')
+        else:
+            self.refresh()
+
+    def is_loading(self):
+        return self.load_task is not None or self.waiting_prefetch
+
+    def close(self):
+        # 页面关闭：未写入日志的修改立即写入，取消尚未完成的读取
+        if self.journal_timer.isActive():
+            self.journal_edits()
+        self.cancel()
+
+    def cancel(self):
+        # 取消尚未完成的读取（保存会继续完成，避免数据丢失）
+        if self.load_task:
+            self.load_task.cancel()
+            self.load_task = self.snapshot_task = None
+        if self.check_task:
+            self.check_task.cancel()
+            self.check_task = None
+        for name in ('query_task', 'values_task', 'size_task'):
+            task = getattr(self, name)
+            if task:
+                task.cancel()
+                setattr(self, name, None)
+        self.waiting_prefetch = False
+        self.cancel_blocks()
+
+    def on_task_progress(self, done, total):
+        if self.load_task is not None:
+            self.show_status(f'正在加载 {done}/{total}')
+            self.progress.emit(done, total)
+
+    def on_task_finished(self, task, result):
+        table = self.tasks.pop(task, None)
+        if task in self.block_tasks:
+            loader, result = result
+            self.utils.adopt(loader)  # 读取时解码的行列数、合并等在界面线程中更新
+            self.block_loaded.emit(self.block_tasks.pop(task), result)
+        elif task in self.append_tasks:
+            rows, row_ids = self.append_tasks.pop(task)
+            first_row, revision = result
+            self.show_status(f'已添加 {len(rows)} 行', 3000)
+            sheet_events().rows_appended.emit(self.utils.sheet_key(), first_row, rows, row_ids, revision)
+        elif task is self.check_task:
+            self.check_task = None
+            self.revision_checked.emit(result)
+        elif task is self.size_task:
+            self.size_task = None
+            self.size_checked.emit(result)
+        elif task is self.query_task:
+            self.query_task = None
+            loader, result, skip = result  # 只解码了一页，不更新本对象的表格状态
+            self.show_status(f'筛选结果 {result[-1]} 行', 3000)
+            self.queried.emit(result, skip)
+        elif task is self.values_task:
+            self.values_task = None
+            self.show_status('')
+            self.values_queried.emit(*result)
+        elif task is self.load_task and task is self.snapshot_task:
+            self.load_task = self.snapshot_task = None
+            loader, result = result
+            if result is None:
+                self.load()
+            else:
+                self.utils.adopt(loader)
+                self.displaying = True
+                self.loaded.emit(result)
+                self.refresh()
+                self.show_status('已从本地快照显示，正在与服务器同步...')
+        elif task is self.load_task:
+            self.load_task = None
+            loader, result = result
+            if result is None:
+                self.show_status('数据已是最新', 3000)
+                self.unchanged.emit()
+            elif self.keep_edits and self.watched is not None and self.utils.has_unsaved_changes(self.watched[0]):
+                # 显示快照或预取数据后、与服务器同步完成前用户已开始编辑：保留编辑，不用服务器的数据覆盖表格
+                self.show_status('服务器上有更新的数据，保存或刷新后显示')
+            else:
+                self.utils.adopt(loader)
+                self.show_status('加载完成', 3000)
+                self.displaying = True
+                self.loaded.emit(result)
+        elif table is not None:
+            failed = self.utils.apply_commits(result)  # 在界面线程中更新版本号
+            if failed:
+                self.show_status(f'保存成功，但引用表格 {", ".join(failed)} 未能同步')
+            else:
+                self.show_status('保存成功', 3000)
+            for collection_name in self.utils.projections:
+                # 引用本表格的表格可能已随之更新
+                sheet_events().sheet_changed.emit(self.utils.db_client.snapshot_key(collection_name))
+            self.saved.emit()
+
+    def on_task_failed(self, task, message):
+        table = self.tasks.pop(task, None)
+        if task.cancelled:
+            return
+        if task is self.load_task and task is self.snapshot_task:
+            # 本地快照不可用，直接从服务器加载
+            self.load_task = self.snapshot_task = None
+            self.load()
+            return
+        if task is self.size_task:
+            # 无法查询行数时按原方式打开整张表格
+            self.size_task = None
+            self.open()
+            return
+        if task is self.load_task:
+            self.load_task = None
+        elif task is self.check_task:
+            self.check_task = None
+        elif task is self.query_task:
+            self.query_task = None
+        elif task is self.values_task:
+            self.values_task = None
+        elif task in self.block_tasks:
+            self.block_failed.emit(self.block_tasks.pop(task))
+        elif table is not None:
+            self.utils.revision = None  # 失败前可能已提交了部分修改，版本号未知，下次刷新时重新下载
+        else:
+            self.append_tasks.pop(task, None)
+        # 保存失败时修改仍留在本地日志中，下次保存时重试
+        print(f"Background task failed: {message}")
+        self.show_status(f'操作失败: {message}')
+        self.failed.emit(message)
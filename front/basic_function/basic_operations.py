@@ -1,59 +1,96 @@
 # 从 PySide6.QtWidgets 导入 QTableWidgetItem 类来创建表格单元格，从 PySide6.QtCore 导入 Qt 用于使用常量
 from PySide6.QtWidgets import QTableWidgetItem
 from PySide6.QtCore import Qt
+from basic_function.change_tracker import ChangeTracker
+from basic_function.span_index import SpanIndex
+from basic_function.undo_stack import UndoStack
+from basic_function.column_types import shift_column_types
 
 # 定义一个名为 BasicOperations 的类，用于执行表格操作
 class BasicOperations:
     # 构造函数：初始化实例并传入一个表格控件的引用
     def __init__(self, table):
         self.table = table  # 保存对表格控件的引用
+        self.tracker = ChangeTracker.for_table(table)  # 记录被修改的单元格，用于增量保存
+        self.span_index = SpanIndex.for_table(table)  # 插入/删除行列后同步调整合并索引
+        self.undo_stack = UndoStack.for_table(table)  # 记录每个操作的修改，用于撤销/重做
 
     # 方法：清除表格中选中单元格的文本
     def clear_cells(self):
-        for item in self.table.selectedItems():  # 遍历表格中每个选中的单元格
-            item.setText("")  # 将选中单元格的文本设置为空字符串
+        items = self.table.selectedItems()
+        with self.undo_stack.record('清空单元格') as step:
+            step.watch_cells((item.row(), item.column()) for item in items)
+            for item in items:  # 遍历表格中每个选中的单元格
+                item.setText("")  # 将选中单元格的文本设置为空字符串
+                self.tracker.mark_cell(item.row(), item.column())
 
     # 方法：在选中的行上方或下方添加行
     def add_rows(self, above):
         rows = sorted(set(index.row() for index in self.table.selectedIndexes()))  # 获取所有选中单元格的行号，并去重、排序
         count = len(rows)  # 计算选中行的数量
         insert_at = rows[0] if above else rows[-1] + 1  # 判断是在上方还是下方添加行，并确定插入位置
-        for _ in range(count):  # 根据选中行的数量重复添加行
-            self.table.insertRow(insert_at)  # 在指定位置插入行
-            for column in range(self.table.columnCount()):  # 遍历所有列
-                item = QTableWidgetItem()  # 创建新的单元格项
-                item.setBackground(Qt.white)  # 设置单元格背景为白色
-                self.table.setItem(insert_at, column, item)  # 将新的单元格项添加到表格中
+        self.tracker.mark_structure()  # 行结构变化，下次保存需整表写入
+        with self.undo_stack.record('添加行') as step:
+            for _ in range(count):  # 根据选中行的数量重复添加行
+                self.table.insertRow(insert_at)  # 在指定位置插入行
+                self.span_index.insert_rows(insert_at)
+                for column in range(self.table.columnCount()):  # 遍历所有列
+                    item = QTableWidgetItem()  # 创建新的单元格项
+                    item.setBackground(Qt.white)  # 设置单元格背景为白色
+                    self.table.setItem(insert_at, column, item)  # 将新的单元格项添加到表格中
+                step.inserted('row', insert_at)
 
     # 方法：在选中的列左侧或右侧添加列
     def add_columns(self, left):
         columns = sorted(set(index.column() for index in self.table.selectedIndexes()))  # 获取所有选中单元格的列号，并去重、排序
         count = len(columns)  # 计算选中列的数量
         insert_at = columns[0] if left else columns[-1] + 1  # 判断是在左侧还是右侧添加列，并确定插入位置
-        for _ in range(count):  # 根据选中列的数量重复添加列
-            self.table.insertColumn(insert_at)  # 在指定位置插入列
-            for row in range(self.table.rowCount()):  # 遍历所有行
-                item = QTableWidgetItem()  # 创建新的单元格项
-                item.setBackground(Qt.white)  # 设置单元格背景为白色
-                self.table.setItem(row, insert_at, item)  # 将新的单元格项添加到表格中
+        self.tracker.mark_structure()  # 列结构变化，下次保存需整表写入
+        with self.undo_stack.record('添加列') as step:
+            for _ in range(count):  # 根据选中列的数量重复添加列
+                self.table.insertColumn(insert_at)  # 在指定位置插入列
+                self.span_index.insert_columns(insert_at)
+                shift_column_types(self.table, insert_at, 1)  # 列类型设置随列移动
+                for row in range(self.table.rowCount()):  # 遍历所有行
+                    item = QTableWidgetItem()  # 创建新的单元格项
+                    item.setBackground(Qt.white)  # 设置单元格背景为白色
+                    self.table.setItem(row, insert_at, item)  # 将新的单元格项添加到表格中
+                step.inserted('column', insert_at)
 
     # 方法：删除选中的行
     def delete_rows(self):
         rows = sorted(set(index.row() for index in self.table.selectedIndexes()), reverse=True)  # 获取所有选中行的行号，并去重、倒序排序
-        for row in rows:  # 遍历所有选中的行
-            self.table.removeRow(row)  # 删除行
+        if rows:
+            self.tracker.mark_structure()
+        with self.undo_stack.record('删除行') as step:
+            step.watch_spans()  # 删除行会缩小或移除合并，撤销时恢复原来的合并
+            for row in rows:  # 遍历所有选中的行
+                step.removing('row', row)
+                self.table.removeRow(row)  # 删除行
+                self.span_index.remove_rows(row)
 
     # 方法：删除选中的列
     def delete_columns(self):
         columns = sorted(set(index.column() for index in self.table.selectedIndexes()), reverse=True)  # 获取所有选中列的列号，并去重、倒序排序
-        for col in columns:  # 遍历所有选中的列
-            self.table.removeColumn(col)  # 删除列
+        if columns:
+            self.tracker.mark_structure()
+        with self.undo_stack.record('删除列') as step:
+            step.watch_spans()
+            for col in columns:  # 遍历所有选中的列
+                step.removing('column', col)
+                self.table.removeColumn(col)  # 删除列
+                self.span_index.remove_columns(col)
+                shift_column_types(self.table, col, -1)
 
     # 方法：设置选中单元格的对齐方式
     def align_cells(self, horizontal_alignment, vertical_alignment):
-        for index in self.table.selectedIndexes():  # 遍历所有选中的单元格
-            item = self.table.item(index.row(), index.column())  # 获取单元格项
-            if not item:
-                item = QTableWidgetItem()  # 如果单元格项不存在，则创建新的单元格项
-                self.table.setItem(index.row(), index.column(), item)  # 将新的单元格项添加到表格中
-            item.setTextAlignment(horizontal_alignment | vertical_alignment)  # 设置单元格的文本对齐方式
+        indexes = self.table.selectedIndexes()
+        with self.undo_stack.record('对齐单元格') as step:
+            step.watch_cells((index.row(), index.column()) for index in indexes)
+            for index in indexes:  # 遍历所有选中的单元格
+                item = self.table.item(index.row(), index.column())  # 获取单元格项
+                if not item:
+                    item = QTableWidgetItem()  # 如果单元格项不存在，则创建新的单元格项
+                    self.table.setItem(index.row(), index.column(), item)  # 将新的单元格项添加到表格中
+                item.setTextAlignment(horizontal_alignment | vertical_alignment)  # 设置单元格的文本对齐方式
+                self.tracker.mark_style(index.row(), index.column())
@@ -0,0 +1,90 @@
+# ChangeTracker 用于记录表格自上次加载/保存以来被修改过的部分（脏数据），
+# 保存时只把这些变化发送到数据库，而不是重写整张表
+
+
+class ChangeTracker:
+    def __init__(self):
+        self.synced = False  # 表格内容是否与数据库中的文档一致（加载或保存成功后为 True）
+        self.listener = None  # 每次标记修改后调用的回调（例如延迟写入本地日志）
+        # 上次整表填充（PageUtils.fill_items）时设置了样式的单元格 {(row, col): 样式}，之后被修改过的单元格样式记为 None，
+        # 用于判断单元格项能否直接复用；None 表示还没有填充过或行列结构已改变，不能复用。保存后不清空（样式仍在单元格项上）
+        self.formatted = None
+        self.reset()
+
+    @staticmethod
+    def for_table(table):
+        # 获取挂在表格上的跟踪器，没有则创建一个（例如临时表格）
+        tracker = getattr(table, 'change_tracker', None)
+        if tracker is None:
+            tracker = ChangeTracker()
+            table.change_tracker = tracker
+        return tracker
+
+    def reset(self):
+        # 清空所有脏标记
+        self.dirty_cells = set()  # 文本被修改的单元格 (row, col)
+        self.dirty_styles = set()  # 颜色/字体/对齐被修改的单元格 (row, col)
+        self.dirty_row_heights = set()  # 行高被修改的行
+        self.dirty_col_widths = set()  # 列宽被修改的列
+        self.spans_dirty = False  # 合并信息是否被修改
+        self.column_types_dirty = False  # 列类型设置是否被修改
+        self.structure_dirty = False  # 是否插入/删除了行或列
+
+    def mark_synced(self):
+        # 表格已与数据库一致（加载完成或保存成功）
+        self.reset()
+        self.synced = True
+
+    def changed(self):
+        if self.listener is not None:
+            self.listener()
+
+    def mark_cell(self, row, col):
+        self.dirty_cells.add((row, col))
+        self.changed()
+
+    def mark_style(self, row, col):
+        self.dirty_styles.add((row, col))
+        self.mark_formatted(row, col)
+        self.changed()
+
+    def mark_item(self, row, col):
+        # 文本和样式都可能变化的编辑
+        self.dirty_cells.add((row, col))
+        self.dirty_styles.add((row, col))
+        self.mark_formatted(row, col)
+        self.changed()
+
+    def mark_formatted(self, row, col):
+        if self.formatted is not None:
+            self.formatted[(row, col)] = None
+
+    def mark_row_height(self, row):
+        self.dirty_row_heights.add(row)
+        self.changed()
+
+    def mark_col_width(self, col):
+        self.dirty_col_widths.add(col)
+        self.changed()
+
+    def mark_spans(self):
+        self.spans_dirty = True
+        self.changed()
+
+    def mark_column_types(self):
+        self.column_types_dirty = True
+        self.changed()
+
+    def mark_structure(self):
+        # 行列结构改变后，单元格坐标整体偏移，只能整表保存
+        self.structure_dirty = True
+        self.formatted = None
+        self.changed()
+
+    def has_changes(self):
+        return bool(self.dirty_cells or self.dirty_styles or self.dirty_row_heights
+                    or self.dirty_col_widths or self.spans_dirty or self.column_types_dirty or self.structure_dirty)
+
+    def can_save_delta(self):
+        # 只有在表格与数据库同步、且结构未变时才能做增量保存
+        return self.synced and not self.structure_dirty
@@ -0,0 +1,31 @@
+# 列类型设置：表格单元格中保存的都是文本，筛选、排序等分析时按列的类型转换（转换见 typed_data.py）。
+# 类型由数据推断，也可以在表格文档的 column_types 中按列指定
+#   int 整数 / float 小数 / date 日期 / category 分类（重复值多的文本） / text 文本
+# 这里只有列类型的保存和调整，不依赖 pandas，加载表格时不需要导入 pandas
+
+COLUMN_KINDS = {'int': '整数', 'float': '小数', 'date': '日期', 'category': '分类', 'text': '文本'}
+
+
+def encode_column_types(column_types):
+    # 保存到数据库时列号转换为字符串键
+    return {str(col): kind for col, kind in sorted(column_types.items())}
+
+
+def decode_column_types(column_types):
+    return {int(col): kind for col, kind in (column_types or {}).items() if kind in COLUMN_KINDS}
+
+
+def shift_column_types(table, at, count):
+    # 插入 (count > 0) 或删除 (count < 0) 列后调整表格上的列类型设置
+    column_types = getattr(table, 'column_types', None)
+    if not column_types:
+        return
+    shifted = {}
+    for col, kind in column_types.items():
+        if col < at:
+            shifted[col] = kind
+        elif count > 0:
+            shifted[col + count] = kind
+        elif col >= at - count:
+            shifted[col + count] = kind
+    table.column_types = shifted
@@ -0,0 +1,204 @@
+import numpy as np
+import pandas as pd
+from basic_function.change_tracker import ChangeTracker
+from basic_function.undo_stack import UndoStack
+from basic_function.span_index import SpanIndex
+from basic_function.typed_data import typed_column, value_labels
+
+# 筛选引擎：加载表格时为每一列预先计算一次“值编号”（对按类型转换后的列做 pd.factorize，编号按值的大小排序），
+# 之后修改某一列的筛选只需用该列的编号生成这一列的行位图，再与其他列缓存的位图求交集；
+# 数字/日期列按数值排序，所以编号本身就是排序的秩，多个排序键只做一次稳定的 lexsort。
+# 表格不重建，只隐藏/显示可见性变化的行，排序时按排列移动行。编号、位图都按原数据行（行标识）保存，
+# order/position 是原数据行与表格行之间的映射；单元格的文本和样式、行高以及单行的合并随行一起移动。
+# 筛选对话框用到的每列不重复值和计数按列缓存，只有该列的单元格被修改（或列类型改变）时才重新计算这一列
+# 第二页的两个视图通常加载整张表格（快照/预取后与服务器只比对版本），筛选和排序在本地通过本引擎完成；
+# 数据行数超过 QUERY_MODE_ROWS 的表格在只读视图中不使用本引擎，而是在服务器端分页筛选（MongoDBClient.query_rows）
+
+
+class FilterEngine:
+    def __init__(self, df, table, first_row):
+        self.table = table
+        self.first_row = first_row  # 数据第一行在表格中的行号（用户视图上方有表头行/筛选行）
+        self.row_count = len(df)
+        self.codes = []  # 每列每行的值编号（按值排序后的序号，相同的值编号相同，空值为 -1）
+        self.labels = []  # 每列按编号排列的不重复值的显示文本（筛选项）
+        for col in range(df.shape[1]):
+            codes, values = pd.factorize(df.iloc[:, col], sort=True)
+            self.codes.append(codes)
+            self.labels.append(value_labels(values))
+        self.counts = {}  # 列 -> 每个不重复值出现的行数（打开筛选对话框时计算并缓存）
+        self.column_types = dict(getattr(table, 'column_types', {}))  # 计算编号时使用的列类型设置
+        self.dirty = set()  # 加载后被修改过、需要重新计算编号的列
+        self.filters = {}  # 列 -> 选中的值（空表示不筛选）
+        self.masks = {}  # 列 -> 该列筛选的行位图
+        self.visible = np.ones(self.row_count, dtype=bool)  # 每个数据行是否可见
+        self.sorts = []  # 当前的排序键 [(列, 是否升序)]
+        self.order = np.arange(self.row_count)  # 表格中第 i 个数据行显示的是原数据的第 order[i] 行
+        self.position = np.arange(self.row_count)  # order 的逆排列：原数据行当前在表格中的位置
+        table.itemChanged.connect(self.on_item_changed)
+        if hasattr(table, 'rangeChanged'):
+            table.rangeChanged.connect(self.on_range_changed)
+
+    def detach(self):
+        # 重新加载表格、换用新的筛选引擎之前调用：显示被筛选隐藏的行，不再跟踪表格的修改
+        self.show_all()
+        self.table.itemChanged.disconnect(self.on_item_changed)
+        if hasattr(self.table, 'rangeChanged'):
+            self.table.rangeChanged.disconnect(self.on_range_changed)
+
+    def on_item_changed(self, item):
+        # 数据行的单元格被修改：只标记该列，下次用到这一列时再重新计算
+        if item.row() >= self.first_row:
+            self.dirty.add(item.column())
+
+    def on_range_changed(self, top, left, bottom, right):
+        # 一次更新了多个单元格（例如行块加载完成）：标记涉及的列
+        if bottom >= self.first_row:
+            self.dirty.update(range(left, right + 1))
+
+    def show_all(self):
+        # 显示被筛选隐藏的行（重新加载表格、换用新的筛选引擎之前调用）
+        for index in np.flatnonzero(~self.visible[self.order]):
+            self.table.setRowHidden(self.first_row + int(index), False)
+
+    def column_values(self, col):
+        # 该列所有不重复的值的显示文本（按值排序，数字/日期列按数值顺序）
+        self.refresh_column(col)
+        return self.labels[col]
+
+    def column_counts(self, col):
+        # 该列每个不重复值（与 column_values 顺序相同）出现的行数
+        self.refresh_column(col)
+        counts = self.counts.get(col)
+        if counts is None:
+            codes = self.codes[col]
+            counts = self.counts[col] = np.bincount(codes[codes >= 0], minlength=len(self.labels[col]))
+        return counts
+
+    def refresh_column(self, col):
+        # 该列的数据或列类型在加载后变化时，按表格当前的内容重新计算这一列的编号，并清除它的缓存
+        kind = getattr(self.table, 'column_types', {}).get(col)
+        if col not in self.dirty and kind == self.column_types.get(col):
+            return
+        # 按原数据行的顺序读取（排序后原数据行 i 显示在表格的 first_row + position[i] 行）
+        texts = []
+        for row in self.position:
+            item = self.table.item(self.first_row + int(row), col)
+            texts.append(item.text() if item else '')
+        codes, values = pd.factorize(typed_column(texts, kind), sort=True)
+        self.codes[col] = codes
+        self.labels[col] = value_labels(values)
+        self.counts.pop(col, None)
+        if kind is None:
+            self.column_types.pop(col, None)
+        else:
+            self.column_types[col] = kind
+        self.dirty.discard(col)
+        if col in self.filters:
+            self.masks[col] = self.column_mask(col, self.filters[col])
+
+    def apply(self, filter_conditions, sort_conditions):
+        # 应用新的筛选和排序条件，只重新计算条件变化的列，并只更新可见性变化的行；
+        # 数据区域中有跨多行的合并单元格而不能排序时，筛选照常应用，保持原来的排序并返回 False
+        for col in set(self.filters) | set(filter_conditions) | set(col for col, _ in sort_conditions):
+            self.refresh_column(col)
+        for col in set(self.filters) | set(filter_conditions):
+            selected = list(filter_conditions.get(col) or [])
+            if selected == self.filters.get(col, []):
+                continue
+            if selected:
+                self.filters[col] = selected
+                self.masks[col] = self.column_mask(col, selected)
+            else:
+                self.filters.pop(col, None)
+                self.masks.pop(col, None)
+        visible = np.ones(self.row_count, dtype=bool)
+        for mask in self.masks.values():
+            visible &= mask
+
+        sorts = list(sort_conditions)
+        sorted_ok = True
+        if sorts != self.sorts:
+            previous, self.sorts = self.sorts, sorts
+            sorted_ok = self.reorder(visible)
+            if not sorted_ok:
+                self.sorts = previous
+        else:
+            # 只有筛选变化：找出可见性变化的行
+            for row in np.flatnonzero(visible != self.visible):
+                self.table.setRowHidden(self.first_row + int(self.position[row]), not visible[row])
+        self.visible = visible
+        return sorted_ok
+
+    def column_mask(self, col, selected):
+        # 选中值的编号 -> 查找表，再按每行的编号取出，得到该列的行位图
+        lookup = np.zeros(len(self.labels[col]) + 1, dtype=bool)  # 最后一项对应缺失值（编号 -1）
+        lookup[:-1] = np.isin(self.labels[col], np.asarray(selected, dtype=object))
+        return lookup[self.codes[col]]
+
+    def sort_key(self, col, ascending):
+        # 每行的排序键：编号按值排序，降序时取反；空值（编号 -1）无论升序降序都排在最后
+        codes = self.codes[col]
+        count = len(self.labels[col])
+        return np.where(codes < 0, count, codes if ascending else count - 1 - codes)
+
+    def reorder(self, visible):
+        # 按排序键计算新的行顺序（第一个为主排序键，相等时保持原来的顺序），把表格中的行移动到新位置；
+        # 有跨多行的合并而不能移动行时只更新可见性，返回 False
+        if self.sorts:
+            # np.lexsort 以最后一个键为主排序键
+            keys = [self.sort_key(col, ascending) for col, ascending in reversed(self.sorts)]
+            order = np.lexsort(keys)
+        else:
+            order = np.arange(self.row_count)
+        moves = self.position[order]  # 新位置 i 的内容原来在表格中的位置
+        sorted_ok = True
+        if (moves != np.arange(self.row_count)).any() and self.has_row_spans():
+            sorted_ok = False
+            order, moves = self.order, np.arange(self.row_count)
+        if (moves != np.arange(self.row_count)).any():
+            permute_rows(self.table, self.first_row, moves)
+            UndoStack.for_table(self.table).clear()  # 行已移动，之前的撤销记录不再适用
+            ChangeTracker.for_table(self.table).mark_structure()  # 行的位置变化，保存时整表写入
+        old_hidden = ~self.visible[self.order]
+        new_hidden = ~visible[order]
+        for index in np.flatnonzero(old_hidden != new_hidden):
+            self.table.setRowHidden(self.first_row + int(index), bool(new_hidden[index]))
+        self.order = order
+        self.position = np.empty_like(order)
+        self.position[order] = np.arange(self.row_count)
+        return sorted_ok
+
+    def has_row_spans(self):
+        # 数据区域中是否有跨多行的合并（这样的合并无法随行移动）
+        spans = SpanIndex.for_table(self.table).overlapping(self.first_row, 0, self.first_row + self.row_count - 1,
+                                                            self.table.columnCount())
+        return any(row_span > 1 for _, _, row_span, _ in spans)
+
+
+def permute_rows(table, first_row, moves):
+    # 把 first_row 开始的行重新排列：新的第 i 行为原来的第 moves[i] 行，行高和单行的合并随行移动
+    table.setUpdatesEnabled(False)
+    table.blockSignals(True)
+    try:
+        permute = getattr(table, 'permute_rows', None)
+        if permute is not None:
+            permute(first_row, moves.tolist())  # 基于模型的表格直接在列数据中重排
+        else:
+            columns = table.columnCount()
+            items = [[table.takeItem(first_row + int(row), col) for col in range(columns)] for row in moves]
+            for index, row_items in enumerate(items):
+                for col, item in enumerate(row_items):
+                    if item is not None:
+                        table.setItem(first_row + index, col, item)
+        heights = [table.rowHeight(first_row + row) for row in range(len(moves))]
+        for index, row in enumerate(moves):
+            if heights[row] != heights[index]:
+                table.setRowHeight(first_row + index, heights[row])
+        span_index = SpanIndex.for_table(table)
+        if len(span_index):
+            span_index.permute_rows(first_row, moves)
+    finally:
+        table.blockSignals(False)
+        table.setUpdatesEnabled(True)
+
@@ -1,32 +1,107 @@
-import pandas as pd  # 引入pandas库处理数据框
-from PySide6.QtWidgets import QCheckBox, QDialog, QVBoxLayout, QDialogButtonBox, QTableWidgetItem  # 引入PySide6相关组件
-from PySide6.QtGui import QColor, QFont  # 引入颜色和字体相关的类
+import numpy as np
+import pandas as pd
+from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QDialogButtonBox, QLineEdit, QListView,
+                               QPushButton, QLabel)  # 引入PySide6相关组件
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex
+from basic_function.typed_data import typed_dataframe  # 按列类型转换数据
+
+
+# 筛选值列表的模型：只保存不重复值、计数和勾选状态的数组，列表视图只为可见的几十行请求数据，
+# 5 万个不重复值也不需要创建 5 万个复选框。搜索时只改变显示哪些值，勾选状态保持不变
+class FilterValueModel(QAbstractListModel):
+    def __init__(self, values, counts, selected_items, parent=None):
+        super().__init__(parent)
+        values = np.asarray(values, dtype=object)
+        counts = np.asarray(counts)
+        keep = values != ''  # 过滤空白选项
+        self.values = values[keep]
+        self.counts = counts[keep]
+        self.checked = np.isin(self.values, np.asarray(list(selected_items), dtype=object))
+        self.shown = np.arange(len(self.values))  # 当前显示的值（搜索结果）在 values 中的序号
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.shown)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        value = int(self.shown[index.row()])
+        if role == Qt.DisplayRole:
+            return f"{self.values[value]}  ({self.counts[value]})"
+        if role == Qt.CheckStateRole:
+            return Qt.Checked if self.checked[value] else Qt.Unchecked
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.CheckStateRole or not index.isValid():
+            return False
+        self.checked[self.shown[index.row()]] = Qt.CheckState(value) == Qt.Checked
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+        return True
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsUserCheckable
+
+    def search(self, text):
+        # 只显示包含搜索文本（不区分大小写）的值
+        text = text.strip()
+        self.beginResetModel()
+        if text:
+            matches = pd.Series(self.values, dtype=object).str.contains(text, case=False, regex=False)
+            self.shown = np.flatnonzero(matches.to_numpy(dtype=bool))
+        else:
+            self.shown = np.arange(len(self.values))
+        self.endResetModel()
+
+    def set_shown_checked(self, checked):
+        # 全选/全不选只作用于当前显示的值
+        self.checked[self.shown] = checked
+        if len(self.shown):
+            self.dataChanged.emit(self.index(0), self.index(len(self.shown) - 1), [Qt.CheckStateRole])
+
+    def selected_items(self):
+        return self.values[self.checked].tolist()
+
 
 # 定义筛选对话框类，用于创建和管理筛选对话框
 class FilterDialog(QDialog):
-    def __init__(self, column, data, selected_items, parent=None):
+    def __init__(self, column, values, counts, selected_items, parent=None):
         super().__init__(parent)  # 初始化父类
         self.column = column  # 要筛选的列编号
-        self.data = data  # 数据列表
-        self.selected_items = selected_items  # 已选择的筛选项
+        self.model = FilterValueModel(values, counts, selected_items, self)  # 不重复值、计数和勾选状态
         self.init_ui()  # 初始化用户界面
 
     def init_ui(self):
         self.setWindowTitle(f"筛选 列 {self.column + 1}")  # 设置窗口标题
+        self.resize(320, 420)
         layout = QVBoxLayout()  # 使用垂直布局
-        self.checkboxes = []  # 复选框列表
 
-        # 生成数据中的唯一项，过滤空白选项，并排序
-        unique_items = list(set(self.data))
-        unique_items = [item for item in unique_items if item]
-        unique_items.sort()
+        # 搜索框
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("搜索")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.textChanged.connect(self.on_search)
+        layout.addWidget(self.search_edit)
+
+        # 全选/全不选（作用于搜索结果）
+        select_layout = QHBoxLayout()
+        select_all_button = QPushButton("全选")
+        select_all_button.clicked.connect(lambda: self.model.set_shown_checked(True))
+        select_none_button = QPushButton("全不选")
+        select_none_button.clicked.connect(lambda: self.model.set_shown_checked(False))
+        select_layout.addWidget(select_all_button)
+        select_layout.addWidget(select_none_button)
+        select_layout.addStretch()
+        self.count_label = QLabel()
+        select_layout.addWidget(self.count_label)
+        layout.addLayout(select_layout)
 
-        # 为每个唯一项创建一个复选框，并设置是否选中
-        for item in unique_items:
-            checkbox = QCheckBox(item)
-            checkbox.setChecked(item in self.selected_items)
-            layout.addWidget(checkbox)
-            self.checkboxes.append(checkbox)
+        # 值列表：只绘制可见的行
+        self.list_view = QListView()
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setModel(self.model)
+        layout.addWidget(self.list_view)
+        self.update_count_label()
 
         # 添加确定和取消按钮
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
@@ -36,71 +111,26 @@ class FilterDialog(QDialog):
 
         self.setLayout(layout)  # 设置布局
 
+    def on_search(self, text):
+        self.model.search(text)
+        self.update_count_label()
+
+    def update_count_label(self):
+        self.count_label.setText(f"{len(self.model.shown)} / {len(self.model.values)} 项")
+
     def get_selected_items(self):
-        # 返回选中的项
-        return [checkbox.text() for checkbox in self.checkboxes if checkbox.isChecked()]
-
-# 应用筛选条件并排序
-def apply_filters(df, filter_conditions, sort_conditions):
-    filtered_df = df.copy()  # 复制数据框以避免在原数据上进行修改
-    # 根据筛选条件过滤数据
-    for col, selected_items in filter_conditions.items():
-        if selected_items:
-            filtered_df = filtered_df[filtered_df.iloc[:, col].isin(selected_items)]
-    # 根据排序条件排序数据
-    for col, ascending in sort_conditions.items():
-        filtered_df = filtered_df.sort_values(by=filtered_df.columns[col], ascending=ascending)
-    return filtered_df
-
-# 从表格转换数据到 DataFrame
+        # 返回选中的项（包括搜索时没有显示的已选项）
+        return self.model.selected_items()
+
+# 从表格转换数据到 DataFrame：每列按推断或指定的类型保存为数字/日期/分类数据，而不是文本对象
 def table_to_dataframe(table, headers, is_admin):
-    data = []
     start_row = 1 if not is_admin else 0  # 管理员从第0行开始，非管理员从第1行开始
-    # 遍历表格行
-    for row in range(start_row, table.rowCount()):
-        row_data = []
-        # 遍历表格列，读取数据
-        for column in range(table.columnCount()):
+    columns = []
+    # 按列读取数据
+    for column in range(table.columnCount()):
+        values = []
+        for row in range(start_row, table.rowCount()):
             item = table.item(row, column)
-            row_data.append(item.text() if item else '')
-        data.append(row_data)
-    return pd.DataFrame(data, columns=headers)  # 返回DataFrame格式的数据
-
-# 从表格中读取样式并保存到字典
-def table_styles_to_dict(table, start_row):
-    styles = {'colors': {}, 'fonts': {}, 'alignments': {}}
-    for row in range(start_row, table.rowCount()):
-        for col in range(table.columnCount()):
-            item = table.item(row, col)
-            if item:
-                text = item.text()
-                # 保存非白色背景的颜色
-                if item.background().color().name() == '#000000':
-                    styles['colors'][text] = '#ffffff'
-                font = item.font()
-                styles['fonts'][text] = {'bold': font.bold(), 'size': font.pointSize()}
-                styles['alignments'][text] = item.textAlignment()
-    return styles
-
-# 将DataFrame加载回表格，应用样式
-def load_dataframe_to_table(df, table, headers, is_admin, styles):
-    table.setRowCount(len(df) + (1 if not is_admin else 0))
-    start_row = 1 if not is_admin else 0
-    for row in range(len(df)):
-        for col in range(len(df.columns)):
-            item = QTableWidgetItem(df.iloc[row, col])
-            table.setItem(row + start_row, col, item)
-            cell_text = df.iloc[row, col]
-            # 应用保存的样式
-            if cell_text in styles['colors']:
-                item.setBackground(QColor(styles['colors'][cell_text]))
-            else:
-                item.setBackground(QColor('#ffffff'))
-            if cell_text in styles['fonts']:
-                font = QFont()
-                font.setBold(styles['fonts'][cell_text]['bold'])
-                font.setPointSize(styles['fonts'][cell_text]['size'])
-                item.setFont(font)
-            if cell_text in styles['alignments']:
-                item.setTextAlignment(styles['alignments'][cell_text])
-    table.setHorizontalHeaderLabels(headers)  # 设置表头
+            values.append(item.text() if item else '')
+        columns.append(values)
+    return typed_dataframe(columns, headers, getattr(table, 'column_types', {}))  # 返回DataFrame格式的数据
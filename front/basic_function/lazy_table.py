@@ -0,0 +1,91 @@
+from PySide6.QtCore import QObject
+from window.sheet_model import LazySheetModel
+from basic_function.change_tracker import ChangeTracker
+from basic_function.span_index import SpanIndex
+
+# 按需加载的只读表格：打开时只读取第一个行块并显示第一屏，之后表格滚动到哪里就在后台读取哪里的行块，
+# 打开很大的表格与打开小表格一样快。行块缓存在模型的 LRU 中，内存占用有上限。
+# 每个行块带有读取时的版本号，与第一个行块不同（两次滚动之间有人保存）时重新加载，同一视图中不会混有两个版本的行
+
+
+class LazyTableLoader(QObject):
+    def __init__(self, utils, sheet_tasks, table, is_admin, parent=None):
+        super().__init__(parent)
+        self.utils = utils
+        self.sheet_tasks = sheet_tasks
+        self.table = table  # SheetTableView
+        self.is_admin = is_admin
+        self.model = None
+        self.revision = None  # 模型中行块的版本号（第一个行块读取到的版本）
+        sheet_tasks.block_loaded.connect(self.on_block_loaded)
+        sheet_tasks.block_failed.connect(self.on_block_failed)
+        sheet_tasks.revision_checked.connect(self.on_revision_checked)
+
+    def start(self):
+        # （重新）加载：先读取第一个行块，得到行列数、表头、合并和列宽后再建立模型
+        self.model = None
+        self.sheet_tasks.cancel_blocks()
+        self.sheet_tasks.show_status('正在加载...')
+        self.sheet_tasks.fetch_block(0, self.table.default_style())
+
+    def reopen(self):
+        # 重新显示缓存的页面：只查询版本号，数据未变化时保留已缓存的行块，关闭时被取消的行块在显示到时重新读取
+        if self.model is None:
+            return self.start()
+        self.model.pending.clear()
+        self.sheet_tasks.check_revision()
+
+    def refresh(self):
+        # 刷新按钮：同样只查询版本号，数据变化时才丢弃缓存的行块重新读取
+        if self.model is None:
+            return self.start()
+        self.sheet_tasks.show_status('正在检查更新...')
+        self.sheet_tasks.check_revision()
+
+    def on_revision_checked(self, current):
+        if not current:
+            self.start()
+        elif self.model is not None:
+            self.sheet_tasks.show_status('数据已是最新', 3000)
+
+    def request_block(self, block_id):
+        # 模型显示到未缓存的行块时调用
+        self.sheet_tasks.fetch_block(block_id, self.table.default_style())
+
+    def on_block_loaded(self, block_id, result):
+        rows, styles, row_heights, col_widths, revision = result
+        if self.model is None:
+            if block_id != 0:
+                return
+            self.revision = revision
+            self.build_model(rows, col_widths)
+            self.sheet_tasks.show_status('加载完成', 3000)
+        elif revision != self.revision:
+            # 表格在两次读取之间被保存：已显示的行属于旧版本，整体重新加载
+            self.sheet_tasks.show_status('表格已更新，正在重新加载...')
+            return self.start()
+        self.model.add_block(block_id, rows, styles)
+        for row_height in row_heights:
+            if row_height['row'] < self.table.rowCount():
+                self.table.setRowHeight(row_height['row'], row_height['height'])
+
+    def on_block_failed(self, block_id):
+        if self.model is not None:
+            self.model.pending.discard(block_id)  # 之后显示到这些行时重新读取
+
+    def build_model(self, first_rows, col_widths):
+        utils = self.utils
+        # 用户视图与 set_table_data 一致：首行数据用作表头，表格比数据多一行
+        total_rows = utils.rows if self.is_admin else utils.rows + 1
+        self.model = LazySheetModel(total_rows, utils.columns, utils.block_size, self.request_block,
+                                    self.table.default_style(), header_row=not self.is_admin, parent=self.table)
+        self.table.use_model(self.model)
+        if self.is_admin or not first_rows:
+            headers = [str(i+1) for i in range(utils.columns)]
+        else:
+            headers = [first_rows[0][col] if col < len(first_rows[0]) else '' for col in range(utils.columns)]
+        self.table.setHorizontalHeaderLabels(headers)
+        for col_width in col_widths:
+            self.table.setColumnWidth(col_width['col'], col_width['width'])
+        SpanIndex.for_table(self.table).reset(utils.spans)
+        ChangeTracker.for_table(self.table).mark_synced()
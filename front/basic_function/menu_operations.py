@@ -1,14 +1,18 @@
 from PySide6.QtWidgets import QMenu, QTextEdit, QTableWidgetItem
 from PySide6.QtCore import Qt
-from PySide6.QtGui import QColor
+from PySide6.QtGui import QColor, QKeySequence, QShortcut
 from basic_function.basic_operations import BasicOperations
 from basic_function.set_operations import SetOperations
 from basic_function.merge_operations import MergeOperations
+from basic_function.change_tracker import ChangeTracker
+from basic_function.undo_stack import UndoStack
 
 # MenuOperations 类用于管理表格操作的菜单
 class MenuOperations:
     def __init__(self, table):
         self.table = table  # 表格对象
+        self.tracker = ChangeTracker.for_table(table)  # 各操作共享的修改跟踪器
+        self.undo_stack = UndoStack.for_table(table)  # 各操作共享的撤销栈
         # 初始化不同的操作类
         self.basic_operations = BasicOperations(table)
         self.set_operations = SetOperations(table)
@@ -19,6 +23,10 @@ class MenuOperations:
         self.table.setContextMenuPolicy(Qt.CustomContextMenu)
         self.table.customContextMenuRequested.connect(self.open_menu)
 
+        # 撤销/重做快捷键 (Ctrl+Z / Ctrl+Y)
+        self.undo_shortcut = QShortcut(QKeySequence.Undo, self.table, self.undo_stack.undo)
+        self.redo_shortcut = QShortcut(QKeySequence.Redo, self.table, self.undo_stack.redo)
+
         # 用于存储原始和编辑后的文本
         self.original_texts = {}  
         self.edited_texts = {}
@@ -27,6 +35,11 @@ class MenuOperations:
         menu = QMenu()  # 创建右键菜单
 
         # 添加各种操作到菜单
+        undo_action = menu.addAction("撤销")
+        undo_action.setEnabled(self.undo_stack.can_undo())
+        redo_action = menu.addAction("重做")
+        redo_action.setEnabled(self.undo_stack.can_redo())
+        menu.addSeparator()
         clear_action = menu.addAction("清空单元格")
         add_menu = menu.addMenu("添加")
         add_row_above_action = add_menu.addAction("在上方添加行")
@@ -42,6 +55,7 @@ class MenuOperations:
         set_height_action = set_menu.addAction("设置行高")
         set_font_size_action = set_menu.addAction("设置字体大小")
         toggle_bold_action = set_menu.addAction("切换加粗")
+        set_column_type_action = set_menu.addAction("设置列类型")
         align_menu = menu.addMenu("对齐单元格")
         align_left_action = align_menu.addAction("左对齐")
         align_center_action = align_menu.addAction("居中对齐")
@@ -53,7 +67,11 @@ class MenuOperations:
         action = menu.exec(self.table.viewport().mapToGlobal(position))
 
         # 根据用户选择执行相应操作
-        if action == clear_action:
+        if action == undo_action:
+            self.undo_stack.undo()
+        elif action == redo_action:
+            self.undo_stack.redo()
+        elif action == clear_action:
             self.basic_operations.clear_cells()
         elif action in [add_row_above_action, add_row_below_action]:
             self.basic_operations.add_rows(above=(action == add_row_above_action))
@@ -80,6 +98,8 @@ class MenuOperations:
             self.set_operations.set_font_size()
         elif action == toggle_bold_action:
             self.set_operations.toggle_bold()
+        elif action == set_column_type_action:
+            self.set_operations.set_column_type()
         elif action == merge_action:
             self.merge_operations.merge_cells()
         elif action == unmerge_action:
@@ -117,10 +137,13 @@ class MenuOperations:
         if text_edit:
             text = text_edit.toPlainText()
             self.table.removeCellWidget(row, column)
-            new_item = QTableWidgetItem(text)
-            new_item.setBackground(background_color)
-            new_item.setFont(font)
-            new_item.setTextAlignment(alignment)
-            self.table.setItem(row, column, new_item)
+            with self.undo_stack.record('编辑单元格') as step:
+                step.watch_cells([(row, column)])
+                new_item = QTableWidgetItem(text)
+                new_item.setBackground(background_color)
+                new_item.setFont(font)
+                new_item.setTextAlignment(alignment)
+                self.table.setItem(row, column, new_item)
             self.original_texts[(row, column)] = text
             self.edited_texts[(row, column)] = text
+            self.tracker.mark_item(row, column)
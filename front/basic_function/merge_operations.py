@@ -1,10 +1,16 @@
 from PySide6.QtWidgets import QTableWidgetItem
 from PySide6.QtCore import Qt
 from PySide6.QtGui import QColor
+from basic_function.change_tracker import ChangeTracker
+from basic_function.span_index import SpanIndex
+from basic_function.undo_stack import UndoStack
 
 class MergeOperations:
     def __init__(self, table):
         self.table = table
+        self.tracker = ChangeTracker.for_table(table)  # 记录合并/拆分涉及的单元格
+        self.span_index = SpanIndex.for_table(table)  # 已有的合并单元格
+        self.undo_stack = UndoStack.for_table(table)  # 记录每个操作的修改，用于撤销/重做
 
     def merge_cells(self):
         selected_ranges = self.table.selectedRanges()
@@ -20,74 +26,87 @@ class MergeOperations:
         if bottom_row == top_row and right_col == left_col:
             return
 
-        # 查找第一个非空单元格的文本、背景颜色和字体
-        text = ''
-        background_color = QColor("#ffffff")
-        font = self.table.font()
-        found_non_empty = False
-        for col in range(left_col, right_col + 1):
-            for row in range(top_row, bottom_row + 1):
-                item = self.table.item(row, col)
-                if item and item.text().strip():
-                    text = item.text()
-                    background_color = item.background().color()
-                    font = item.font()
-                    found_non_empty = True
-                    break
-            if found_non_empty:
-                break
+        # 与已有合并部分重叠时，扩大区域把这些合并整个包含进来
+        top_row, left_col, bottom_row, right_col = self.span_index.expand(top_row, left_col, bottom_row, right_col)
 
-        # 清空所有选中单元格的文本并保留背景颜色和字体，除了第一个单元格
-        for row in range(top_row, bottom_row + 1):
+        with self.undo_stack.record('合并单元格') as step:
+            step.watch_cells((row, col) for row in range(top_row, bottom_row + 1) for col in range(left_col, right_col + 1))
+            step.watch_spans()
+            # 查找第一个非空单元格的文本、背景颜色和字体
+            text = ''
+            background_color = QColor("#ffffff")
+            font = self.table.font()
+            found_non_empty = False
             for col in range(left_col, right_col + 1):
-                if row == top_row and col == left_col:
-                    continue
-                item = self.table.item(row, col)
-                if not item:
-                    item = QTableWidgetItem()
-                    self.table.setItem(row, col, item)
-                item.setText('')
-                item.setBackground(background_color)
-                item.setFont(font)
-
-        # 设置跨度和在左上角单元格中设置文本
-        self.table.setSpan(top_row, left_col, bottom_row - top_row + 1, right_col - left_col + 1)
-        if not self.table.item(top_row, left_col):
-            self.table.setItem(top_row, left_col, QTableWidgetItem())
-        top_left_item = self.table.item(top_row, left_col)
-        top_left_item.setText(text)
-        top_left_item.setBackground(background_color)
-        top_left_item.setFont(font)
-
-    def unmerge_cells(self):
-        selected_ranges = self.table.selectedRanges()
-        if not selected_ranges:
-            return
-
-        for selected_range in selected_ranges:
-            top_row = selected_range.topRow()
-            left_col = selected_range.leftColumn()
-            bottom_row = selected_range.bottomRow()
-            right_col = selected_range.rightColumn()
-
-            merged_item = self.table.item(top_row, left_col)
-            merged_text = merged_item.text() if merged_item else ''
-            background_color = merged_item.background().color() if merged_item else QColor("#ffffff")
-            font = merged_item.font() if merged_item else self.table.font()
+                for row in range(top_row, bottom_row + 1):
+                    item = self.table.item(row, col)
+                    if item and item.text().strip():
+                        text = item.text()
+                        background_color = item.background().color()
+                        font = item.font()
+                        found_non_empty = True
+                        break
+                if found_non_empty:
+                    break
 
+            # 清空所有选中单元格的文本并保留背景颜色和字体，除了第一个单元格
             for row in range(top_row, bottom_row + 1):
                 for col in range(left_col, right_col + 1):
-                    # 只有当单元格是合并的一部分时才取消合并
-                    if self.table.rowSpan(row, col) > 1 or self.table.columnSpan(row, col) > 1:
-                        self.table.setSpan(row, col, 1, 1)
+                    if row == top_row and col == left_col:
+                        continue
                     item = self.table.item(row, col)
                     if not item:
                         item = QTableWidgetItem()
                         self.table.setItem(row, col, item)
+                    item.setText('')
                     item.setBackground(background_color)
                     item.setFont(font)
-                    item.setFlags(item.flags() | Qt.ItemIsEditable)  # 确保单元格可编辑
-                    if row == top_row and col == left_col:
-                        item.setText(merged_text)
-                    else:
-                        item.setText('')
+                    self.tracker.mark_item(row, col)
+
+            # 设置跨度和在左上角单元格中设置文本
+            self.span_index.merge(top_row, left_col, bottom_row, right_col)  # 区域内原有的合并并入新的合并
+            if not self.table.item(top_row, left_col):
+                self.table.setItem(top_row, left_col, QTableWidgetItem())
+            top_left_item = self.table.item(top_row, left_col)
+            top_left_item.setText(text)
+            top_left_item.setBackground(background_color)
+            top_left_item.setFont(font)
+            self.tracker.mark_item(top_row, left_col)
+            self.tracker.mark_spans()
+
+    def unmerge_cells(self):
+        selected_ranges = self.table.selectedRanges()
+        if not selected_ranges:
+            return
+
+        with self.undo_stack.record('取消合并单元格') as step:
+            step.watch_spans()
+            for selected_range in selected_ranges:
+                top_row = selected_range.topRow()
+                left_col = selected_range.leftColumn()
+                bottom_row = selected_range.bottomRow()
+                right_col = selected_range.rightColumn()
+                step.watch_cells((row, col) for row in range(top_row, bottom_row + 1) for col in range(left_col, right_col + 1))
+
+                merged_item = self.table.item(top_row, left_col)
+                merged_text = merged_item.text() if merged_item else ''
+                background_color = merged_item.background().color() if merged_item else QColor("#ffffff")
+                font = merged_item.font() if merged_item else self.table.font()
+
+                # 只拆分与选区重叠的合并（从合并索引中查找，不逐个单元格检查）
+                self.span_index.unmerge(top_row, left_col, bottom_row, right_col)
+                for row in range(top_row, bottom_row + 1):
+                    for col in range(left_col, right_col + 1):
+                        item = self.table.item(row, col)
+                        if not item:
+                            item = QTableWidgetItem()
+                            self.table.setItem(row, col, item)
+                        item.setBackground(background_color)
+                        item.setFont(font)
+                        item.setFlags(item.flags() | Qt.ItemIsEditable)  # 确保单元格可编辑
+                        if row == top_row and col == left_col:
+                            item.setText(merged_text)
+                        else:
+                            item.setText('')
+                        self.tracker.mark_item(row, col)
+                self.tracker.mark_spans()
@@ -0,0 +1,58 @@
+# RowIds 为表格的每一行保存一个行标识，挂在表格上，随插入/删除行自动调整（监听表格模型的行插入/删除信号，
+# 因此各种插入/删除行的操作都不需要单独处理）。撤销删除行、重做插入行时重新插入的行会先得到新的标识，
+# UndoStack 在插入后把它恢复为原来的标识，否则保存时源表格会把原编号视为已删除，引用它的行随之失去引用。
+# 源表格（assign=True）中新插入的行得到新的编号，编号保存后不再改变，可以被其他表格引用；
+# 引用表格（assign=False）中的行标识是所引用的源表格行编号，新插入的行不引用任何行（None）
+
+
+class RowIds:
+    def __init__(self, table, assign=True):
+        self.table = table
+        self.assign = assign  # 新行是否分配新编号
+        self.next_id = 0  # 下一个可用的编号
+        self.ids = self.new_ids(table.rowCount())
+        self.model = table.model()
+        self.model.rowsInserted.connect(self.on_rows_inserted)
+        self.model.rowsRemoved.connect(self.on_rows_removed)
+        self.model.modelReset.connect(self.on_model_reset)
+        table.destroyed.connect(self.on_table_destroyed)
+
+    @staticmethod
+    def for_table(table, assign=True):
+        # 获取挂在表格上的行标识，没有则创建一个
+        row_ids = getattr(table, 'row_ids', None)
+        if row_ids is None:
+            row_ids = RowIds(table, assign)
+            table.row_ids = row_ids
+        return row_ids
+
+    def new_ids(self, count):
+        if not self.assign:
+            return [None] * count
+        ids = list(range(self.next_id, self.next_id + count))
+        self.next_id += count
+        return ids
+
+    def reset(self, ids, next_id):
+        # 加载表格后调用：ids 为从第 0 行开始的行标识，不足表格行数的部分补上
+        self.next_id = next_id
+        self.ids = list(ids)[:self.table.rowCount()]
+        self.ids.extend(self.new_ids(self.table.rowCount() - len(self.ids)))
+
+    def on_rows_inserted(self, parent, first, last):
+        self.ids[first:first] = self.new_ids(last - first + 1)
+
+    def on_rows_removed(self, parent, first, last):
+        del self.ids[first:last + 1]
+
+    def on_table_destroyed(self):
+        # 表格释放时它的模型随之清空，不再跟踪
+        self.model.rowsInserted.disconnect(self.on_rows_inserted)
+        self.model.rowsRemoved.disconnect(self.on_rows_removed)
+        self.model.modelReset.disconnect(self.on_model_reset)
+
+    def on_model_reset(self):
+        # 模型整体重置（例如批量写入行）后保持与行数一致
+        rows = self.table.rowCount()
+        del self.ids[rows:]
+        self.ids.extend(self.new_ids(rows - len(self.ids)))
@@ -1,46 +1,85 @@
 from PySide6.QtWidgets import QColorDialog, QInputDialog, QTableWidgetItem
 from PySide6.QtCore import Qt
-from PySide6.QtGui import QFont
+from PySide6.QtGui import QColor, QFont
+from basic_function.change_tracker import ChangeTracker
+from basic_function.undo_stack import UndoStack
+from basic_function.column_types import COLUMN_KINDS
 
 # SetOperations 类用于设置表格单元格的颜色、行高、列宽和字体样式
 class SetOperations:
     # 构造函数初始化类，接收表格对象
     def __init__(self, table):
         self.table = table
+        self.tracker = ChangeTracker.for_table(table)  # 记录被修改的样式和行列尺寸
+        self.undo_stack = UndoStack.for_table(table)  # 记录每个操作的修改，用于撤销/重做
 
     # 设置选中单元格的颜色
     def set_cell_color(self):
         color = QColorDialog.getColor()  # 打开颜色选择对话框
         if color.isValid():  # 如果选中的颜色有效
-            for index in self.table.selectedIndexes():  # 遍历所有选中的单元格
-                item = self.table.item(index.row(), index.column())
-                if not item:  # 如果单元格不存在，创建新的单元格
-                    item = QTableWidgetItem()
-                    self.table.setItem(index.row(), index.column(), item)
-                    item.setBackground(QColor('white'))  # 设置默认的白色背景
-                item.setBackground(color)  # 设置单元格的背景颜色
+            indexes = self.table.selectedIndexes()
+            with self.undo_stack.record('设置单元格颜色') as step:
+                step.watch_cells((index.row(), index.column()) for index in indexes)
+                for index in indexes:  # 遍历所有选中的单元格
+                    item = self.table.item(index.row(), index.column())
+                    if not item:  # 如果单元格不存在，创建新的单元格
+                        item = QTableWidgetItem()
+                        self.table.setItem(index.row(), index.column(), item)
+                        item.setBackground(QColor('white'))  # 设置默认的白色背景
+                    item.setBackground(color)  # 设置单元格的背景颜色
+                    self.tracker.mark_style(index.row(), index.column())
 
     # 设置选中行的高度
     def set_row_height(self):
         rows = set(index.row() for index in self.table.selectedIndexes())  # 获取所有选中的行
         height, ok = QInputDialog.getInt(self.table, "Set Row Height", "Enter new row height:", 30, 10, 500, 1)  # 打开输入对话框获取新的行高
         if ok:  # 如果用户点击确认
-            for row in rows:
-                self.table.setRowHeight(row, height)  # 设置行高
+            with self.undo_stack.record('设置行高') as step:
+                step.watch_row_heights(rows)
+                for row in rows:
+                    self.table.setRowHeight(row, height)  # 设置行高
+                    self.tracker.mark_row_height(row)
 
     # 设置选中列的宽度
     def set_col_width(self):
         cols = set(index.column() for index in self.table.selectedIndexes())  # 获取所有选中的列
         width, ok = QInputDialog.getInt(self.table, "Set Column Width", "Enter new column width:", 100, 10, 500, 1)  # 打开输入对话框获取新的列宽
         if ok:  # 如果用户点击确认
-            for col in cols:
-                self.table.setColumnWidth(col, width)  # 设置列宽
+            with self.undo_stack.record('设置列宽') as step:
+                step.watch_col_widths(cols)
+                for col in cols:
+                    self.table.setColumnWidth(col, width)  # 设置列宽
+                    self.tracker.mark_col_width(col)
 
     # 设置选中单元格的字体大小
     def set_font_size(self):
         size, ok = QInputDialog.getInt(self.table, "Set Font Size", "Enter new font size:", 10, 1, 100, 1)  # 打开输入对话框获取新的字体大小
         if ok:  # 如果用户点击确认
-            for index in self.table.selectedIndexes():  # 遍历所有选中的单元格
+            indexes = self.table.selectedIndexes()
+            with self.undo_stack.record('设置字体大小') as step:
+                step.watch_cells((index.row(), index.column()) for index in indexes)
+                for index in indexes:  # 遍历所有选中的单元格
+                    item = self.table.item(index.row(), index.column())
+                    if item is None:  # 如果单元格不存在，创建新的单元格
+                        item = QTableWidgetItem()
+                        self.table.setItem(index.row(), index.column(), item)
+                    widget = self.table.cellWidget(index.row(), index.column())
+                    if widget:  # 如果单元格是一个特殊控件
+                        font = widget.font()  # 获取控件的字体
+                        font.setPointSize(size)  # 设置字体大小
+                        widget.setFont(font)
+                    else:
+                        font = item.font()  # 获取单元格字体
+                        font.setPointSize(size)  # 设置字体大小
+                        item.setFont(font)
+                    self.tracker.mark_style(index.row(), index.column())
+
+    # 切换选中单元格的字体粗体状态
+    def toggle_bold(self):
+        indexes = self.table.selectedIndexes()
+        with self.undo_stack.record('切换加粗') as step:
+            step.watch_cells((index.row(), index.column()) for index in indexes)
+            for index in indexes:  # 遍历所有选中的单元格
                 item = self.table.item(index.row(), index.column())
                 if item is None:  # 如果单元格不存在，创建新的单元格
                     item = QTableWidgetItem()
@@ -48,26 +87,30 @@ class SetOperations:
                 widget = self.table.cellWidget(index.row(), index.column())
                 if widget:  # 如果单元格是一个特殊控件
                     font = widget.font()  # 获取控件的字体
-                    font.setPointSize(size)  # 设置字体大小
+                    font.setBold(not font.bold())  # 切换字体粗体状态
                     widget.setFont(font)
                 else:
                     font = item.font()  # 获取单元格字体
-                    font.setPointSize(size)  # 设置字体大小
+                    font.setBold(not font.bold())  # 切换字体粗体状态
                     item.setFont(font)
+                self.tracker.mark_style(index.row(), index.column())
 
-    # 切换选中单元格的字体粗体状态
-    def toggle_bold(self):
-        for index in self.table.selectedIndexes():  # 遍历所有选中的单元格
-            item = self.table.item(index.row(), index.column())
-            if item is None:  # 如果单元格不存在，创建新的单元格
-                item = QTableWidgetItem()
-                self.table.setItem(index.row(), index.column(), item)
-            widget = self.table.cellWidget(index.row(), index.column())
-            if widget:  # 如果单元格是一个特殊控件
-                font = widget.font()  # 获取控件的字体
-                font.setBold(not font.bold())  # 切换字体粗体状态
-                widget.setFont(font)
-            else:
-                font = item.font()  # 获取单元格字体
-                font.setBold(not font.bold())  # 切换字体粗体状态
-                item.setFont(font)
+    # 设置选中列的数据类型（用于筛选和排序），选择“自动”时按数据推断
+    def set_column_type(self):
+        cols = sorted(set(index.column() for index in self.table.selectedIndexes()))  # 获取所有选中的列
+        if not cols:
+            return
+        names = ['自动'] + list(COLUMN_KINDS.values())
+        name, ok = QInputDialog.getItem(self.table, "设置列类型", "列类型:", names, 0, False)  # 打开选择对话框
+        if ok:  # 如果用户点击确认
+            kinds = {label: kind for kind, label in COLUMN_KINDS.items()}
+            with self.undo_stack.record('设置列类型') as step:
+                step.watch_column_types()
+                column_types = dict(getattr(self.table, 'column_types', {}))
+                for col in cols:
+                    if name in kinds:
+                        column_types[col] = kinds[name]
+                    else:
+                        column_types.pop(col, None)
+                self.table.column_types = column_types
+                self.tracker.mark_column_types()
@@ -0,0 +1,150 @@
+from bisect import bisect_left, bisect_right, insort
+
+# SpanIndex 记录表格中的所有合并单元格，挂在表格上与表格保持同步。
+# 合并按左上角 (行, 列) 保存，并按起始行排序：查找与某个区域重叠的合并只需二分查找起始行落在
+# [区域顶行 - 最大合并行数 + 1, 区域底行] 之间的合并，再比较列范围；加载、保存、清除合并以及插入/删除行列
+# 时的调整都只与合并的数量有关，不需要逐个单元格调用 rowSpan/columnSpan
+
+
+class SpanIndex:
+    def __init__(self, table=None):
+        self.table = table  # 同步修改的表格，为 None 时只维护索引
+        self.spans = {}  # (行, 列) -> (合并行数, 合并列数)
+        self.anchors = []  # 按 (行, 列) 排序的左上角
+        self.max_row_span = 1  # 最大的合并行数，决定重叠查找的范围
+
+    @staticmethod
+    def for_table(table):
+        # 获取挂在表格上的合并索引，没有则创建一个
+        index = getattr(table, 'span_index', None)
+        if index is None:
+            index = SpanIndex(table)
+            table.span_index = index
+        return index
+
+    def __len__(self):
+        return len(self.spans)
+
+    def rebuild(self, spans):
+        # 用 {(行, 列): (行数, 列数)} 重建排序索引（只保存真正合并的单元格）
+        self.spans = {anchor: size for anchor, size in spans.items() if size[0] > 1 or size[1] > 1}
+        self.anchors = sorted(self.spans)
+        self.max_row_span = max((size[0] for size in self.spans.values()), default=1)
+
+    def reset(self, spans):
+        # 加载表格时调用：清除表格原有的合并，设置 spans（数据库中的合并列表）
+        if self.table is not None:
+            self.table.clearSpans()
+        self.rebuild({(span['row'], span['column']): (span['row_span'], span['column_span']) for span in spans})
+        if self.table is not None:
+            for (row, col), (row_span, col_span) in self.spans.items():
+                self.table.setSpan(row, col, row_span, col_span)
+
+    def to_list(self):
+        # 保存到数据库的合并列表，按行、列排序
+        return [{'row': row, 'column': col, 'row_span': self.spans[(row, col)][0], 'column_span': self.spans[(row, col)][1]}
+                for row, col in self.anchors]
+
+    def overlapping(self, top, left, bottom, right):
+        # 返回与区域 [top, bottom] x [left, right] 重叠的合并 [(行, 列, 行数, 列数)]
+        start = bisect_left(self.anchors, (top - self.max_row_span + 1, -1))
+        end = bisect_right(self.anchors, (bottom, float('inf')))
+        result = []
+        for row, col in self.anchors[start:end]:
+            row_span, col_span = self.spans[(row, col)]
+            if row + row_span > top and col <= right and col + col_span > left:
+                result.append((row, col, row_span, col_span))
+        return result
+
+    def span_at(self, row, col):
+        # 包含该单元格的合并，没有则返回 None
+        spans = self.overlapping(row, col, row, col)
+        return spans[0] if spans else None
+
+    def expand(self, top, left, bottom, right):
+        # 把区域扩大到完整包含与它重叠的已有合并，返回扩大后的区域
+        while True:
+            spans = self.overlapping(top, left, bottom, right)
+            expanded = (min([top] + [span[0] for span in spans]), min([left] + [span[1] for span in spans]),
+                        max([bottom] + [span[0] + span[2] - 1 for span in spans]),
+                        max([right] + [span[1] + span[3] - 1 for span in spans]))
+            if expanded == (top, left, bottom, right):
+                return expanded
+            top, left, bottom, right = expanded
+
+    def merge(self, top, left, bottom, right):
+        # 合并区域，与它重叠的已有合并并入新的合并；返回最终的区域
+        top, left, bottom, right = self.expand(top, left, bottom, right)
+        self.unmerge(top, left, bottom, right)
+        self.add(top, left, bottom - top + 1, right - left + 1)
+        return top, left, bottom, right
+
+    def unmerge(self, top, left, bottom, right):
+        # 拆分所有与区域重叠的合并，返回被拆分的合并
+        spans = self.overlapping(top, left, bottom, right)
+        for row, col, _, _ in spans:
+            self.remove(row, col)
+        return spans
+
+    def add(self, row, col, row_span, col_span):
+        if row_span <= 1 and col_span <= 1:
+            return
+        if (row, col) not in self.spans:
+            insort(self.anchors, (row, col))
+        self.spans[(row, col)] = (row_span, col_span)
+        self.max_row_span = max(self.max_row_span, row_span)
+        if self.table is not None:
+            self.table.setSpan(row, col, row_span, col_span)
+
+    def remove(self, row, col):
+        if self.spans.pop((row, col), None) is None:
+            return
+        del self.anchors[bisect_left(self.anchors, (row, col))]
+        if self.table is not None:
+            self.table.setSpan(row, col, 1, 1)
+
+    # 插入/删除行列后调整合并，规则与 QTableView 一致：在合并内部插入会扩大合并，删除会缩小合并，
+    # 整个被删除或缩小到一个单元格的合并被移除。表格自己会调整合并，这里只更新索引
+
+    def insert_rows(self, at, count=1):
+        self.rebuild({(row + count if row >= at else row, col): (row_span + count if row < at < row + row_span else row_span, col_span)
+                      for (row, col), (row_span, col_span) in self.spans.items()})
+
+    def insert_columns(self, at, count=1):
+        self.rebuild({(row, col + count if col >= at else col): (row_span, col_span + count if col < at < col + col_span else col_span)
+                      for (row, col), (row_span, col_span) in self.spans.items()})
+
+    def remove_rows(self, at, count=1):
+        spans = {}
+        for (row, col), (row_span, col_span) in self.spans.items():
+            row, row_span = shrink(row, row_span, at, count)
+            if row_span > 0:
+                spans[(row, col)] = (row_span, col_span)
+        self.rebuild(spans)
+
+    def permute_rows(self, first_row, moves):
+        # 行重新排列（排序）后调整合并：新的第 first_row + i 行为原来的第 first_row + moves[i] 行。
+        # 只有不跨行的合并能随行移动，调用前需确认排列范围内没有跨多行的合并
+        new_row = {first_row + int(row): first_row + index for index, row in enumerate(moves)}
+        spans = [{'row': new_row.get(row, row), 'column': col, 'row_span': row_span, 'column_span': col_span}
+                 for (row, col), (row_span, col_span) in self.spans.items()]
+        self.reset(spans)
+
+    def remove_columns(self, at, count=1):
+        spans = {}
+        for (row, col), (row_span, col_span) in self.spans.items():
+            col, col_span = shrink(col, col_span, at, count)
+            if col_span > 0:
+                spans[(row, col)] = (row_span, col_span)
+        self.rebuild(spans)
+
+
+def shrink(start, length, at, count):
+    # 删除 [at, at + count) 后，从 start 开始、长度为 length 的区间的新起点和长度（长度为 0 表示整个被删除）
+    end = start + length
+    removed = max(0, min(end, at + count) - max(start, at))
+    if start >= at + count:
+        start -= count
+    elif start > at:
+        start = at
+    return start, length - removed
@@ -0,0 +1,107 @@
+# 紧凑样式编码：
+#   style_palette    样式表，每种不同的 (颜色, 加粗, 字号, 对齐) 组合只保存一次
+#   style_runs       [行, 起始列, 连续列数, 样式编号]，只记录与默认样式不同的单元格，同一行中相邻的相同样式合并为一段
+#   row_height_runs  [起始行, 连续行数, 行高]，只记录与默认行高不同的行
+# 旧格式（每个单元格一条 colors/fonts/alignments 记录）仍可读取
+
+DEFAULT_COLOR = '#ffffff'
+
+
+class StylePalette:
+    def __init__(self, entries=None):
+        self.entries = [dict(entry) for entry in (entries or [])]
+        self.index = {self.entry_key(entry): style_id for style_id, entry in enumerate(self.entries)}
+
+    @staticmethod
+    def entry_key(entry):
+        return (entry['color'], entry['bold'], entry['size'], entry['alignment'])
+
+    def intern(self, style_key):
+        # 返回样式编号，样式表中不存在时追加
+        style_id = self.index.get(style_key)
+        if style_id is None:
+            color, bold, size, alignment = style_key
+            style_id = len(self.entries)
+            self.entries.append({'color': color, 'bold': bold, 'size': size, 'alignment': alignment})
+            self.index[style_key] = style_id
+        return style_id
+
+
+class OperationPalette:
+    # 增量保存使用的样式表：已保存的样式沿用其编号，新样式不写入共享的样式表，而是随操作一起保存，
+    # 编号记为负数 -1, -2, ...（操作中的第几个新样式），读取时由 apply_operation 追加到样式表并换成实际编号，
+    # 多个客户端同时增加样式时不会分配到相同的编号
+    def __init__(self, palette):
+        self.palette = palette
+        self.entries = []  # 本次操作新增的样式
+        self.index = {}
+
+    def intern(self, style_key):
+        style_id = self.palette.index.get(style_key)
+        if style_id is None:
+            style_id = self.index.get(style_key)
+            if style_id is None:
+                self.entries.append(style_to_dict(style_key))
+                style_id = self.index[style_key] = -len(self.entries)
+        return style_id
+
+
+def alignment_value(alignment):
+    # 对齐方式可能是整数或 Qt 枚举，统一转换为整数以便比较和存入数据库
+    return alignment if isinstance(alignment, int) else alignment.value
+
+
+def style_to_dict(style_key):
+    color, bold, size, alignment = style_key
+    return {'color': color, 'bold': bold, 'size': size, 'alignment': alignment}
+
+
+def encode_style_runs(row, style_ids):
+    # style_ids 为一行中每列的样式编号，None 表示默认样式
+    runs = []
+    col = 0
+    while col < len(style_ids):
+        style_id = style_ids[col]
+        if style_id is None:
+            col += 1
+            continue
+        start = col
+        while col < len(style_ids) and style_ids[col] == style_id:
+            col += 1
+        runs.append([row, start, col - start, style_id])
+    return runs
+
+
+def encode_row_height_runs(heights, default_height, first_row=0):
+    # heights 为从 first_row 开始的连续行高
+    runs = []
+    row = 0
+    while row < len(heights):
+        height = heights[row]
+        start = row
+        while row < len(heights) and heights[row] == height:
+            row += 1
+        if height != default_height:
+            runs.append([first_row + start, row - start, height])
+    return runs
+
+
+def decode_style_runs(style_runs, palette_entries, default_style, colors, fonts, alignments):
+    # 把样式段展开到 colors/fonts/alignments 字典中，只展开与默认样式不同的属性
+    for row, start, length, style_id in style_runs:
+        if style_id >= len(palette_entries):
+            continue
+        entry = palette_entries[style_id]
+        for col in range(start, start + length):
+            if entry['color'] != default_style['color']:
+                colors[(row, col)] = entry['color']
+            if entry['bold'] != default_style['bold'] or entry['size'] != default_style['size']:
+                fonts[(row, col)] = {'bold': entry['bold'], 'size': entry['size']}
+            if entry['alignment'] != default_style['alignment']:
+                alignments[(row, col)] = entry['alignment']
+
+
+def decode_row_height_runs(row_height_runs):
+    return [{'row': row, 'height': height}
+            for start, count, height in row_height_runs
+            for row in range(start, start + count)]
@@ -0,0 +1,96 @@
+import math
+import re
+import numpy as np
+import pandas as pd
+from basic_function.column_types import COLUMN_KINDS
+
+# 按列类型把一列文本转换为 NumPy 数组或分类数据（筛选、排序使用），只在显示（筛选项）时才转换回文本
+
+CATEGORY_RATIO = 0.5  # 不重复值不超过非空值数量的这个比例时视为分类列
+INTEGER_PATTERN = r'[+-]?\d+'
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1  # 超出 int64 的整数（例如很长的编号）不能按整数处理
+
+
+def parse_int(text):
+    # 把一个文本精确地转换为 int64 范围内的整数（不经过 float，长编号不会丢失精度）；
+    # 小数四舍五入，无法转换或超出范围时返回 None
+    if re.fullmatch(INTEGER_PATTERN, text):
+        value = int(text)
+    else:
+        try:
+            number = float(text)
+        except ValueError:
+            return None
+        if not math.isfinite(number):
+            return None
+        value = round(number)
+    return value if INT64_MIN <= value <= INT64_MAX else None
+
+
+def infer_kind(values):
+    # 根据列中的文本推断类型；只检查不重复的非空值
+    text = pd.Series(values, dtype=object).astype(str).str.strip()
+    present = text[text != '']
+    if present.empty:
+        return 'text'
+    uniques = pd.Series(present.unique(), dtype=object)
+    if uniques.str.fullmatch(INTEGER_PATTERN).all():
+        # 全是整数，但超出 int64 的（长编号）按文本/分类处理，不按小数处理：float 会把不同的编号合并为同一个值
+        if all(INT64_MIN <= int(value) <= INT64_MAX for value in uniques):
+            return 'int'
+        return 'category' if len(uniques) <= CATEGORY_RATIO * len(present) else 'text'
+    if pd.to_numeric(uniques, errors='coerce').notna().all():
+        return 'float'
+    if pd.to_datetime(uniques, errors='coerce', format='mixed').notna().all():
+        return 'date'
+    if len(uniques) <= CATEGORY_RATIO * len(present):
+        return 'category'
+    return 'text'
+
+
+def to_typed(values, kind):
+    # 把一列文本转换为指定类型；空值和无法转换的值为缺失值
+    text = pd.Series(values, dtype=object)
+    if kind in ('int', 'float', 'date'):
+        stripped = text.astype(str).str.strip()
+        stripped = stripped.where(stripped != '')
+        if kind == 'date':
+            return pd.to_datetime(stripped, errors='coerce', format='mixed')
+        if kind == 'float':
+            return pd.to_numeric(stripped, errors='coerce').astype(float)
+        # 整数逐个不重复值精确转换，有空值时使用可空整数
+        parsed = {value: parse_int(value) for value in stripped.dropna().unique()}
+        numbers = pd.Series(pd.array([parsed.get(value) for value in stripped], dtype='Int64'), index=text.index)
+        if numbers.isna().any():
+            return numbers
+        return numbers.astype(np.int64)
+    if kind == 'category':
+        return text.astype('category')
+    return text
+
+
+def typed_column(values, kind=None):
+    # 按指定类型转换一列文本，没有指定（或类型无效）时自动推断
+    if kind not in COLUMN_KINDS:
+        kind = infer_kind(values)
+    return to_typed(values, kind).reset_index(drop=True)
+
+
+def typed_dataframe(columns, headers, overrides=None):
+    # columns 为每列的文本列表；overrides 为 {列号: 类型}，没有指定的列自动推断
+    overrides = overrides or {}
+    data = {}
+    for col, values in enumerate(columns):
+        data[headers[col]] = typed_column(values, overrides.get(col))
+    return pd.DataFrame(data, columns=headers) if data else pd.DataFrame(columns=headers)
+
+
+def value_labels(uniques):
+    # 把不重复的值转换回显示用的文本（筛选项）
+    if isinstance(uniques, pd.DatetimeIndex):
+        has_time = (uniques != uniques.normalize()).any()
+        return np.asarray(uniques.strftime('%Y-%m-%d %H:%M:%S' if has_time else '%Y-%m-%d'), dtype=object)
+    values = np.asarray(uniques, dtype=object)
+    if len(values) and pd.api.types.is_float_dtype(uniques):
+        return np.array(['%.15g' % value for value in values], dtype=object)
+    return np.array([str(value) for value in values], dtype=object)
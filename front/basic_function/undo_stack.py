@@ -0,0 +1,313 @@
+import os
+import sys
+import time
+from contextlib import contextmanager
+from PySide6.QtWidgets import QTableWidgetItem
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QColor, QFont
+from basic_function.change_tracker import ChangeTracker
+from basic_function.span_index import SpanIndex
+from basic_function.style_codec import alignment_value
+from basic_function.column_types import shift_column_types
+
+# 撤销/重做：每个编辑操作记录为一步，只保存被修改部分的前后差异（单元格状态、行高列宽、插入/删除的行列、合并、列类型），
+# 不保存整张表格，撤销一次修改 1 万个单元格颜色的操作只需恢复这 1 万个单元格。
+# 连续的小编辑（例如逐个修改单元格）合并为一步；所有步骤的内存估计超过上限时丢弃最早的步骤
+
+UNDO_MEMORY_LIMIT = int(os.environ.get('KPI_UNDO_MEMORY_MB', 32)) * 1024 * 1024  # 撤销记录占用内存的上限（字节）
+MERGE_WINDOW = 2.0  # 同一种小编辑在这个时间（秒）内连续发生时合并为一步
+SMALL_EDIT_CELLS = 1  # 不超过这个单元格数的编辑视为小编辑
+CELL_COST = 160  # 每个单元格记录的估计内存（不含文本）
+
+
+def cell_state(table, row, col):
+    # 单元格的完整状态 (文本, 背景颜色, 加粗, 字号, 对齐, 可编辑)；没有单元格项时为 None，未设置背景时颜色为 None
+    item = table.item(row, col)
+    if item is None:
+        return None
+    background = item.background()
+    color = background.color().name() if background.style() != Qt.NoBrush else None
+    font = item.font()
+    return (item.text(), color, font.bold(), font.pointSize(), alignment_value(item.textAlignment()),
+            bool(item.flags() & Qt.ItemIsEditable))
+
+
+def restore_cell(table, row, col, state):
+    if state is None:
+        take_item = getattr(table, 'takeItem', None)
+        if take_item is not None:
+            take_item(row, col)
+        else:
+            table.setItem(row, col, QTableWidgetItem())
+        return
+    text, color, bold, size, alignment, editable = state
+    item = QTableWidgetItem(text)
+    if color is not None:
+        item.setBackground(QColor(color))
+    font = QFont()
+    font.setBold(bold)
+    if size > 0:
+        font.setPointSize(size)
+    item.setFont(font)
+    item.setTextAlignment(Qt.Alignment(alignment))
+    if not editable:
+        item.setFlags(item.flags() & ~Qt.ItemIsEditable)
+    table.setItem(row, col, item)
+
+
+def row_id_at(table, axis, index):
+    # 行的行标识（表格有 RowIds 时），撤销删除行/重做插入行时恢复为原来的标识，而不是分配新的编号
+    row_ids = getattr(table, 'row_ids', None)
+    return row_ids.ids[index] if axis == 'row' and row_ids is not None else None
+
+
+def state_cost(state):
+    return CELL_COST + (sys.getsizeof(state[0]) if state else 0)
+
+
+class UndoStep:
+    # 一步操作的差异：单元格 {(行, 列): (修改前, 修改后)}、行高/列宽 {行或列: (修改前, 修改后)}、
+    # 按顺序发生的行列插入/删除，以及操作前后的合并列表和列类型设置（只在发生变化时保存）
+    def __init__(self, table, label):
+        self.table = table
+        self.label = label
+        self.time = time.monotonic()
+        self.cells = {}
+        self.row_heights = {}
+        self.col_widths = {}
+        self.structure = []  # (是否插入, 'row'/'column', 位置, 该行/列的单元格状态, 行高/列宽, 行标识)
+        self.spans = None  # (修改前, 修改后)
+        self.watch_spans_before = None
+        self.column_types = None  # (修改前, 修改后)
+        self.watch_column_types_before = None
+        self.cost = 0
+        self.mergeable = False
+
+    # ---- 记录：在修改之前调用 watch_*，修改之后由 UndoStack.end 读取修改后的状态 ----
+
+    def watch_cells(self, cells):
+        for row, col in cells:
+            if (row, col) not in self.cells:
+                self.cells[(row, col)] = (cell_state(self.table, row, col), None)
+
+    def watch_row_heights(self, rows):
+        for row in rows:
+            self.row_heights.setdefault(row, (self.table.rowHeight(row), None))
+
+    def watch_col_widths(self, cols):
+        for col in cols:
+            self.col_widths.setdefault(col, (self.table.columnWidth(col), None))
+
+    def watch_spans(self):
+        if self.watch_spans_before is None:
+            self.watch_spans_before = SpanIndex.for_table(self.table).to_list()
+
+    def watch_column_types(self):
+        if self.watch_column_types_before is None:
+            self.watch_column_types_before = dict(getattr(self.table, 'column_types', {}))
+
+    def removing(self, axis, index):
+        # 在删除一行/一列之前调用，保存它的内容以便撤销时恢复
+        if axis == 'row':
+            states = [cell_state(self.table, index, col) for col in range(self.table.columnCount())]
+            size = self.table.rowHeight(index)
+        else:
+            states = [cell_state(self.table, row, index) for row in range(self.table.rowCount())]
+            size = self.table.columnWidth(index)
+        self.structure.append((False, axis, index, states, size, row_id_at(self.table, axis, index)))
+
+    def inserted(self, axis, index):
+        # 在插入一行/一列并填充内容之后调用，保存新行/列的内容以便重做
+        if axis == 'row':
+            states = [cell_state(self.table, index, col) for col in range(self.table.columnCount())]
+            size = self.table.rowHeight(index)
+        else:
+            states = [cell_state(self.table, row, index) for row in range(self.table.rowCount())]
+            size = self.table.columnWidth(index)
+        self.structure.append((True, axis, index, states, size, row_id_at(self.table, axis, index)))
+
+    def finish(self):
+        # 读取修改后的状态，去掉没有变化的记录；返回这一步是否有修改
+        self.cells = {cell: (before, cell_state(self.table, *cell)) for cell, (before, _) in self.cells.items()
+                      if cell[0] < self.table.rowCount() and cell[1] < self.table.columnCount()}
+        self.cells = {cell: states for cell, states in self.cells.items() if states[0] != states[1]}
+        self.row_heights = {row: (before, self.table.rowHeight(row)) for row, (before, _) in self.row_heights.items()}
+        self.row_heights = {row: sizes for row, sizes in self.row_heights.items() if sizes[0] != sizes[1]}
+        self.col_widths = {col: (before, self.table.columnWidth(col)) for col, (before, _) in self.col_widths.items()}
+        self.col_widths = {col: sizes for col, sizes in self.col_widths.items() if sizes[0] != sizes[1]}
+        if self.watch_spans_before is not None:
+            after = SpanIndex.for_table(self.table).to_list()
+            if after != self.watch_spans_before:
+                self.spans = (self.watch_spans_before, after)
+            self.watch_spans_before = None
+        if self.watch_column_types_before is not None:
+            after = dict(getattr(self.table, 'column_types', {}))
+            if after != self.watch_column_types_before:
+                self.column_types = (self.watch_column_types_before, after)
+            self.watch_column_types_before = None
+        self.cost = (sum(state_cost(before) + state_cost(after) for before, after in self.cells.values())
+                     + 64 * (len(self.row_heights) + len(self.col_widths))
+                     + sum(CELL_COST * len(states) for _, _, _, states, _, _ in self.structure)
+                     + CELL_COST * sum(len(spans) for spans in (self.spans or ())))
+        return bool(self.cells or self.row_heights or self.col_widths or self.structure or self.spans
+                    or self.column_types)
+
+    def is_small(self):
+        return (len(self.cells) <= SMALL_EDIT_CELLS and not self.row_heights and not self.col_widths
+                and not self.structure and not self.spans and not self.column_types)
+
+    def absorb(self, step):
+        # 把紧接着的小编辑合并到这一步：每个单元格保留最早的修改前状态和最新的修改后状态
+        for cell, (before, after) in step.cells.items():
+            if cell in self.cells:
+                before = self.cells[cell][0]
+            self.cells[cell] = (before, after)
+        self.cells = {cell: states for cell, states in self.cells.items() if states[0] != states[1]}
+        self.cost = sum(state_cost(before) + state_cost(after) for before, after in self.cells.values())
+        self.time = step.time
+
+    # ---- 撤销/重做 ----
+
+    def apply(self, undo):
+        table = self.table
+        tracker = ChangeTracker.for_table(table)
+        span_index = SpanIndex.for_table(table)
+        side = 0 if undo else 1
+        table.setUpdatesEnabled(False)
+        try:
+            # 行列结构：撤销时按相反顺序执行相反的操作
+            for inserted, axis, index, states, size, row_id in (reversed(self.structure) if undo else self.structure):
+                if inserted != undo:
+                    self.insert(axis, index, states, size, row_id)
+                else:
+                    if axis == 'row':
+                        table.removeRow(index)
+                        span_index.remove_rows(index)
+                    else:
+                        table.removeColumn(index)
+                        span_index.remove_columns(index)
+                        shift_column_types(table, index, -1)
+                tracker.mark_structure()
+            for (row, col), states in self.cells.items():
+                restore_cell(table, row, col, states[side])
+                tracker.mark_item(row, col)
+            for row, sizes in self.row_heights.items():
+                table.setRowHeight(row, sizes[side])
+                tracker.mark_row_height(row)
+            for col, sizes in self.col_widths.items():
+                table.setColumnWidth(col, sizes[side])
+                tracker.mark_col_width(col)
+            # 合并最后恢复，覆盖行列操作对合并的调整
+            if self.spans is not None:
+                span_index.reset(self.spans[side])
+                tracker.mark_spans()
+            # 列类型同样最后恢复，覆盖插入/删除列时的平移
+            if self.column_types is not None:
+                table.column_types = dict(self.column_types[side])
+                tracker.mark_column_types()
+        finally:
+            table.setUpdatesEnabled(True)
+
+    def insert(self, axis, index, states, size, row_id=None):
+        table = self.table
+        if axis == 'row':
+            table.insertRow(index)
+            row_ids = getattr(table, 'row_ids', None)
+            if row_ids is not None:
+                row_ids.ids[index] = row_id  # 插入时 RowIds 分配了新编号，恢复为删除前（或第一次插入时）的标识
+            SpanIndex.for_table(table).insert_rows(index)
+            for col, state in enumerate(states):
+                restore_cell(table, index, col, state)
+            table.setRowHeight(index, size)
+        else:
+            table.insertColumn(index)
+            SpanIndex.for_table(table).insert_columns(index)
+            shift_column_types(table, index, 1)
+            for row, state in enumerate(states):
+                restore_cell(table, row, index, state)
+            table.setColumnWidth(index, size)
+
+
+class UndoStack:
+    def __init__(self, table, memory_limit=UNDO_MEMORY_LIMIT):
+        self.table = table
+        self.memory_limit = memory_limit
+        self.undo_steps = []
+        self.redo_steps = []
+        self.current = None  # 正在记录的一步
+        self.depth = 0  # 嵌套记录的层数（例如一个操作内部调用另一个操作）
+
+    @staticmethod
+    def for_table(table):
+        # 获取挂在表格上的撤销栈，没有则创建一个
+        stack = getattr(table, 'undo_stack', None)
+        if stack is None:
+            stack = UndoStack(table)
+            table.undo_stack = stack
+        return stack
+
+    def begin(self, label):
+        # 开始记录一步操作，返回 UndoStep；嵌套调用时记录到外层的一步中
+        if self.current is None:
+            self.current = UndoStep(self.table, label)
+        self.depth += 1
+        return self.current
+
+    @contextmanager
+    def record(self, label):
+        # with undo_stack.record('操作名') as step: 在修改前调用 step.watch_*，结束时生成一步撤销记录
+        step = self.begin(label)
+        try:
+            yield step
+        finally:
+            self.end()
+
+    def end(self):
+        self.depth -= 1
+        if self.depth > 0:
+            return
+        step, self.current = self.current, None
+        if not step.finish():
+            return
+        self.redo_steps = []
+        last = self.undo_steps[-1] if self.undo_steps else None
+        if (last is not None and step.is_small() and last.mergeable and last.label == step.label
+                and step.time - last.time <= MERGE_WINDOW):
+            last.absorb(step)
+        else:
+            step.mergeable = step.is_small()  # 由小编辑开始的一步可以继续合并后面的小编辑
+            self.undo_steps.append(step)
+        self.enforce_limit()
+
+    def enforce_limit(self):
+        # 超过内存上限时从最早的步骤开始丢弃
+        total = sum(step.cost for step in self.undo_steps) + sum(step.cost for step in self.redo_steps)
+        while self.undo_steps and total > self.memory_limit:
+            total -= self.undo_steps.pop(0).cost
+        if total > self.memory_limit:
+            self.redo_steps = []
+
+    def can_undo(self):
+        return bool(self.undo_steps)
+
+    def can_redo(self):
+        return bool(self.redo_steps)
+
+    def undo(self):
+        if not self.undo_steps:
+            return
+        step = self.undo_steps.pop()
+        step.apply(undo=True)
+        self.redo_steps.append(step)
+
+    def redo(self):
+        if not self.redo_steps:
+            return
+        step = self.redo_steps.pop()
+        step.apply(undo=False)
+        self.undo_steps.append(step)
+
+    def clear(self):
+        # 表格重新加载后之前的记录不再适用
+        self.undo_steps = []
+        self.redo_steps = []
@@ -1,127 +1,366 @@
-import pandas as pd  # 引入pandas库，用于数据处理
+import copy
+import os
 from PySide6.QtWidgets import QTableWidgetItem  # 引入Qt的表格单元项
 from PySide6.QtGui import QColor, QFont  # 引入颜色和字体处理工具
-from window.database import MongoDBClient  # 从项目的database模块引入MongoDBClient类
+from PySide6.QtCore import Qt  # 引入Qt常量（对齐方式等）
+from window.database import MongoDBClient, BLOCK_SIZE, make_operation, apply_operations  # 从项目的database模块引入MongoDBClient类和行块大小
+from window.edit_journal import get_edit_journal  # 本地预写日志，保存尚未提交到服务器的修改
+from basic_function.change_tracker import ChangeTracker  # 引入修改跟踪器，用于增量保存
+from basic_function.span_index import SpanIndex  # 合并单元格索引
+from basic_function.undo_stack import UndoStack  # 撤销/重做记录
+from basic_function.row_ids import RowIds  # 行标识（被引用的源表格和引用表格使用）
+from basic_function.column_types import encode_column_types, decode_column_types  # 按列指定的数据类型
+from basic_function.style_codec import (StylePalette, OperationPalette, DEFAULT_COLOR, alignment_value, style_to_dict, encode_style_runs,
+                                        encode_row_height_runs, decode_style_runs, decode_row_height_runs)  # 紧凑样式编码
 
 # 设置默认行数、列数和表头
 DEFAULT_ROWS = 10
 DEFAULT_COLUMNS = 11
 DEFAULT_HEADERS = [str(i+1) for i in range(DEFAULT_COLUMNS)]  # 生成从1开始的列编号作为表头
+QUERY_PAGE_SIZE = 200  # 服务器端筛选每次返回的行数
+QUERY_MODE_ROWS = int(os.environ.get('KPI_QUERY_MODE_ROWS', 20000))  # 只读视图中数据行数超过此值的表格在服务器端分页筛选，不下载整张表格
+# 读取并解码表格时设置的属性，把预取的表格交给页面时一起复制
+DECODED_FIELDS = ('rows', 'columns', 'headers', 'spans', 'column_types', 'block_size', 'style_palette', 'default_style',
+                  'default_row_height', 'row_ids', 'next_row_id', 'revision', 'has_document')
 
 # 定义PageUtils类，用于页面数据的加载和存储
 class PageUtils:
-    def __init__(self, collection_name):
+    # row_ids: None 不保存行标识；'source' 为每行分配固定编号（可被其他表格引用）；'reference' 每行保存所引用的源表格行编号
+    # projections: 引用本表格行的表格，本表格保存后把被引用行的新内容写入这些表格
+    def __init__(self, collection_name, row_ids=None, projections=()):
         self.db_client = MongoDBClient()  # 实例化数据库客户端
         self.collection_name = collection_name  # 设置要操作的集合名称
+        self.row_id_mode = row_ids
+        self.projections = tuple(projections)
+        self.row_ids = []  # 已保存的数据行的行标识
+        self.next_row_id = 0  # 源表格下一个可用的行编号
+        self.journal = get_edit_journal(self.db_client.snapshot_key(collection_name))  # 尚未提交到服务器的修改（同一表格共享）
+        self.editing = False  # 是否为编辑该表格的页面：只有编辑页面叠加本地日志，只读视图只显示已提交的数据
         self.rows = DEFAULT_ROWS  # 初始化行数
         self.columns = DEFAULT_COLUMNS  # 初始化列数
         self.headers = DEFAULT_HEADERS  # 初始化表头
         self.spans = []  # 初始化单元格合并信息列表
+        self.column_types = {}  # 按列指定的数据类型 {列号: 类型}，没有指定的列自动推断
+        self.has_document = False  # 数据库中是否已有该集合的文档，没有文档时只能整表保存
+        self.block_size = BLOCK_SIZE  # 数据库中每个行块包含的行数
+        self.style_palette = StylePalette()  # 已保存的样式表
+        self.default_style = None  # 已保存文档使用的默认样式 (颜色, 加粗, 字号, 对齐)，旧格式文档为 None
+        self.default_row_height = None  # 已保存文档使用的默认行高
+        self.revision = None  # 表格当前显示的数据版本号，None 表示尚未加载或版本未知
 
-    def load_data_from_db(self):
-        # 从数据库加载数据
-        data = self.db_client.get_data(self.collection_name)
+    def empty_table_data(self):
+        # 数据库中没有数据时返回的空数据结构
+        return (
+            [['' for _ in range(self.columns)] for _ in range(self.rows)],
+            {'': '#ffffff'},  # 默认颜色为白色
+            {'': {'bold': False, 'size': 10}},  # 默认字体为非粗体，大小为10
+            {'': Qt.AlignCenter},  # 默认居中对齐
+            [],  # 默认行高
+            []   # 默认列宽
+        )
+
+    def load_data_from_db(self, block_ids=None, progress=None):
+        # 从数据库加载数据，block_ids 为 None 时加载全部行块；progress 用于后台加载时汇报进度
+        data = self.db_client.load_sheet(self.collection_name, block_ids, progress)
+        if block_ids is None:
+            self.revision = data.get('revision', 0) if data else None
+            data = self.apply_journal(data)  # 叠加本地尚未提交的修改
+        else:
+            # 按需加载的表格以第一个行块的版本为准，之后读取的行块与它比对（见 load_block）
+            self.revision = data.get('revision', 0) if data else None
+        self.has_document = bool(data)
         if not data:
             # 如果没有数据，则返回空的数据结构
-            return (
-                [['' for _ in range(self.columns)] for _ in range(self.rows)],
-                {'': '#ffffff'},  # 默认颜色为白色
-                {'': {'bold': False, 'size': 10}},  # 默认字体为非粗体，大小为10
-                {'': Qt.AlignCenter},  # 默认居中对齐
-                [],  # 默认行高
-                []   # 默认列宽
-            )
+            return self.empty_table_data()
+        return self.decode_document(data)
+
+    def load_snapshot(self):
+        # 从本地磁盘快照加载上次的数据（不访问服务器），没有快照时返回 None
+        # 版本号取自快照，之后的刷新会与服务器比对并在需要时重新加载
+        data = self.db_client.load_snapshot(self.collection_name)
+        if not data:
+            return None
+        self.has_document = True
+        self.revision = data.get('revision', 0)
+        return self.decode_document(self.apply_journal(data))
 
+    def detached(self):
+        # 后台读取使用的副本：读取和解码只修改副本的属性，完成后由界面线程 adopt 回来，
+        # 界面线程在保存时读取的行列数、合并、样式表和版本号不会被后台线程同时修改
+        return copy.copy(self)
+
+    def adopt(self, other):
+        # 使用另一个 PageUtils（登录后预取）读取并解码的表格状态，之后像本对象加载的一样保存和刷新
+        for name in DECODED_FIELDS:
+            setattr(self, name, getattr(other, name))
+
+    def apply_journal(self, data):
+        # 把本地日志中尚未提交到服务器的修改（例如程序崩溃前的编辑）叠加到读取的数据上
+        if not self.editing:
+            return data
+        for entry in self.journal.entries():
+            if entry['kind'] == 'replace':
+                data = dict(entry['payload'], revision=data.get('revision', 0) if data else 0)
+            elif data:
+                data = apply_operations(data, [entry['payload']])
+        return data
+
+    def decode_document(self, data):
         # 加载各种数据属性
         self.rows = data.get('rows', DEFAULT_ROWS)
         self.columns = data.get('columns', DEFAULT_COLUMNS)
         self.headers = data.get('headers', DEFAULT_HEADERS)
         self.spans = data.get('spans', [])
+        self.column_types = decode_column_types(data.get('column_types'))
+        self.block_size = data.get('block_size', BLOCK_SIZE)
+        self.style_palette = StylePalette(data.get('style_palette'))
+        default_style = data.get('default_style')
+        self.default_style = StylePalette.entry_key(default_style) if default_style else None
+        self.default_row_height = data.get('default_row_height')
 
-        # 转换数据为更易于处理的格式
+        # 转换数据为更易于处理的格式（旧格式的逐单元格记录和紧凑格式的样式段都要读取）
         table_data = data.get("data", [['' for _ in range(self.columns)] for _ in range(self.rows)])
-        colors = {(color['row'], color['column']): color['color'] for color in data.get("colors", [])}
-        fonts = {(font['row'], font['column']): font for font in data.get("fonts", [])}
-        alignments = {(alignment['row'], alignment['column']): alignment['alignment'] for alignment in data.get("alignments", [])}
-        row_heights = data.get("row_heights", [])
-        col_widths = data.get("col_widths", [])
+        if self.row_id_mode:
+            self.decode_row_ids(data, len(table_data))
+        colors = {(color['row'], color['column']): color['color'] for color in data.get("colors", []) if 'row' in color and 'column' in color}
+        fonts = {(font['row'], font['column']): font for font in data.get("fonts", []) if 'row' in font and 'column' in font}
+        alignments = {(alignment['row'], alignment['column']): alignment['alignment'] for alignment in data.get("alignments", []) if 'row' in alignment and 'column' in alignment}
+        if default_style:
+            decode_style_runs(data.get("style_runs", []), self.style_palette.entries, default_style, colors, fonts, alignments)
+        row_heights = [row_height for row_height in data.get("row_heights", []) if row_height]
+        row_heights.extend(decode_row_height_runs(data.get("row_height_runs", [])))
+        col_widths = [col_width for col_width in data.get("col_widths", []) if col_width]
 
         return table_data, colors, fonts, alignments, row_heights, col_widths
 
+    def decode_row_ids(self, data, count):
+        # 读取行标识；源表格中还没有编号的行（旧数据）按顺序分配编号，同一份数据每次分配的结果相同
+        row_ids = list(data.get('row_ids') or [])[:count]
+        row_ids.extend([None] * (count - len(row_ids)))
+        next_row_id = data.get('next_row_id')
+        if next_row_id is None:
+            next_row_id = max([row_id for row_id in row_ids if row_id is not None], default=-1) + 1
+        if self.row_id_mode == 'source':
+            for index, row_id in enumerate(row_ids):
+                if row_id is None:
+                    row_ids[index] = next_row_id
+                    next_row_id += 1
+        self.row_ids = row_ids
+        self.next_row_id = next_row_id
+
+    def load_data_if_changed(self, progress=None):
+        # 先只查询版本号，与当前显示的版本相同时返回 None，不再下载和重建表格
+        if self.is_current():
+            return None
+        return self.load_data_from_db(progress=progress)
+
+    def is_current(self):
+        # 只查询版本号：数据库中的表格与当前显示的版本相同时返回 True
+        return self.revision is not None and self.db_client.get_revision(self.collection_name) == self.revision
+
+    def load_rows(self, start_row, end_row):
+        # 只读取覆盖 [start_row, end_row) 数据行的行块，返回这些行的数据
+        first_block = start_row // self.block_size
+        last_block = max(end_row - 1, start_row) // self.block_size
+        data = self.db_client.load_sheet(self.collection_name, range(first_block, last_block + 1))
+        if not data:
+            return []
+        offset = first_block * self.block_size
+        return data['data'][start_row - offset:end_row - offset]
+
+    def load_block(self, block_id, default_style):
+        # 读取一个行块，供按需加载的表格使用：返回 (数据行, {(行, 列): 样式}, 行高, 列宽, 读取到的版本号)，
+        # 样式只包含设置过颜色/字体/对齐的单元格，未设置的属性取 default_style
+        table_data, colors, fonts, alignments, row_heights, col_widths = self.load_data_from_db([block_id])
+        return (table_data, self.cell_styles(colors, fonts, alignments, default_style), row_heights, col_widths,
+                self.revision)
+
+    def sheet_rows(self):
+        # 只查询数据库中表格的数据行数（只读视图据此决定是否分页显示），没有表格时返回 None
+        return self.db_client.get_row_count(self.collection_name)
+
+    def query_rows(self, filter_conditions, sort_conditions, skip, default_style, limit=QUERY_PAGE_SIZE, is_admin=False):
+        # 在数据库中筛选和排序，返回 (一页匹配的数据行, {(页内序号, 列): 样式}, 表头行, 列宽, 匹配总数)；
+        # 用户视图中首行数据是表头，不参与筛选。解码会修改本对象的属性，在后台使用 detached 的副本
+        first_row = 0 if is_admin else 1
+        document, total = self.db_client.query_rows(self.collection_name, filter_conditions, sort_conditions, first_row, skip, limit)
+        if document is None:
+            return [], {}, [], [], 0
+        self.has_document = True
+        self.revision = document.get('revision', 0)
+        table_data, colors, fonts, alignments, row_heights, col_widths = self.decode_document(document)
+        return table_data, self.cell_styles(colors, fonts, alignments, default_style), document['header_row'], col_widths, total
+
+    def query_values(self, col, is_admin=False):
+        # 在数据库中统计一列的不重复值和计数（分页显示时的筛选对话框），返回 (值列表, 计数列表)
+        return self.db_client.query_values(self.collection_name, col, 0 if is_admin else 1)
+
+    def sheet_key(self):
+        # 表格在进程内的标识（库/集合）
+        return self.db_client.snapshot_key(self.collection_name)
+
+    def append_rows(self, rows, row_ids=None):
+        # 在服务器端把数据行追加到表格末尾，不读取整张表格；row_ids 为新行引用的源表格行编号。
+        # 返回 (第一个新行的数据行号, 追加后的版本号)
+        first_row, header = self.db_client.append_rows(self.collection_name, rows, row_ids)
+        return first_row, header['revision']
+
+    def append_rows_to_table(self, table, first_row, rows, is_admin, row_ids=None):
+        # 把已追加到数据库的行显示到表格末尾（数据行号与表格行号相同），不重新加载整张表格
+        table.setUpdatesEnabled(False)
+        table.blockSignals(True)
+        try:
+            self.columns = max(self.columns, max(len(row) for row in rows))
+            if table.columnCount() < self.columns:
+                table.setColumnCount(self.columns)
+            last_row = first_row + len(rows)
+            if table.rowCount() < last_row + (0 if is_admin else 1):  # 用户视图比数据多一行（与 set_table_data 相同）
+                table.setRowCount(last_row + (0 if is_admin else 1))
+            if hasattr(table, 'set_rows'):
+                table.set_rows(rows, first_row)
+            else:
+                for index, row in enumerate(rows):
+                    for col, text in enumerate(row):
+                        table.setItem(first_row + index, col, QTableWidgetItem(text))
+            if self.row_id_mode and row_ids is not None:
+                RowIds.for_table(table, self.row_id_mode == 'source').ids[first_row:last_row] = list(row_ids)
+        finally:
+            table.blockSignals(False)
+            table.setUpdatesEnabled(True)
+
     def set_table_data(self, table, data, colors, fonts, alignments, row_heights, col_widths, is_admin):
-        # 根据加载的数据设置表格
+        # 根据加载的数据设置表格：文本和颜色/字体/对齐在同一遍中写入，写入期间暂停重绘和信号，
+        # 避免每个单元格都触发一次界面更新和 itemChanged
         self.columns = len(data[0])  # 根据数据更新列数
-        table.setRowCount(self.rows + 1 if not is_admin else self.rows)  # 设置行数，管理员视图可能不同
-        table.setColumnCount(self.columns)  # 设置列数
-        self.set_headers(table, is_admin)  # 设置表头
+        table.setUpdatesEnabled(False)
+        table.blockSignals(True)
+        try:
+            table.setRowCount(self.rows + 1 if not is_admin else max(self.rows, len(data)))  # 设置行数，管理员视图可能不同（可能追加了新行）
+            table.setColumnCount(self.columns)  # 设置列数
+            self.set_headers(table, is_admin)  # 设置表头
 
-        if is_admin:
-            # 如果是管理员，直接加载数据和格式
-            for row in range(len(data)):
-                for col in range(len(data[row])):
-                    item = table.item(row, col)
-                    if not item:
-                        item = QTableWidgetItem()
-                        table.setItem(row, col, item)
-                    item.setText(data[row][col])
-        else:
-            # 如果不是管理员，首行数据用作表头
-            for col in range(self.columns):
-                header_item = QTableWidgetItem(data[0][col])
-                table.setHorizontalHeaderItem(col, header_item)
-            # 从第二行开始加载数据
-            for row in range(1, len(data)):
-                for col in range(len(data[row])):
-                    item = table.item(row, col)
-                    if not item:
-                        item = QTableWidgetItem()
-                        table.setItem(row, col, item)
-                    item.setText(data[row][col])
-
-        # 应用各种格式设置
-        for (row, col), color in colors.items():
-            item = table.item(row, col)
-            if not item:
-                item = QTableWidgetItem()
-                table.setItem(row, col, item)
-            if QColor.isValidColor(color):
-                item.setBackground(QColor(color))
+            first_row = 0 if is_admin else 1
+            if not is_admin:
+                # 如果不是管理员，首行数据用作表头，从第二行开始加载数据
+                for col in range(self.columns):
+                    header_item = QTableWidgetItem(data[0][col])
+                    table.setHorizontalHeaderItem(col, header_item)
+
+            if hasattr(table, 'set_rows'):
+                # 基于模型的表格：文本和样式整批写入，只重置一次模型
+                styles = self.cell_styles(colors, fonts, alignments, table.default_style())
+                blank_rows = [[]] * (table.rowCount() - max(len(data), first_row))  # 数据之后的行（例如用户视图的空行）清空
+                table.set_rows(data[first_row:] + blank_rows, first_row, styles)
             else:
-                item.setBackground(QColor('#ffffff'))  # 默认白色
-
-        for (row, col), font_info in fonts.items():
-            item = table.item(row, col)
-            if not item:
-                item = QTableWidgetItem()
-                table.setItem(row, col, item)
-            font = QFont()
-            font.setBold(font_info['bold'])
-            font.setPointSize(font_info['size'])
-            item.setFont(font)
-
-        for (row, col), alignment in alignments.items():
-            item = table.item(row, col)
-            if not item:
-                item = QTableWidgetItem()
-                table.setItem(row, col, item)
-            item.setTextAlignment(alignment)
-
-        # 设置行高和列宽
-        for row_height in row_heights:
-            table.setRowHeight(row_height['row'], row_height['height'])
-
-        for col_width in col_widths:
-            table.setColumnWidth(col_width['col'], col_width['width'])
-
-        # 清除和设置单元格的跨度
-        for row in range(self.rows):
-            for col in range(self.columns):
-                if table.rowSpan(row, col) > 1 or table.columnSpan(row, col) > 1:
-                    table.setSpan(row, col, 1, 1)
-
-        for span in self.spans:
-            if span['row_span'] > 1 or span['column_span'] > 1:
-                table.setSpan(span['row'], span['column'], span['row_span'], span['column_span'])
+                self.fill_items(table, data, first_row, colors, fonts, alignments)
+
+            # 设置行高和列宽
+            for row_height in row_heights:
+                table.setRowHeight(row_height['row'], row_height['height'])
+
+            for col_width in col_widths:
+                table.setColumnWidth(col_width['col'], col_width['width'])
+
+            # 清除原有的合并并设置新的合并（只处理合并列表，不需要逐个单元格检查）
+            SpanIndex.for_table(table).reset(self.spans)
+            UndoStack.for_table(table).clear()  # 重新加载后之前的撤销记录不再适用
+            if self.row_id_mode:
+                RowIds.for_table(table, self.row_id_mode == 'source').reset(self.row_ids, self.next_row_id)
+            table.column_types = dict(self.column_types)  # 列类型设置随表格编辑，保存时写回
+        finally:
+            table.blockSignals(False)
+            table.setUpdatesEnabled(True)
+
+        # 表格内容已与数据库一致，清空修改记录
+        ChangeTracker.for_table(table).mark_synced()
+
+    def fill_items(self, table, data, first_row, colors, fonts, alignments):
+        # 为 QTableWidget 一次写入所有单元格项并设置样式。样式与上次填充时相同、之后也没有被修改过的单元格项直接复用（只更新文本），
+        # 其余单元格创建新的单元格项，保证之前的样式被重置为默认；设置了样式的单元格项从同样式的原型复制。
+        # 写入期间关闭排序并屏蔽模型的逐项通知，写完后对整个区域只通知一次
+        tracker = ChangeTracker.for_table(table)
+        formatted = tracker.formatted
+        styles = {}  # 这次填充设置了样式的单元格 -> (颜色, (加粗, 字号), 对齐)
+        for cell in set(colors) | set(fonts) | set(alignments):
+            if isinstance(cell, tuple):
+                font_info = fonts.get(cell)
+                styles[cell] = (colors.get(cell), (font_info['bold'], font_info['size']) if font_info else None,
+                                alignments.get(cell))
+        prototypes = {}  # 样式 -> 设置好该样式的单元格项，同样样式的单元格复制它（一次调用复制所有样式）
+
+        def make_item(cell, text):
+            style = styles.get(cell)
+            if style is None:
+                return QTableWidgetItem(text)
+            prototype = prototypes.get(style)
+            if prototype is None:
+                prototype = prototypes[style] = QTableWidgetItem()
+                color, font_key, alignment = style
+                if color is not None:
+                    prototype.setBackground(QColor(color if QColor.isValidColor(color) else '#ffffff'))  # 无效颜色使用默认白色
+                if font_key is not None:
+                    font = QFont()
+                    font.setBold(font_key[0])
+                    font.setPointSize(font_key[1])
+                    prototype.setFont(font)
+                if alignment is not None:
+                    prototype.setTextAlignment(alignment)
+            item = prototype.clone()
+            item.setText(text)
+            return item
+
+        sorting = table.isSortingEnabled()
+        table.setSortingEnabled(False)  # 排序打开时每写入一项都会重新排序
+        model = table.model()
+        model.blockSignals(True)
+        try:
+            if formatted is None:
+                for row in range(first_row, len(data)):
+                    for col, text in enumerate(data[row]):
+                        table.setItem(row, col, make_item((row, col), text))
+            else:
+                item_at = table.item
+                previous_style = formatted.get
+                style_of = styles.get
+                for row in range(first_row, len(data)):
+                    for col, text in enumerate(data[row]):
+                        cell = (row, col)
+                        item = item_at(row, col)
+                        if item is not None and previous_style(cell, False) == style_of(cell, False):
+                            item.setText(text)
+                        else:
+                            table.setItem(row, col, make_item(cell, text))
+            # 数据之后的行（例如用户视图的空行）清除之前留下的内容
+            for row in range(max(len(data), first_row), table.rowCount()):
+                for col in range(table.columnCount()):
+                    if table.item(row, col) is not None:
+                        table.takeItem(row, col)
+
+            # 设置了样式但不在数据范围内的单元格（例如追加的空行）
+            for cell in styles:
+                if not (first_row <= cell[0] < len(data) and cell[1] < len(data[cell[0]])):
+                    if cell[0] < table.rowCount() and cell[1] < table.columnCount():
+                        table.setItem(cell[0], cell[1], make_item(cell, ''))
+        finally:
+            model.blockSignals(False)
+        if table.rowCount() and table.columnCount():
+            model.dataChanged.emit(model.index(0, 0), model.index(table.rowCount() - 1, table.columnCount() - 1))
+        table.setSortingEnabled(sorting)
+        # 记录这次填充的样式，之后的修改由跟踪器继续记录；重新打开排序后单元格项的位置已变化，不能复用
+        tracker.formatted = None if sorting else styles
+
+    def cell_styles(self, colors, fonts, alignments, default_style):
+        # 把分开保存的颜色/字体/对齐合并为 {(行, 列): (颜色, 加粗, 字号, 对齐)}，
+        # 只包含设置过样式的单元格，未设置的属性取 default_style
+        styles = {}
+        for cell in set(colors) | set(fonts) | set(alignments):
+            if not isinstance(cell, tuple):
+                continue  # 空表的默认样式条目
+            color = colors.get(cell, default_style[0])
+            font = fonts.get(cell, {'bold': default_style[1], 'size': default_style[2]})
+            styles[cell] = (color if QColor.isValidColor(color) else '#ffffff', font['bold'], font['size'],
+                            alignment_value(alignments.get(cell, default_style[3])))
+        return styles
 
     def set_headers(self, table, is_admin):
         # 设置表头，管理员模式下从1开始，否则使用已有表头
@@ -132,46 +371,206 @@ class PageUtils:
         table.setHorizontalHeaderLabels(headers)
 
     def save_to_db(self, table, is_admin):
-        # 将表格数据保存回数据库
-        spans = []
-        colors = []
-        fonts = []
-        alignments = []
-        row_heights = []
-        col_widths = []
-
-        # 遍历表格，收集各项数据
-        for row in range(table.rowCount()):
-            row_height = table.rowHeight(row)
-            row_heights.append({'row': row, 'height': row_height})
+        # 将表格数据保存回数据库：修改先写入本地日志，再按顺序提交到服务器
+        # 返回未能更新的引用表格
+        self.prepare_save(table, is_admin)
+        return self.apply_commits(self.flush_journal())
 
-            for col in range(table.columnCount()):
-                col_width = table.columnWidth(col)
-                col_widths.append({'col': col, 'width': col_width})
+    def prepare_save(self, table, is_admin):
+        # 在界面线程中读取表格，把自上次以来的修改追加到本地日志（没有修改时返回 None）
+        # 能增量保存时生成只包含修改的操作，否则整表写入
+        tracker = ChangeTracker.for_table(table)
+        operation = None
+        if self.can_save_delta(table, is_admin, tracker):
+            if tracker.has_changes():
+                header_fields, block_updates, palette = self.build_delta(table, is_admin, tracker)
+                operation = ('update', make_operation(header_fields, block_updates, palette))
+        else:
+            data = self.table_to_document(table, is_admin)
+            operation = ('replace', data)
+            self.has_document = True
+            self.rows = data['rows']
+            self.columns = data['columns']
+            if self.row_id_mode:
+                self.row_ids = data['row_ids']
+                self.next_row_id = data['next_row_id']
+        if operation is not None:
+            self.journal.append(*operation)
+        tracker.mark_synced()
+        return operation
+
+    def flush_journal(self):
+        # 按顺序把本地日志中的修改提交到服务器，可以在后台线程中执行（不修改本对象的属性）
+        # 每提交一条就从日志中删除，失败时剩余的条目留在日志中，下次保存时重试
+        # 返回提交的 [(类型, 提交后的版本号, 未能更新的引用表格)]，由界面线程调用 apply_commits 更新版本号
+        commits = []
+        for entry in self.journal.entries():
+            if entry['kind'] == 'update':
+                header = self.db_client.append_operation(self.collection_name, entry['payload'])
+            else:
+                header = self.db_client.save_sheet(self.collection_name, entry['payload'], self.block_size)  # 调用数据库客户端按行块保存
+            self.journal.discard(entry['id'])
+            commits.append((entry['kind'], header['revision'], self.update_projections(entry)))
+        return commits
+
+    def apply_commits(self, commits):
+        # 版本号只加了一说明期间没有其他人保存，表格与数据库一致；否则下次刷新需要重新下载
+        # 返回未能更新的引用表格（去重，保持顺序），由调用方提示用户
+        failed = []
+        for kind, revision, failed_projections in commits:
+            if kind == 'replace' or (self.revision is not None and revision == self.revision + 1):
+                self.revision = revision
+            else:
+                self.revision = None
+            failed.extend(name for name in failed_projections if name not in failed)
+        return failed
+
+    def update_projections(self, entry):
+        # 把这次保存中被修改的行写入引用这些行的表格：整表保存时为所有行的整行数据（只有内容与引用表格不同的行会被写入），
+        # 增量保存时为修改的单元格（增量保存时表格结构未变，数据行号对应的行编号就是加载时的 row_ids）
+        # 返回更新失败的引用表格；失败不影响本表格的保存，下次保存这些行时会再次更新
+        if not self.projections or self.row_id_mode != 'source':
+            return []
+        payload = entry['payload']
+        changes = {}
+        if entry['kind'] == 'replace':
+            changes = dict(zip(payload.get('row_ids', []), payload.get('data', [])))
+        else:
+            for block_id, fields in payload['blocks']:
+                for path, value in fields:
+                    keys = path.split('.')
+                    if keys[0] != 'data' or len(keys) != 3:
+                        continue
+                    data_row = block_id * self.block_size + int(keys[1])
+                    if data_row < len(self.row_ids):
+                        changes.setdefault(self.row_ids[data_row], {})[int(keys[2])] = value
+        failed = []
+        for collection_name in self.projections:
+            try:
+                self.db_client.update_references(collection_name, changes)
+            except Exception:
+                failed.append(collection_name)
+        return failed
+
+    def has_unsaved_changes(self, table):
+        # 表格中还有未写入日志的修改，或日志中还有未提交的修改
+        return ChangeTracker.for_table(table).has_changes() or self.journal.has_pending()
+
+    def discard_unsaved(self):
+        # 放弃本地日志中尚未提交的修改
+        self.journal.clear()
 
-                row_span = table.rowSpan(row, col)
-                col_span = table.columnSpan(row, col)
-                if row_span > 1 or col_span > 1:
-                    spans.append({'row': row, 'column': col, 'row_span': row_span, 'column_span': col_span})
+    def can_save_delta(self, table, is_admin, tracker):
+        # 数据库已有文档、表格自加载后结构未变时才能增量保存
+        stored_rows = table.rowCount() - 1 if not is_admin else table.rowCount()
+        return (self.has_document and tracker.can_save_delta()
+                and stored_rows == self.rows and table.columnCount() == self.columns)
+
+    def build_delta(self, table, is_admin, tracker):
+        # 根据修改记录构建按行块划分的增量更新：
+        # 数据用 $set 定位到块内位置，样式和行高按行块整块重新编码
+        start_row = 1 if not is_admin else 0
+        block_size = self.block_size
+        block_updates = {}
+
+        def block_update(block_id):
+            return block_updates.setdefault(block_id, {})
+
+        for row, col in tracker.dirty_cells:
+            if start_row <= row < table.rowCount() and col < table.columnCount():
+                item = table.item(row, col)
+                data_row = row - start_row
+                block_update(data_row // block_size)[f'data.{data_row % block_size}.{col}'] = item.text() if item else ''
+
+        # 样式和行高按行块重新编码整块（行块内的旧格式条目一并清空）
+        header_fields = {}
+        if self.default_style is None:
+            # 旧格式文档还没有默认样式，先写入表头，紧凑编码才能被正确读取
+            self.default_style = self.default_style_key(table)
+            self.default_row_height = table.verticalHeader().defaultSectionSize()
+            header_fields['default_style'] = style_to_dict(self.default_style)
+            header_fields['default_row_height'] = self.default_row_height
+        # 新样式随操作保存，不改写表头中的整个样式表（见 OperationPalette）
+        palette = OperationPalette(self.style_palette)
+
+        for block_id in {row // block_size for row, col in tracker.dirty_styles if row < table.rowCount()}:
+            update = block_update(block_id)
+            block_rows = range(block_id * block_size, min((block_id + 1) * block_size, table.rowCount()))
+            update['style_runs'] = self.encode_styles(table, block_rows, self.default_style, palette)
+            for field in ('colors', 'fonts', 'alignments'):
+                update[field] = []
+
+        for block_id in {row // block_size for row in tracker.dirty_row_heights if row < table.rowCount()}:
+            update = block_update(block_id)
+            first_row = block_id * block_size
+            heights = [table.rowHeight(row) for row in range(first_row, min(first_row + block_size, table.rowCount()))]
+            update['row_height_runs'] = encode_row_height_runs(heights, self.default_row_height, first_row)
+            update['row_heights'] = []
+
+        # 表头文档中每列一条列宽记录，按列号定位
+        for col in tracker.dirty_col_widths:
+            if col < table.columnCount():
+                header_fields[f'col_widths.{col}'] = {'col': col, 'width': table.columnWidth(col)}
+        if tracker.spans_dirty:
+            header_fields['spans'] = self.collect_spans(table)
+        if tracker.column_types_dirty:
+            header_fields['column_types'] = encode_column_types(getattr(table, 'column_types', {}))
+        return header_fields, block_updates, palette.entries
+
+    def default_style_key(self, table):
+        # 没有单独设置样式的单元格所呈现的样式
+        font = table.font()
+        return (DEFAULT_COLOR, font.bold(), font.pointSize(), alignment_value(QTableWidgetItem().textAlignment()))
+
+    def cell_style_key(self, item):
+        # 单元格样式 (颜色, 加粗, 字号, 对齐)；没有设置背景的单元格视为白色
+        background = item.background()
+        color = background.color().name() if background.style() != Qt.NoBrush else DEFAULT_COLOR
+        font = item.font()
+        return (color, font.bold(), font.pointSize(), alignment_value(item.textAlignment()))
+
+    def encode_styles(self, table, rows, default_style, palette):
+        # 把指定行中与默认样式不同的单元格编码为样式段
+        style_runs = []
+        for row in rows:
+            style_ids = []
+            for col in range(table.columnCount()):
                 item = table.item(row, col)
-                if item:
-                    if item.background().color() != QColor('white'):
-                        colors.append({'row': row, 'column': col, 'color': item.background().color().name()})
-                    font = item.font()
-                    fonts.append({'row': row, 'column': col, 'bold': font.bold(), 'size': font.pointSize()})
-                    alignments.append({'row': row, 'column': col, 'alignment': item.textAlignment()})
+                style_key = self.cell_style_key(item) if item else default_style
+                style_ids.append(None if style_key == default_style else palette.intern(style_key))
+            style_runs.extend(encode_style_runs(row, style_ids))
+        return style_runs
+
+    def collect_spans(self, table):
+        # 收集所有合并单元格（从合并索引读取，不逐个单元格检查）
+        return SpanIndex.for_table(table).to_list()
+
+    def table_to_document(self, table, is_admin):
+        # 遍历整张表格，构建完整的保存数据结构（紧凑样式编码，每次整表保存时重建样式表）
+        self.default_style = self.default_style_key(table)
+        self.default_row_height = table.verticalHeader().defaultSectionSize()
+        self.style_palette = StylePalette()
+        col_widths = [{'col': col, 'width': table.columnWidth(col)} for col in range(table.columnCount())]  # 每列只记录一次列宽
+        row_height_runs = encode_row_height_runs([table.rowHeight(row) for row in range(table.rowCount())], self.default_row_height)
 
         # 构建保存数据结构
-        data = {
+        document = {
             "rows": table.rowCount() - 1 if not is_admin else table.rowCount(),
             "columns": table.columnCount(),
             "headers": [table.horizontalHeaderItem(i).text() if table.horizontalHeaderItem(i) else '' for i in range(table.columnCount())],
             "data": [[table.item(row, col).text() if table.item(row, col) else '' for col in range(table.columnCount())] for row in range(1 if not is_admin else 0, table.rowCount())],
-            "spans": spans,
-            "colors": colors,
-            "fonts": fonts,
-            "alignments": alignments,
-            "row_heights": row_heights,
-            "col_widths": col_widths
+            "spans": self.collect_spans(table),
+            "style_runs": self.encode_styles(table, range(table.rowCount()), self.default_style, self.style_palette),
+            "style_palette": self.style_palette.entries,
+            "default_style": style_to_dict(self.default_style),
+            "default_row_height": self.default_row_height,
+            "row_height_runs": row_height_runs,
+            "col_widths": col_widths,
+            "column_types": encode_column_types(getattr(table, 'column_types', {}))
         }
-        self.db_client.insert_data(self.collection_name, data)  # 调用数据库客户端的插入数据方法
+        if self.row_id_mode:
+            # 行标识与 data 一一对应
+            row_ids = RowIds.for_table(table, self.row_id_mode == 'source')
+            document["row_ids"] = row_ids.ids[1 if not is_admin else 0:table.rowCount()]
+            document["next_row_id"] = row_ids.next_id
+        return document
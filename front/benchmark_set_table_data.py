@@ -0,0 +1,95 @@
+import sys
+import time
+from PySide6.QtWidgets import QApplication, QTableWidget, QTableWidgetItem
+from PySide6.QtGui import QColor, QFont
+from basic_function.utils import PageUtils
+from window.sheet_model import SheetTableView
+
+# 测量 PageUtils.set_table_data 填充大表格的耗时，与原来逐项多遍写入的做法对比
+# 用法: python benchmark_set_table_data.py [行数] [列数]，默认 10000 x 20；不需要连接数据库
+
+
+def make_sheet(rows, columns):
+    # 生成测试数据：每隔几个单元格设置颜色/字体/对齐，并有少量合并单元格
+    data = [[f'{row}-{col}' for col in range(columns)] for row in range(rows)]
+    colors = {(row, col): ('#ffff00' if (row + col) % 2 else '#ccffcc') for row in range(rows) for col in range(0, columns, 3)}
+    fonts = {(row, col): {'bold': True, 'size': 12} for row in range(0, rows, 2) for col in range(0, columns, 4)}
+    alignments = {(row, col): 132 for row in range(rows) for col in range(0, columns, 5)}
+    spans = [{'row': row, 'column': 0, 'row_span': 2, 'column_span': 1} for row in range(0, rows, 50)]
+    return data, colors, fonts, alignments, spans
+
+
+def make_utils(rows, columns, spans):
+    # 正常创建 PageUtils（创建连接池不会连接服务器，只有读写数据库时才连接），再设置 set_table_data 用到的属性
+    utils = PageUtils('benchmark_set_table_data')
+    utils.rows = rows
+    utils.columns = columns
+    utils.spans = spans
+    return utils
+
+
+def legacy_set_table_data(utils, table, data, colors, fonts, alignments):
+    # 原来的做法：文本、颜色、字体、对齐分四遍写入，每遍逐个单元格 item()/setItem()，最后逐个单元格检查合并
+    table.setRowCount(utils.rows)
+    table.setColumnCount(utils.columns)
+    for row in range(len(data)):
+        for col in range(len(data[row])):
+            table.setItem(row, col, QTableWidgetItem(data[row][col]))
+    for (row, col), color in colors.items():
+        table.item(row, col).setBackground(QColor(color))
+    for (row, col), font_info in fonts.items():
+        font = QFont()
+        font.setBold(font_info['bold'])
+        font.setPointSize(font_info['size'])
+        table.item(row, col).setFont(font)
+    for (row, col), alignment in alignments.items():
+        table.item(row, col).setTextAlignment(alignment)
+    for row in range(utils.rows):
+        for col in range(utils.columns):
+            if table.rowSpan(row, col) > 1 or table.columnSpan(row, col) > 1:
+                table.setSpan(row, col, 1, 1)
+    for span in utils.spans:
+        table.setSpan(span['row'], span['column'], span['row_span'], span['column_span'])
+
+
+def measure(fn):
+    start = time.perf_counter()
+    fn()
+    QApplication.processEvents()  # 包括写入后的界面更新
+    return time.perf_counter() - start
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    columns = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    app = QApplication.instance() or QApplication(sys.argv)
+    data, colors, fonts, alignments, spans = make_sheet(rows, columns)
+    utils = make_utils(rows, columns, spans)
+
+    results = []
+    for name, create_table, fill in [
+        ('旧做法 (QTableWidget)', QTableWidget,
+         lambda table: legacy_set_table_data(utils, table, data, colors, fonts, alignments)),
+        ('set_table_data (QTableWidget)', QTableWidget,
+         lambda table: utils.set_table_data(table, data, colors, fonts, alignments, [], [], True)),
+        ('set_table_data (SheetTableView)', SheetTableView,
+         lambda table: utils.set_table_data(table, data, colors, fonts, alignments, [], [], True)),
+    ]:
+        table = create_table()
+        table.show()
+        QApplication.processEvents()
+        # 第一次填充空表格，第二次替换已有内容（刷新时的情况）
+        first = measure(lambda: fill(table))
+        second = measure(lambda: fill(table))
+        results.append((name, first, second))
+        table.close()
+
+    print(f'{rows} x {columns} 单元格')
+    baseline = results[0][1] + results[0][2]
+    for name, first, second in results:
+        print(f'{name:34s} 首次 {first:7.3f}s  重新填充 {second:7.3f}s  加速 {baseline / (first + second):5.1f}x')
+    app.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# 测量从进程启动到登录窗口显示的时间，超过预算或登录前导入了页面模块/pandas 时以非零状态退出（可用于持续集成）
+# 用法: python benchmark_startup.py [运行次数]，默认 5 次；预算（毫秒）可用环境变量 KPI_STARTUP_BUDGET_MS 修改
+# 每次在新的 Python 进程中启动，不需要连接数据库（数据库连接在后台线程中建立，不计入时间）
+
+STARTUP_BUDGET_MS = float(os.environ.get('KPI_STARTUP_BUDGET_MS', 600))
+# 登录窗口显示前不应导入的模块：页面在第一次打开时才导入，数据库模块在登录窗口的预热线程中导入
+DEFERRED_MODULES = ('pandas', 'numpy', 'pymongo', 'window.database', 'basic_function.utils',
+                    'pages.kpi_process_plan', 'pages.second_page', 'pages.page3_admin', 'pages.page3_user')
+
+# 子进程执行的代码：与 main.py 相同的启动过程，登录窗口显示后报告耗时和导入 login 后已加载的模块
+# （预热线程随后会导入数据库模块，所以模块列表在创建登录窗口之前记录）
+CHILD_CODE = '''
+import time
+start = time.perf_counter()
+import json, os, sys
+from PySide6.QtWidgets import QApplication
+from login import LoginPage
+modules = sorted(sys.modules)
+app = QApplication(sys.argv)
+login_page = LoginPage()
+login_page.show()
+app.processEvents()
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({'elapsed': elapsed, 'modules': modules}))
+sys.stdout.flush()
+os._exit(0)
+'''
+
+
+def measure_once():
+    result = subprocess.run([sys.executable, '-c', CHILD_CODE], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    measure_once()  # 第一次运行预热磁盘缓存和 .pyc，不计入结果
+    results = [measure_once() for _ in range(runs)]
+    times = [result['elapsed'] for result in results]
+    median = statistics.median(times)
+    loaded = sorted(set(module for result in results for module in result['modules'] if module in DEFERRED_MODULES))
+
+    print(f'登录窗口显示耗时: 中位数 {median:.0f} ms, 最小 {min(times):.0f} ms, 最大 {max(times):.0f} ms ({runs} 次)')
+    print(f'预算: {STARTUP_BUDGET_MS:.0f} ms')
+    failed = False
+    if median > STARTUP_BUDGET_MS:
+        print('失败: 启动时间超过预算')
+        failed = True
+    if loaded:
+        print(f'失败: 登录前导入了应在打开页面时才导入的模块: {", ".join(loaded)}')
+        failed = True
+    if not failed:
+        print('通过')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
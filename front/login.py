@@ -1,10 +1,26 @@
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QLabel, QLineEdit, QPushButton, QMessageBox
+from PySide6.QtCore import QTimer
+import threading
 from window.main_window import MainWindow
 
+
+def warm_up_connection():
+    # 在后台线程中提前建立数据库连接；window.database（以及 pymongo、Redis 探测、SQLite）也在线程中导入，
+    # 不占用登录窗口显示前的时间
+    def warm_up():
+        from window.database import ping_server
+        ping_server()
+
+    thread = threading.Thread(target=warm_up, name='mongo-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
 class LoginPage(QWidget):
     def __init__(self):
         super().__init__()
         self.init_ui()
+        warm_up_connection()  # 用户输入账号密码期间在后台建立数据库连接
 
     def init_ui(self):
         """
@@ -58,5 +74,14 @@ class LoginPage(QWidget):
         接受登录并打开相应的窗口
         """
         self.main_window = MainWindow(is_admin=is_admin)  # 根据用户权限创建主窗口
+        self.main_window.logged_out.connect(self.on_logout)
         self.main_window.show()  # 显示主窗口
+        QTimer.singleShot(0, self.main_window.start_prefetch)  # 主窗口显示后立即在后台预取各页面的表格
         self.close()  # 关闭登录窗口
+
+    def on_logout(self):
+        """
+        注销后重新显示登录窗口
+        """
+        self.password_input.clear()
+        self.show()
@@ -1,7 +1,14 @@
+import os
+import time
+START_TIME = time.perf_counter()  # 进程启动后开始计时，用于测量登录窗口的显示时间
+
 from PySide6.QtWidgets import QApplication
+from PySide6.QtCore import QTimer
 from login import LoginPage
 import sys
 
+PROFILE_STARTUP = bool(os.environ.get('KPI_PROFILE_IMPORTS'))  # 设置后打印登录窗口的显示耗时和页面模块的导入耗时
+
 if __name__ == "__main__":
     # 创建应用程序对象
     app = QApplication(sys.argv)
@@ -11,6 +18,8 @@ if __name__ == "__main__":
 
     # 显示登录页面
     login_page.show()
+    if PROFILE_STARTUP:
+        QTimer.singleShot(0, lambda: print(f"[startup] login window: {(time.perf_counter() - START_TIME) * 1000:.0f} ms"))
 
     # 进入应用程序的主循环，等待事件处理
     sys.exit(app.exec())
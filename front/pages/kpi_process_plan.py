@@ -1,5 +1,7 @@
 from PySide6.QtWidgets import QMainWindow, QVBoxLayout, QWidget, QPushButton
 from basic_function.utils import PageUtils
+from basic_function.background_tasks import SheetTaskRunner
+from basic_function.lazy_table import LazyTableLoader
 from window.excel_editor import ExcelEditor, ReadOnlyExcelEditor
 
 class KPIProcessPlan(QMainWindow):
@@ -7,11 +9,14 @@ class KPIProcessPlan(QMainWindow):
         super().__init__()
         self.is_admin = is_admin  # 设置是否为管理员
         self.utils = PageUtils('kpi_process_plan')  # 创建 PageUtils 实例
+        self.sheet_tasks = SheetTaskRunner(self.utils, self)  # 后台读写数据库，避免界面卡顿
+        self.sheet_tasks.loaded.connect(self.on_data_loaded)
         self.init_ui()  # 初始化用户界面
 
     def init_ui(self):
         self.setWindowTitle('KPI Process Plan')  # 设置窗口标题
         self.setGeometry(100, 100, 800, 600)  # 设置窗口位置和大小
+        self.sheet_tasks.attach_status_bar(self.statusBar())  # 在状态栏显示加载/保存进度
 
         central_widget = QWidget()  # 创建中央组件
         self.setCentralWidget(central_widget)  # 设置中央组件
@@ -19,9 +24,6 @@ class KPIProcessPlan(QMainWindow):
         layout = QVBoxLayout()  # 创建垂直布局
         central_widget.setLayout(layout)  # 设置布局
 
-        # 从数据库加载数据
-        table_data, colors, fonts, alignments, row_heights, col_widths = self.utils.load_data_from_db()
-
         # 根据是否为管理员创建相应的编辑器
         if self.is_admin:
             self.excel_editor = ExcelEditor()
@@ -29,9 +31,6 @@ class KPIProcessPlan(QMainWindow):
             self.excel_editor = ReadOnlyExcelEditor()
         layout.addWidget(self.excel_editor)  # 将编辑器添加到布局中
 
-        # 加载数据到表格中
-        self.utils.set_table_data(self.excel_editor.table, table_data, colors, fonts, alignments, row_heights, col_widths, self.is_admin)
-
         # 如果是管理员，则添加保存按钮
         if self.is_admin:
             save_button = QPushButton('保存')
@@ -43,24 +42,53 @@ class KPIProcessPlan(QMainWindow):
         refresh_button.clicked.connect(self.refresh_page)
         layout.addWidget(refresh_button)
 
+        if self.is_admin:
+            self.sheet_tasks.watch(self.excel_editor.table, self.is_admin)  # 编辑随时写入本地日志
+            # 在后台加载数据，加载完成后填充表格
+            self.sheet_tasks.open()  # 先显示本地快照，再与服务器同步
+        else:
+            # 只读视图按需加载：先显示第一屏，滚动时再读取后面的行
+            self.lazy_table = LazyTableLoader(self.utils, self.sheet_tasks, self.excel_editor.table, False, self)
+            self.lazy_table.start()
+
     def save_to_db(self):
-        # 保存数据到数据库
-        self.utils.save_to_db(self.excel_editor.table, self.is_admin)
+        # 在后台保存数据到数据库
+        self.sheet_tasks.save(self.excel_editor.table, self.is_admin)
 
     def refresh_page(self):
-        # 从数据库重新加载数据并更新表格
-        table_data, colors, fonts, alignments, row_heights, col_widths = self.utils.load_data_from_db()
+        if not self.is_admin:
+            self.lazy_table.refresh()  # 只查询版本号，数据变化时才重新读取
+            return
+        # 在后台检查数据库版本，只有数据变化时才重新加载
+        self.sheet_tasks.refresh(self.excel_editor.table)
+
+    def reopen_page(self):
+        # 从主窗口的页面缓存中重新显示：只在后台比对数据版本，数据未变化时保留表格（包括未保存的修改）
+        if not self.is_admin:
+            self.lazy_table.reopen()
+            return
+        self.sheet_tasks.reopen()
+
+    def on_data_loaded(self, result):
+        # 后台加载完成后更新表格
+        table_data, colors, fonts, alignments, row_heights, col_widths = result
         self.utils.set_table_data(self.excel_editor.table, table_data, colors, fonts, alignments, row_heights, col_widths, self.is_admin)
 
+    def closeEvent(self, event):
+        self.sheet_tasks.close()  # 关闭窗口时写入未保存的修改并取消尚未完成的加载
+        super().closeEvent(event)
+
 class ReadOnlyKPIProcessPlan(QMainWindow):
     def __init__(self):
         super().__init__()
         self.utils = PageUtils('kpi_process_plan')  # 创建 PageUtils 实例
+        self.sheet_tasks = SheetTaskRunner(self.utils, self)  # 后台读取数据库，避免界面卡顿
         self.init_ui()  # 初始化用户界面
 
     def init_ui(self):
         self.setWindowTitle('KPI Process Plan')  # 设置窗口标题
         self.setGeometry(100, 100, 800, 600)  # 设置窗口位置和大小
+        self.sheet_tasks.attach_status_bar(self.statusBar())  # 在状态栏显示加载进度
 
         central_widget = QWidget()  # 创建中央组件
         self.setCentralWidget(central_widget)  # 设置中央组件
@@ -68,22 +96,25 @@ class ReadOnlyKPIProcessPlan(QMainWindow):
         layout = QVBoxLayout()  # 创建垂直布局
         central_widget.setLayout(layout)  # 设置布局
 
-        # 从数据库加载数据
-        table_data, colors, fonts, alignments, row_heights, col_widths = self.utils.load_data_from_db()
-
         # 创建只读的 Excel 编辑器
         self.excel_editor = ReadOnlyExcelEditor()
         layout.addWidget(self.excel_editor)  # 将编辑器添加到布局中
 
-        # 加载数据到表格中
-        self.utils.set_table_data(self.excel_editor.table, table_data, colors, fonts, alignments, row_heights, col_widths, False)
-
         # 添加刷新按钮
         refresh_button = QPushButton('刷新')
         refresh_button.clicked.connect(self.refresh_page)
         layout.addWidget(refresh_button)
 
+        # 按需加载：先显示第一屏，滚动时再在后台读取后面的行
+        self.lazy_table = LazyTableLoader(self.utils, self.sheet_tasks, self.excel_editor.table, False, self)
+        self.lazy_table.start()
+
     def refresh_page(self):
-        # 从数据库重新加载数据并更新表格
-        table_data, colors, fonts, alignments, row_heights, col_widths = self.utils.load_data_from_db()
-        self.utils.set_table_data(self.excel_editor.table, table_data, colors, fonts, alignments, row_heights, col_widths, False)
+        self.lazy_table.refresh()  # 只查询版本号，数据变化时才重新读取
+
+    def reopen_page(self):
+        self.lazy_table.reopen()  # 只查询版本号，数据未变化时保留已读取的行块
+
+    def closeEvent(self, event):
+        self.sheet_tasks.close()  # 关闭窗口时写入未保存的修改并取消尚未完成的加载
+        super().closeEvent(event)
@@ -1,8 +1,10 @@
-from PySide6.QtWidgets import QMainWindow, QVBoxLayout, QWidget, QPushButton, QTableWidgetItem, QTableWidget
+from PySide6.QtWidgets import QMainWindow, QVBoxLayout, QWidget, QPushButton, QTableWidgetItem
 from PySide6.QtGui import QColor
 from PySide6.QtCore import Qt
 from basic_function.utils_with_page3 import PageUtils  # 确保导入新的PageUtils
 from window.excel_editor import ExcelEditor  # 确保导入 ExcelEditor
+from basic_function.background_tasks import SheetTaskRunner
+from basic_function.row_ids import RowIds
 import logging  # 添加导入 logging
 
 # 配置日志
@@ -12,13 +14,20 @@ class AdminPage3(QMainWindow):
     def __init__(self, is_admin=True):
         super().__init__()
         self.is_admin = is_admin
-        self.utils = PageUtils('page3')
-        self.display_utils = PageUtils('page3_display')
+        # 展示栏中的行引用第三页的行（按行编号），第三页保存后被引用行的新内容写入展示栏
+        self.utils = PageUtils('page3', row_ids='source', projections=('page3_display',))
+        self.display_utils = PageUtils('page3_display', row_ids='reference')
+        self.sheet_tasks = SheetTaskRunner(self.utils, self)  # 后台读写数据库
+        self.sheet_tasks.loaded.connect(self.on_data_loaded)
+        self.display_tasks = SheetTaskRunner(self.display_utils, self)  # 后台向展示栏追加行
+        self.display_page = None  # 展示栏窗口，第一次打开时创建，关闭后再次打开时复用
         self.init_ui()
 
     def init_ui(self):
         self.setWindowTitle('Page 3')
         self.setGeometry(100, 100, 800, 600)
+        self.sheet_tasks.attach_status_bar(self.statusBar())
+        self.display_tasks.attach_status_bar(self.statusBar())
 
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -26,9 +35,6 @@ class AdminPage3(QMainWindow):
         layout = QVBoxLayout()
         central_widget.setLayout(layout)
 
-        # 从数据库加载数据
-        table_data, colors, fonts, alignments, row_heights, col_widths = self.utils.load_data_from_db()
-
         # 创建表格编辑器
         self.excel_editor = ExcelEditor()
         view_button = QPushButton('进入展示栏')
@@ -37,12 +43,6 @@ class AdminPage3(QMainWindow):
 
         layout.addWidget(self.excel_editor)
 
-        # 加载数据到表格中
-        try:
-            self.utils.set_table_data(self.excel_editor.table, table_data, colors, fonts, alignments, row_heights, col_widths, True)
-        except IndexError as e:
-            logging.error(f"Error setting table data: {e}")
-
         save_button = QPushButton('保存')
         save_button.clicked.connect(self.save_to_db)
         layout.addWidget(save_button)
@@ -59,65 +59,84 @@ class AdminPage3(QMainWindow):
         add_to_display_button.clicked.connect(self.add_selected_to_display)
         layout.addWidget(add_to_display_button)
 
+        self.sheet_tasks.watch(self.excel_editor.table, True)  # 编辑随时写入本地日志
+
+        # 在后台加载数据，加载完成后填充表格
+        self.sheet_tasks.open()  # 先显示本地快照，再与服务器同步
+
     def add_row(self):
         row_position = self.excel_editor.table.rowCount()
         self.excel_editor.table.insertRow(row_position)
 
     def add_selected_to_display(self):
-        selected_row = self.excel_editor.table.currentRow()
-        if selected_row != -1:
+        # 所有选中的行（没有选中区域时为当前行）在服务器端一次追加到展示栏末尾，不读取也不重写整个展示栏；
+        # 追加的行记录所引用的第三页行编号，之后第三页修改这些行时展示栏随之更新
+        table = self.excel_editor.table
+        selected_rows = sorted(set(index.row() for index in table.selectedIndexes()))
+        if not selected_rows and table.currentRow() != -1:
+            selected_rows = [table.currentRow()]
+        if not selected_rows:
+            return
+        rows = []
+        for row in selected_rows:
             row_data = []
-            for col in range(self.excel_editor.table.columnCount()):
-                item = self.excel_editor.table.item(selected_row, col)
+            for col in range(table.columnCount()):
+                item = table.item(row, col)
                 row_data.append(item.text() if item else '')
+            rows.append(row_data)
 
-            logging.debug(f"Selected row data to add to display: {row_data}")
-
-            # Load current display table data
-            display_data, display_colors, display_fonts, display_alignments, display_row_heights, display_col_widths = self.display_utils.load_data_from_db()
-
-            logging.debug(f"Current display data before adding new row: {display_data}")
-
-            # Add selected row data to display table data
-            display_data.append(row_data)
-
-            # Save updated display table data
-            temp_table = QTableWidget()
-            temp_table.setRowCount(len(display_data))
-            temp_table.setColumnCount(self.excel_editor.table.columnCount())
-            self.display_utils.set_table_data(temp_table, display_data, display_colors, display_fonts, display_alignments, display_row_heights, display_col_widths, True)
-            self.display_utils.save_to_db(temp_table, True)
-
-            logging.debug("Display data saved successfully.")
-            self.refresh_page()
+        row_ids = RowIds.for_table(table).ids
+        logging.debug(f"Selected rows to add to display: {len(rows)}")
+        self.display_tasks.append_rows(rows, [row_ids[row] for row in selected_rows])  # 打开的展示栏窗口会收到通知并追加这些行
 
     def save_to_db(self):
-        self.utils.save_to_db(self.excel_editor.table, True)
-        logging.debug("Table data saved successfully.")
+        self.sheet_tasks.save(self.excel_editor.table, True)
+        logging.debug("Table data save started.")
 
     def refresh_page(self):
+        self.sheet_tasks.refresh(self.excel_editor.table)  # 只有数据库版本变化时才重新加载
+
+    def reopen_page(self):
+        # 从主窗口的页面缓存中重新显示：只在后台比对数据版本，数据未变化时保留表格（包括未保存的修改）
+        self.sheet_tasks.reopen()
+
+    def on_data_loaded(self, result):
         self.excel_editor.table.clear()  # 清除表格内容
         self.excel_editor.table.setRowCount(0)  # 重设行数
         self.excel_editor.table.setColumnCount(0)  # 重设列数
-        table_data, colors, fonts, alignments, row_heights, col_widths = self.utils.load_data_from_db()
+        table_data, colors, fonts, alignments, row_heights, col_widths = result
         try:
             self.utils.set_table_data(self.excel_editor.table, table_data, colors, fonts, alignments, row_heights, col_widths, True)
         except IndexError as e:
             logging.error(f"Error setting table data: {e}")
 
+    def closeEvent(self, event):
+        self.sheet_tasks.close()  # 关闭窗口时写入未保存的修改并取消尚未完成的加载
+        self.display_tasks.cancel()
+        super().closeEvent(event)
+
     def open_display_view(self):
-        self.display_page = AdminDisplayPage()
+        if self.display_page is None:
+            self.display_page = AdminDisplayPage()
+        elif not self.display_page.isVisible():
+            self.display_page.reopen_page()
         self.display_page.show()
+        self.display_page.raise_()
+        self.display_page.activateWindow()
 
 class AdminDisplayPage(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.utils = PageUtils('page3_display')
+        self.utils = PageUtils('page3_display', row_ids='reference')  # 保存时保留每行引用的第三页行编号
+        self.sheet_tasks = SheetTaskRunner(self.utils, self)  # 后台读写数据库
+        self.sheet_tasks.loaded.connect(self.on_data_loaded)
+        self.sheet_tasks.rows_appended.connect(self.on_rows_appended)  # 管理员页面追加到展示栏的行
         self.init_ui()
 
     def init_ui(self):
         self.setWindowTitle('管理员展示栏')
         self.setGeometry(100, 100, 800, 600)
+        self.sheet_tasks.attach_status_bar(self.statusBar())
 
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -129,8 +148,10 @@ class AdminDisplayPage(QMainWindow):
         self.excel_editor = ExcelEditor()
         layout.addWidget(self.excel_editor)
 
-        # 从数据库加载数据
-        self.load_display_data()
+        self.sheet_tasks.watch(self.excel_editor.table, True)  # 编辑随时写入本地日志
+
+        # 在后台加载数据，加载完成后填充表格
+        self.sheet_tasks.open()  # 先显示本地快照，再与服务器同步
 
         save_button = QPushButton('保存')
         save_button.clicked.connect(self.save_to_db)
@@ -141,15 +162,30 @@ class AdminDisplayPage(QMainWindow):
         layout.addWidget(refresh_button)
 
     def load_display_data(self):
+        # 在后台检查数据库版本，只有数据变化时才重新加载
+        self.sheet_tasks.refresh(self.excel_editor.table)
+
+    def reopen_page(self):
+        # 从主窗口的页面缓存中重新显示：只在后台比对数据版本，数据未变化时保留表格（包括未保存的修改）
+        self.sheet_tasks.reopen()
+
+    def on_data_loaded(self, result):
         self.excel_editor.table.clear()  # 清除表格内容
         self.excel_editor.table.setRowCount(0)  # 重设行数
         self.excel_editor.table.setColumnCount(0)  # 重设列数
-        table_data, colors, fonts, alignments, row_heights, col_widths = self.utils.load_data_from_db()
+        table_data, colors, fonts, alignments, row_heights, col_widths = result
         try:
             self.utils.set_table_data(self.excel_editor.table, table_data, colors, fonts, alignments, row_heights, col_widths, True)
         except IndexError as e:
             logging.error(f"Error setting table data: {e}")
 
+    def on_rows_appended(self, first_row, rows, row_ids):
+        self.utils.append_rows_to_table(self.excel_editor.table, first_row, rows, True, row_ids)
+
     def save_to_db(self):
-        self.utils.save_to_db(self.excel_editor.table, True)
-        logging.debug("Display table data saved successfully.")
+        self.sheet_tasks.save(self.excel_editor.table, True)
+        logging.debug("Display table data save started.")
+
+    def closeEvent(self, event):
+        self.sheet_tasks.close()  # 关闭窗口时写入未保存的修改并取消尚未完成的加载
+        super().closeEvent(event)
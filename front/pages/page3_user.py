@@ -1,16 +1,21 @@
 from PySide6.QtWidgets import QMainWindow, QVBoxLayout, QWidget, QTableWidget, QPushButton
 from basic_function.utils_with_page3 import PageUtils
-from window.excel_editor import ExcelEditor
+from basic_function.background_tasks import SheetTaskRunner
+from window.excel_editor import ExcelEditor, ReadOnlyExcelEditor
 
 class AdminDisplayPage(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.utils = PageUtils('page3_display')
+        self.utils = PageUtils('page3_display', row_ids='reference')  # 保存时保留每行引用的第三页行编号
+        self.sheet_tasks = SheetTaskRunner(self.utils, self)  # 后台读写数据库
+        self.sheet_tasks.loaded.connect(self.on_data_loaded)
+        self.sheet_tasks.rows_appended.connect(self.on_rows_appended)  # 管理员页面追加到展示栏的行
         self.init_ui()
 
     def init_ui(self):
         self.setWindowTitle('管理员展示栏')
         self.setGeometry(100, 100, 800, 600)
+        self.sheet_tasks.attach_status_bar(self.statusBar())
 
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -18,8 +23,8 @@ class AdminDisplayPage(QMainWindow):
         layout = QVBoxLayout()
         central_widget.setLayout(layout)
 
-        # 从数据库加载数据
-        self.load_display_data()
+        self.excel_editor = ExcelEditor()  # 使用可编辑的 Excel 编辑器
+        layout.addWidget(self.excel_editor)
 
         save_button = QPushButton('保存')
         save_button.clicked.connect(self.save_to_db)
@@ -29,24 +34,41 @@ class AdminDisplayPage(QMainWindow):
         refresh_button.clicked.connect(self.load_display_data)
         layout.addWidget(refresh_button)
 
+        self.sheet_tasks.watch(self.excel_editor.table, True)  # 编辑随时写入本地日志
+
+        # 在后台加载数据，加载完成后填充表格
+        self.sheet_tasks.open()  # 先显示本地快照，再与服务器同步
+
     def load_display_data(self):
-        table_data, colors, fonts, alignments, row_heights, col_widths = self.utils.load_data_from_db()
-        self.excel_editor = ExcelEditor()  # 使用可编辑的 Excel 编辑器
-        self.centralWidget().layout().addWidget(self.excel_editor)
+        self.sheet_tasks.refresh(self.excel_editor.table)  # 只有数据库版本变化时才重新加载
+
+    def on_data_loaded(self, result):
+        table_data, colors, fonts, alignments, row_heights, col_widths = result
         self.utils.set_table_data(self.excel_editor.table, table_data, colors, fonts, alignments, row_heights, col_widths, True)
 
+    def on_rows_appended(self, first_row, rows, row_ids):
+        self.utils.append_rows_to_table(self.excel_editor.table, first_row, rows, True, row_ids)
+
     def save_to_db(self):
-        self.utils.save_to_db(self.excel_editor.table, True)
+        self.sheet_tasks.save(self.excel_editor.table, True)
+
+    def closeEvent(self, event):
+        self.sheet_tasks.close()  # 关闭窗口时写入未保存的修改并取消尚未完成的加载
+        super().closeEvent(event)
 
 class ReadOnlyPage3(QMainWindow):
     def __init__(self):
         super().__init__()
         self.utils = PageUtils('page3_display')
+        self.sheet_tasks = SheetTaskRunner(self.utils, self)  # 后台读取数据库
+        self.sheet_tasks.loaded.connect(self.on_data_loaded)
+        self.sheet_tasks.rows_appended.connect(self.on_rows_appended)  # 管理员页面追加到展示栏的行
         self.init_ui()
 
     def init_ui(self):
         self.setWindowTitle('用户展示栏')
         self.setGeometry(100, 100, 800, 600)
+        self.sheet_tasks.attach_status_bar(self.statusBar())
 
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -54,9 +76,6 @@ class ReadOnlyPage3(QMainWindow):
         layout = QVBoxLayout()
         central_widget.setLayout(layout)
 
-        # 从数据库加载数据
-        table_data, colors, fonts, alignments, row_heights, col_widths = self.utils.load_data_from_db()
-
         # 创建只读的 Excel 编辑器
         self.excel_editor = ReadOnlyExcelEditor()
         layout.addWidget(self.excel_editor)
@@ -65,9 +84,23 @@ class ReadOnlyPage3(QMainWindow):
         refresh_button.clicked.connect(self.refresh_page)
         layout.addWidget(refresh_button)
 
-        # 加载数据到表格中
-        self.utils.set_table_data(self.excel_editor.table, table_data, colors, fonts, alignments, row_heights, col_widths, False)
+        # 在后台加载数据，加载完成后填充表格
+        self.sheet_tasks.open()  # 先显示本地快照，再与服务器同步
 
     def refresh_page(self):
-        table_data, colors, fonts, alignments, row_heights, col_widths = self.utils.load_data_from_db()
+        self.sheet_tasks.refresh(self.excel_editor.table)  # 只有数据库版本变化时才重新加载
+
+    def reopen_page(self):
+        # 从主窗口的页面缓存中重新显示：只在后台比对数据版本，数据未变化时保留表格（包括未保存的修改）
+        self.sheet_tasks.reopen()
+
+    def on_data_loaded(self, result):
+        table_data, colors, fonts, alignments, row_heights, col_widths = result
         self.utils.set_table_data(self.excel_editor.table, table_data, colors, fonts, alignments, row_heights, col_widths, False)
+
+    def on_rows_appended(self, first_row, rows, row_ids):
+        self.utils.append_rows_to_table(self.excel_editor.table, first_row, rows, False)
+
+    def closeEvent(self, event):
+        self.sheet_tasks.close()  # 关闭窗口时写入未保存的修改并取消尚未完成的加载
+        super().closeEvent(event)
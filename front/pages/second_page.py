@@ -1,8 +1,10 @@
-import pandas as pd
 from PySide6.QtWidgets import QMainWindow, QVBoxLayout, QWidget, QPushButton, QTableWidget, QToolButton, QMenu, QTableWidgetItem
 from PySide6.QtGui import QAction, QColor, QFont
-from basic_function.utils import PageUtils
-from basic_function.filter_operations import FilterDialog, apply_filters, table_to_dataframe, load_dataframe_to_table, table_styles_to_dict
+from basic_function.utils import PageUtils, DEFAULT_COLUMNS, QUERY_MODE_ROWS
+from basic_function.background_tasks import SheetTaskRunner
+from basic_function.span_index import SpanIndex
+from basic_function.filter_operations import FilterDialog, table_to_dataframe
+from basic_function.filter_engine import FilterEngine
 from window.excel_editor import ExcelEditor, ReadOnlyExcelEditor
 from PySide6.QtCore import Qt
 from functools import partial
@@ -14,13 +16,19 @@ class SecondPage(QMainWindow):
         self.utils = PageUtils('second_page')  # 创建 PageUtils 实例，用于处理与第二页相关的数据库操作
         self.initial_df = None  # 保存初始加载的 DataFrame
         self.filter_conditions = {}  # 保存筛选条件
-        self.sort_conditions = {}  # 保存排序条件
-        self.styles = {}  # 保存样式信息
+        self.sort_conditions = []  # 排序条件 [(列, 是否升序)]，第一个为主排序键
+        self.filter_engine = None  # 筛选引擎，数据加载完成后创建
+        self.columns = DEFAULT_COLUMNS  # 列数，数据加载完成后更新
+        self.filter_row_added = False  # 筛选行只在首次加载完成后添加
+        self.readonly_page = None  # 只读视图窗口，第一次打开时创建，关闭后再次打开时复用
+        self.sheet_tasks = SheetTaskRunner(self.utils, self)  # 后台读写数据库，避免界面卡顿
+        self.sheet_tasks.loaded.connect(self.on_data_loaded)
         self.init_ui()  # 初始化用户界面
 
     def init_ui(self):
         self.setWindowTitle('第二页')  # 设置窗口标题
         self.setGeometry(100, 100, 800, 600)  # 设置窗口位置和大小
+        self.sheet_tasks.attach_status_bar(self.statusBar())  # 在状态栏显示加载/保存进度
 
         central_widget = QWidget()
         self.setCentralWidget(central_widget)  # 创建中央组件并设置为中央部件
@@ -28,13 +36,7 @@ class SecondPage(QMainWindow):
         layout = QVBoxLayout()
         central_widget.setLayout(layout)  # 创建垂直布局并设置为中央组件的布局
 
-        # 从数据库加载数据
-        table_data, colors, fonts, alignments, row_heights, col_widths = self.utils.load_data_from_db()
-        self.styles = {'colors': colors, 'fonts': fonts, 'alignments': alignments}  # 保存样式信息
-
-        # 更新列数和表头
-        self.columns = len(table_data[0])  # 确定表格的列数
-        headers = [str(i+1) for i in range(self.columns)]  # 生成表头
+        headers = [str(i+1) for i in range(self.columns)]  # 生成表头，数据加载后按实际列数更新
 
         # 创建ExcelEditor或ReadOnlyExcelEditor
         if self.is_admin:
@@ -46,17 +48,6 @@ class SecondPage(QMainWindow):
             self.excel_editor = ReadOnlyExcelEditor(columns=self.columns, headers=headers)  # 创建只读的 Excel 编辑器
         layout.addWidget(self.excel_editor)  # 将编辑器添加到布局中
 
-        # 加载数据到表格中
-        self.utils.set_table_data(self.excel_editor.table, table_data, self.styles['colors'], self.styles['fonts'], self.styles['alignments'], row_heights, col_widths, self.is_admin)
-
-        # 将表格数据转换为 DataFrame 并保存
-        self.initial_df = table_to_dataframe(self.excel_editor.table, headers, self.is_admin)  # 转换为 DataFrame 并保存
-        self.styles = table_styles_to_dict(self.excel_editor.table, 1 if not self.is_admin else 0)  # 保存样式信息
-
-        # 如果是用户模式，添加筛选行
-        if not self.is_admin:
-            self.add_filter_row()
-
         # 添加保存按钮
         if self.is_admin:
             save_button = QPushButton('保存')
@@ -68,8 +59,14 @@ class SecondPage(QMainWindow):
         self.refresh_button.clicked.connect(self.refresh_page)  # 连接按钮点击事件
         layout.addWidget(self.refresh_button)  # 添加按钮到布局中
 
+        if self.is_admin:
+            self.sheet_tasks.watch(self.excel_editor.table, self.is_admin)  # 编辑随时写入本地日志
+        # 在后台加载数据，加载完成后填充表格
+        self.sheet_tasks.open()  # 先显示本地快照，再与服务器同步
+
     def add_filter_row(self):
         self.excel_editor.table.insertRow(0)  # 在表格顶部插入一行
+        SpanIndex.for_table(self.excel_editor.table).insert_rows(0)  # 合并单元格随之下移
         for col in range(self.excel_editor.table.columnCount()):
             header_item = self.excel_editor.table.item(0, col)
             if header_item:
@@ -105,35 +102,74 @@ class SecondPage(QMainWindow):
             self.excel_editor.table.setCellWidget(0, col, button)  # 将按钮设置为单元格小部件
 
     def show_filter_dialog(self, col):
-        data = self.initial_df.iloc[:, col].tolist()  # 获取列数据
+        if self.filter_engine is None:
+            return  # 数据还没有加载完成
+        values = self.filter_engine.column_values(col)  # 获取列中不重复的值（显示文本）
+        counts = self.filter_engine.column_counts(col)  # 每个值出现的行数（按列缓存）
         selected_items = self.filter_conditions.get(col, [])  # 获取当前筛选条件
-        dialog = FilterDialog(col, data, selected_items, self)
+        dialog = FilterDialog(col, values, counts, selected_items, self)
         if dialog.exec():
             selected_items = dialog.get_selected_items()  # 获取选择的筛选项目
             self.filter_conditions[col] = selected_items  # 更新筛选条件
             self.apply_filters()
 
     def sort_column(self, col, ascending):
-        self.sort_conditions[col] = ascending  # 更新排序条件
+        # 最近点击的列成为主排序键，之前的排序条件依次作为次要键
+        self.sort_conditions = [(col, ascending)] + [key for key in self.sort_conditions if key[0] != col]
         self.apply_filters()
 
     def apply_filters(self):
-        filtered_df = apply_filters(self.initial_df, self.filter_conditions, self.sort_conditions)  # 应用筛选和排序
-        load_dataframe_to_table(filtered_df, self.excel_editor.table, [str(i+1) for i in range(self.columns)], self.is_admin, self.styles)  # 将 DataFrame 加载到表格中
+        # 只重新计算变化的筛选列，只隐藏/显示可见性变化的行，不重建表格
+        if self.filter_engine is not None:
+            if not self.filter_engine.apply(self.filter_conditions, self.sort_conditions):
+                self.sort_conditions = list(self.filter_engine.sorts)  # 保持原来的排序
+                self.sheet_tasks.show_status('数据区域中有跨多行的合并单元格，不能排序', 5000)
 
     def save_to_db(self):
-        self.utils.save_to_db(self.excel_editor.table, self.is_admin)  # 保存数据到数据库
+        self.sheet_tasks.save(self.excel_editor.table, self.is_admin)  # 在后台保存数据到数据库
 
     def refresh_page(self):
-        table_data, colors, fonts, alignments, row_heights, col_widths = self.utils.load_data_from_db()
+        # 在后台检查数据库版本，只有数据变化时才重新加载；有筛选/排序时需要重新加载以恢复原始视图
+        self.sheet_tasks.refresh(self.excel_editor.table, force=bool(self.filter_conditions or self.sort_conditions))
+
+    def reopen_page(self):
+        # 从主窗口的页面缓存中重新显示：只在后台比对数据版本，数据未变化时保留表格、筛选和排序
+        self.sheet_tasks.reopen()
+
+    def on_data_loaded(self, result):
+        table_data, colors, fonts, alignments, row_heights, col_widths = result
+        self.columns = len(table_data[0])  # 确定表格的列数
+        headers = [str(i+1) for i in range(self.columns)]
         self.utils.set_table_data(self.excel_editor.table, table_data, colors, fonts, alignments, row_heights, col_widths, self.is_admin)  # 从数据库加载数据并更新表格
-        self.initial_df = table_to_dataframe(self.excel_editor.table, [str(i+1) for i in range(self.columns)], self.is_admin)  # 更新初始 DataFrame
+        self.initial_df = table_to_dataframe(self.excel_editor.table, headers, self.is_admin)  # 更新初始 DataFrame
         self.filter_conditions.clear()  # 清空筛选条件
-        self.styles = table_styles_to_dict(self.excel_editor.table, 1 if not self.is_admin else 0)  # 更新样式信息
+        self.sort_conditions.clear()  # 重新加载的表格按原始顺序显示
+
+        # 如果是用户模式，首次加载后添加筛选行
+        if not self.is_admin and not self.filter_row_added:
+            self.add_filter_row()
+            self.filter_row_added = True
+        self.create_filter_engine()
+
+    def create_filter_engine(self):
+        # 为加载的数据预先计算各列的值编号；数据行位于表格底部（上方可能有表头行/筛选行）
+        table = self.excel_editor.table
+        if self.filter_engine is not None:
+            self.filter_engine.detach()  # 显示之前筛选隐藏的行
+        self.filter_engine = FilterEngine(self.initial_df, table, table.rowCount() - len(self.initial_df))
+
+    def closeEvent(self, event):
+        self.sheet_tasks.close()  # 关闭窗口时写入未保存的修改并取消尚未完成的加载
+        super().closeEvent(event)
 
     def open_readonly_view(self):
-        self.readonly_page = ReadOnlySecondPage()  # 创建只读页面实例
+        if self.readonly_page is None:
+            self.readonly_page = ReadOnlySecondPage()  # 创建只读页面实例
+        elif not self.readonly_page.isVisible():
+            self.readonly_page.reopen_page()  # 复用关闭的只读页面，只比对数据版本
         self.readonly_page.show()  # 显示只读页面
+        self.readonly_page.raise_()
+        self.readonly_page.activateWindow()
 
 class ReadOnlySecondPage(QMainWindow):
     def __init__(self):
@@ -141,13 +177,24 @@ class ReadOnlySecondPage(QMainWindow):
         self.utils = PageUtils('second_page')  # 创建 PageUtils 实例，用于处理与第二页相关的数据库操作
         self.initial_df = None  # 保存初始加载的 DataFrame
         self.filter_conditions = {}  # 保存筛选条件
-        self.sort_conditions = {}  # 保存排序条件
-        self.styles = {}  # 保存样式信息
+        self.sort_conditions = []  # 排序条件 [(列, 是否升序)]，第一个为主排序键
+        self.filter_engine = None  # 筛选引擎，数据加载完成后创建
+        self.columns = DEFAULT_COLUMNS  # 列数，数据加载完成后更新
+        self.filter_row_added = False  # 筛选行只在首次加载完成后添加
+        self.paged = False  # 表格较大时在服务器端筛选和排序，只下载匹配的一页
+        self.query_loaded = 0  # 分页显示时已显示的匹配行数
+        self.query_total = 0  # 分页显示时匹配的总行数
+        self.sheet_tasks = SheetTaskRunner(self.utils, self)  # 后台读取数据库，避免界面卡顿
+        self.sheet_tasks.loaded.connect(self.on_data_loaded)
+        self.sheet_tasks.size_checked.connect(self.on_size_checked)
+        self.sheet_tasks.queried.connect(self.on_rows_queried)
+        self.sheet_tasks.values_queried.connect(self.open_filter_dialog)
         self.init_ui()  # 初始化用户界面
 
     def init_ui(self):
         self.setWindowTitle('第二页（只读）')  # 设置窗口标题
         self.setGeometry(100, 100, 800, 600)  # 设置窗口位置和大小
+        self.sheet_tasks.attach_status_bar(self.statusBar())  # 在状态栏显示加载进度
 
         central_widget = QWidget()
         self.setCentralWidget(central_widget)  # 创建中央组件并设置为中央部件
@@ -155,33 +202,60 @@ class ReadOnlySecondPage(QMainWindow):
         layout = QVBoxLayout()
         central_widget.setLayout(layout)  # 创建垂直布局并设置为中央组件的布局
 
-        # 从数据库加载数据
-        table_data, colors, fonts, alignments, row_heights, col_widths = self.utils.load_data_from_db()
-        self.styles = {'colors': colors, 'fonts': fonts, 'alignments': alignments}  # 保存样式信息
-
-        # 更新列数和表头
-        self.columns = len(table_data[0])  # 确定表格的列数
-        headers = [str(i+1) for i in range(self.columns)]  # 生成表头
+        headers = [str(i+1) for i in range(self.columns)]  # 生成表头，数据加载后按实际列数更新
 
         # 创建ReadOnlyExcelEditor
         self.excel_editor = ReadOnlyExcelEditor(columns=self.columns, headers=headers)  # 创建只读的 Excel 编辑器
         layout.addWidget(self.excel_editor)  # 将编辑器添加到布局中
 
-        # 加载数据到表格中
-        self.utils.set_table_data(self.excel_editor.table, table_data, self.styles['colors'], self.styles['fonts'], self.styles['alignments'], row_heights, col_widths, False)
-
-        # 将表格数据转换为 DataFrame 并保存
-        self.initial_df = table_to_dataframe(self.excel_editor.table, headers, False)  # 转换为 DataFrame 并保存
-        self.styles = table_styles_to_dict(self.excel_editor.table, 1)  # 保存样式信息
-
-        self.add_filter_row()  # 添加筛选行
-
         # 添加刷新按钮
         refresh_button = QPushButton('刷新')
         refresh_button.clicked.connect(self.refresh_page)  # 连接按钮点击事件
         layout.addWidget(refresh_button)  # 添加按钮到布局中
 
-        self.refresh_page()  # 处理完数据后调用刷新方法
+        # 滚动到底部时分页显示的表格继续下载下一页
+        self.excel_editor.table.verticalScrollBar().valueChanged.connect(self.on_table_scrolled)
+        self.sheet_tasks.check_size()  # 先查询行数，决定整表加载还是服务器端分页
+
+    def on_size_checked(self, rows):
+        # 数据行数超过 QUERY_MODE_ROWS 的表格不下载整张表格，在服务器端筛选和排序，按页显示
+        if rows is not None and rows > QUERY_MODE_ROWS:
+            self.paged = True
+            self.query_page(0)
+        else:
+            self.sheet_tasks.open()  # 先显示本地快照，再在后台与服务器同步
+
+    def query_page(self, skip):
+        self.sheet_tasks.query(self.filter_conditions, self.sort_conditions, skip, self.excel_editor.table.default_style())
+
+    def on_table_scrolled(self, value):
+        scroll_bar = self.excel_editor.table.verticalScrollBar()
+        if (self.paged and value >= scroll_bar.maximum() and self.query_loaded < self.query_total
+                and not self.sheet_tasks.is_querying()):
+            self.query_page(self.query_loaded)
+
+    def on_rows_queried(self, result, skip):
+        # 显示服务器端筛选的一页：第一页替换表格中的数据行，之后的页追加到末尾；表格首行为筛选行
+        rows, styles, header_row, col_widths, total = result
+        table = self.excel_editor.table
+        if skip == 0:
+            self.columns = len(header_row) or self.columns
+            table.setRowCount(1)
+            table.setColumnCount(self.columns)
+            if not self.filter_row_added:
+                self.add_filter_row()  # 添加筛选行
+                self.filter_row_added = True
+            for col in range(self.columns):
+                table.setHorizontalHeaderItem(col, QTableWidgetItem(header_row[col] if col < len(header_row) else ''))
+            for col_width in col_widths:
+                table.setColumnWidth(col_width['col'], col_width['width'])
+        elif skip != self.query_loaded:
+            return  # 筛选条件已改变，丢弃旧查询的结果
+        first_row = 1 + skip
+        table.setRowCount(first_row + len(rows))
+        table.set_rows(rows, first_row, {(first_row + row, col): style for (row, col), style in styles.items()})
+        self.query_loaded = skip + len(rows)
+        self.query_total = total
 
     def add_filter_row(self):
         for col in range(self.excel_editor.table.columnCount()):
@@ -219,25 +293,75 @@ class ReadOnlySecondPage(QMainWindow):
             self.excel_editor.table.setCellWidget(0, col, button)  # 将按钮设置为单元格小部件
 
     def show_filter_dialog(self, col):
-        data = self.initial_df.iloc[:, col].tolist()  # 获取列数据
+        if self.paged:
+            self.sheet_tasks.query_values(col)  # 在服务器端统计整列的取值，完成后打开筛选对话框
+            return
+        if self.filter_engine is None:
+            return  # 数据还没有加载完成
+        values = self.filter_engine.column_values(col)  # 获取列中不重复的值（显示文本）
+        counts = self.filter_engine.column_counts(col)  # 每个值出现的行数（按列缓存）
+        self.open_filter_dialog(col, (values, counts))
+
+    def open_filter_dialog(self, col, values_counts):
+        values, counts = values_counts
         selected_items = self.filter_conditions.get(col, [])  # 获取当前筛选条件
-        dialog = FilterDialog(col, data, selected_items, self)
+        dialog = FilterDialog(col, values, counts, selected_items, self)
         if dialog.exec():
             selected_items = dialog.get_selected_items()  # 获取选择的筛选项目
             self.filter_conditions[col] = selected_items  # 更新筛选条件
             self.apply_filters()
 
     def sort_column(self, col, ascending):
-        self.sort_conditions[col] = ascending  # 更新排序条件
+        # 最近点击的列成为主排序键，之前的排序条件依次作为次要键
+        self.sort_conditions = [(col, ascending)] + [key for key in self.sort_conditions if key[0] != col]
         self.apply_filters()
 
     def apply_filters(self):
-        filtered_df = apply_filters(self.initial_df, self.filter_conditions, self.sort_conditions)  # 应用筛选和排序
-        load_dataframe_to_table(filtered_df, self.excel_editor.table, [str(i+1) for i in range(self.columns)], False, self.styles)  # 将 DataFrame 加载到表格中
+        # 只重新计算变化的筛选列，只隐藏/显示可见性变化的行，不重建表格；分页显示时在服务器端重新查询第一页
+        if self.paged:
+            self.query_page(0)
+        elif self.filter_engine is not None:
+            if not self.filter_engine.apply(self.filter_conditions, self.sort_conditions):
+                self.sort_conditions = list(self.filter_engine.sorts)  # 保持原来的排序
+                self.sheet_tasks.show_status('数据区域中有跨多行的合并单元格，不能排序', 5000)
 
     def refresh_page(self):
-        table_data, colors, fonts, alignments, row_heights, col_widths = self.utils.load_data_from_db()
+        # 在后台检查数据库版本，只有数据变化时才重新加载；有筛选/排序时需要重新加载以恢复原始视图
+        # 分页显示时清除筛选和排序，重新查询第一页
+        if self.paged:
+            self.filter_conditions.clear()
+            self.sort_conditions.clear()
+            self.query_page(0)
+        else:
+            self.sheet_tasks.refresh(self.excel_editor.table, force=bool(self.filter_conditions or self.sort_conditions))
+
+    def reopen_page(self):
+        # 从主窗口的页面缓存中重新显示：只在后台比对数据版本，数据未变化时保留表格、筛选和排序；
+        # 分页显示时按当前的筛选和排序重新查询第一页
+        if self.paged:
+            self.query_page(0)
+        else:
+            self.sheet_tasks.reopen()
+
+    def on_data_loaded(self, result):
+        table_data, colors, fonts, alignments, row_heights, col_widths = result
+        self.columns = len(table_data[0])  # 确定表格的列数
         self.utils.set_table_data(self.excel_editor.table, table_data, colors, fonts, alignments, row_heights, col_widths, False)  # 从数据库加载数据并更新表格
         self.initial_df = table_to_dataframe(self.excel_editor.table, [str(i+1) for i in range(self.columns)], False)  # 更新初始 DataFrame
         self.filter_conditions.clear()  # 清空筛选条件
-        self.styles = table_styles_to_dict(self.excel_editor.table, 1)  # 更新样式信息
+        self.sort_conditions.clear()  # 重新加载的表格按原始顺序显示
+        if not self.filter_row_added:
+            self.add_filter_row()  # 添加筛选行
+            self.filter_row_added = True
+        self.create_filter_engine()
+
+    def create_filter_engine(self):
+        # 为加载的数据预先计算各列的值编号；数据行位于表格底部（首行为筛选行）
+        table = self.excel_editor.table
+        if self.filter_engine is not None:
+            self.filter_engine.detach()  # 显示之前筛选隐藏的行
+        self.filter_engine = FilterEngine(self.initial_df, table, table.rowCount() - len(self.initial_df))
+
+    def closeEvent(self, event):
+        self.sheet_tasks.close()  # 关闭窗口时写入未保存的修改并取消尚未完成的加载
+        super().closeEvent(event)
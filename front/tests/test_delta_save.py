@@ -0,0 +1,98 @@
+import os
+import unittest
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')  # 不需要显示器
+from PySide6.QtWidgets import QApplication, QTableWidget, QTableWidgetItem
+from PySide6.QtGui import QColor
+from basic_function.change_tracker import ChangeTracker
+from basic_function.utils import PageUtils
+from window.database import make_operation, apply_operations
+
+# 增量保存的往返：整表编码后修改表格，把 build_delta 生成的操作叠加到已保存的文档上，
+# 解码结果应与直接整表编码修改后的表格相同（包括操作中新增的样式）。只编码和解码，不访问数据库
+# 用法（在 front 目录下）: python -m unittest discover -s tests
+
+app = QApplication.instance() or QApplication([])
+
+BLOCK_SIZE = 2  # 小行块，修改跨越多个行块
+
+
+def make_table(rows=5, columns=3):
+    table = QTableWidget(rows, columns)
+    for row in range(rows):
+        for col in range(columns):
+            table.setItem(row, col, QTableWidgetItem(f'r{row}c{col}'))
+    table.item(0, 0).setBackground(QColor('#ff0000'))
+    return table
+
+
+def set_color(table, row, col, color):
+    table.item(row, col).setBackground(QColor(color))
+    ChangeTracker.for_table(table).mark_style(row, col)
+
+
+def set_text(table, row, col, text):
+    table.item(row, col).setText(text)
+    ChangeTracker.for_table(table).mark_cell(row, col)
+
+
+def decoded(document):
+    table_data, colors, fonts, alignments, row_heights, col_widths = PageUtils('test_delta_save').decode_document(document)
+    return table_data, colors, fonts, alignments, sorted(row_heights, key=str), col_widths
+
+
+class DeltaSaveTest(unittest.TestCase):
+    def setUp(self):
+        self.table = make_table()
+        self.utils = PageUtils('test_delta_save')
+        self.utils.block_size = BLOCK_SIZE
+        self.document = dict(self.utils.table_to_document(self.table, True), block_size=BLOCK_SIZE)
+        self.utils.decode_document(self.document)  # 与加载后的状态相同：样式表、默认样式和行列数
+        self.utils.has_document = True
+        ChangeTracker.for_table(self.table).mark_synced()
+
+    def save_delta(self):
+        tracker = ChangeTracker.for_table(self.table)
+        self.assertTrue(self.utils.can_save_delta(self.table, True, tracker))
+        header_fields, block_updates, palette = self.utils.build_delta(self.table, True, tracker)
+        tracker.mark_synced()
+        return make_operation(header_fields, block_updates, palette)
+
+    def assert_matches_table(self, document):
+        expected = self.utils.table_to_document(self.table, True)
+        self.assertEqual(decoded(document), decoded(expected))
+
+    def test_text_and_column_width(self):
+        set_text(self.table, 1, 0, 'changed')
+        set_text(self.table, 4, 2, '')
+        self.table.setColumnWidth(1, 150)
+        ChangeTracker.for_table(self.table).mark_col_width(1)
+        operation = self.save_delta()
+        self.assertEqual([block_id for block_id, _ in operation['blocks']], [0, 2])
+        self.assert_matches_table(apply_operations(self.document, [operation]))
+
+    def test_new_styles_travel_with_the_operation(self):
+        set_color(self.table, 1, 1, '#00ff00')
+        set_color(self.table, 3, 0, '#ff0000')  # 样式表中已有的样式
+        operation = self.save_delta()
+        self.assertEqual([entry['color'] for entry in operation['palette']], ['#00ff00'])
+        self.assertEqual(self.utils.style_palette.entries, self.document['style_palette'])  # 表头的样式表不变
+        self.assert_matches_table(apply_operations(self.document, [operation]))
+
+    def test_consecutive_deltas(self):
+        set_color(self.table, 1, 1, '#00ff00')
+        first = self.save_delta()
+        set_color(self.table, 4, 1, '#0000ff')
+        set_text(self.table, 2, 2, 'x')
+        second = self.save_delta()
+        document = apply_operations(self.document, [first, second])
+        self.assertEqual([entry['color'] for entry in document['style_palette']], ['#ff0000', '#00ff00', '#0000ff'])
+        self.assert_matches_table(document)
+
+    def test_structure_change_needs_full_save(self):
+        self.table.insertRow(0)
+        ChangeTracker.for_table(self.table).mark_structure()
+        self.assertFalse(self.utils.can_save_delta(self.table, True, ChangeTracker.for_table(self.table)))
+
+
+if __name__ == '__main__':
+    unittest.main()
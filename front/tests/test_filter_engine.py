@@ -0,0 +1,78 @@
+import os
+import unittest
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')  # 不需要显示器
+from PySide6.QtWidgets import QApplication, QTableWidget, QTableWidgetItem
+from basic_function.filter_engine import FilterEngine
+from basic_function.filter_operations import table_to_dataframe
+from basic_function.span_index import SpanIndex
+
+# 筛选引擎：按值编号筛选、多键排序（空值排在最后）、每列的不重复值和计数，以及修改单元格后只重新计算该列
+# 表格首行为表头行，与用户视图相同
+# 用法（在 front 目录下）: python -m unittest discover -s tests
+
+app = QApplication.instance() or QApplication([])
+
+ROWS = [['名称', '数量'], ['b', '10'], ['a', '9'], ['b', ''], ['c', '9'], ['a', '100']]
+
+
+def make_engine(rows=ROWS):
+    table = QTableWidget(len(rows), 2)
+    for row, values in enumerate(rows):
+        for col, text in enumerate(values):
+            table.setItem(row, col, QTableWidgetItem(text))
+    df = table_to_dataframe(table, ['1', '2'], False)
+    return table, FilterEngine(df, table, 1)
+
+
+def shown(table, col=0):
+    return [table.item(row, col).text() for row in range(1, table.rowCount()) if not table.isRowHidden(row)]
+
+
+class FilterEngineTest(unittest.TestCase):
+    def test_values_and_counts(self):
+        _, engine = make_engine()
+        self.assertEqual(list(engine.column_values(0)), ['a', 'b', 'c'])
+        self.assertEqual(list(engine.column_counts(0)), [2, 2, 1])
+        self.assertEqual(list(engine.column_values(1)), ['9', '10', '100'])  # 整数列按数值排序
+
+    def test_filter_hides_rows(self):
+        table, engine = make_engine()
+        self.assertTrue(engine.apply({0: ['a', 'c']}, []))
+        self.assertEqual(shown(table), ['a', 'c', 'a'])
+        engine.apply({0: ['a', 'c'], 1: ['9']}, [])
+        self.assertEqual(shown(table), ['a', 'c'])
+        engine.apply({}, [])
+        self.assertEqual(shown(table), ['b', 'a', 'b', 'c', 'a'])
+
+    def test_sort_keys_and_blanks_last(self):
+        table, engine = make_engine()
+        engine.apply({}, [(1, False)])
+        self.assertEqual(shown(table, 1), ['100', '10', '9', '9', ''])
+        engine.apply({}, [(0, True), (1, True)])  # 第一个为主排序键，相同时按数量
+        self.assertEqual([(a, b) for a, b in zip(shown(table, 0), shown(table, 1))],
+                         [('a', '9'), ('a', '100'), ('b', '10'), ('b', ''), ('c', '9')])
+        engine.apply({}, [])
+        self.assertEqual(shown(table), ['b', 'a', 'b', 'c', 'a'])
+
+    def test_filter_after_sort_uses_original_rows(self):
+        table, engine = make_engine()
+        engine.apply({}, [(1, True)])
+        engine.apply({0: ['b']}, [(1, True)])
+        self.assertEqual(shown(table, 1), ['10', ''])
+
+    def test_edited_column_is_recounted(self):
+        table, engine = make_engine()
+        engine.column_counts(0)
+        table.item(1, 0).setText('c')
+        self.assertEqual(list(engine.column_counts(0)), [2, 1, 2])
+
+    def test_row_spans_block_sorting(self):
+        table, engine = make_engine()
+        SpanIndex.for_table(table).merge(1, 0, 2, 0)
+        self.assertFalse(engine.apply({0: ['b']}, [(1, True)]))
+        self.assertEqual(engine.sorts, [])
+        self.assertEqual(shown(table), ['b', 'b'])  # 筛选照常应用
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from window.sheet_cache import SheetCache, InMemoryRedis
+
+# SheetCache 的命中、未命中和按版本号失效，使用进程内的 InMemoryRedis，不需要 redis-server
+# 用法（在 front 目录下）: python -m unittest discover -s tests
+
+
+class BrokenRedis:
+    # 每个命令都出错，模拟 Redis 不可用
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError('redis is down')
+        return fail
+
+
+class SheetCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = SheetCache(client=InMemoryRedis())
+        self.document = {'rows': 1, 'columns': 2, 'data': [['a', 'b']], 'revision': 3}
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.get('db', 'sheet'))
+
+    def test_hit(self):
+        self.cache.put('db', 'sheet', self.document)
+        self.assertEqual(self.cache.get('db', 'sheet'), self.document)
+        self.assertIsNone(self.cache.get('db', 'other'))
+
+    def test_newer_revision_invalidates_snapshot(self):
+        # 增量保存后只更新版本号，旧版本的快照不再返回
+        self.cache.put('db', 'sheet', self.document)
+        self.cache.mark_revision('db', 'sheet', 4)
+        self.assertIsNone(self.cache.get('db', 'sheet'))
+
+    def test_older_snapshot_does_not_overwrite(self):
+        # 仍在读取旧版本的客户端不会把旧快照写回
+        self.cache.mark_revision('db', 'sheet', 4)
+        self.cache.put('db', 'sheet', self.document)
+        self.assertIsNone(self.cache.get('db', 'sheet'))
+        newer = dict(self.document, revision=4)
+        self.cache.put('db', 'sheet', newer)
+        self.assertEqual(self.cache.get('db', 'sheet'), newer)
+
+    def test_invalidate(self):
+        self.cache.put('db', 'sheet', self.document)
+        self.cache.invalidate('db', 'sheet')
+        self.assertIsNone(self.cache.get('db', 'sheet'))
+
+    def test_unavailable_redis_falls_back(self):
+        cache = SheetCache(client=BrokenRedis())
+        cache.put('db', 'sheet', self.document)
+        self.assertIsNone(cache.get('db', 'sheet'))
+        self.assertFalse(cache.available())  # 出错后暂停使用，调用方直接读取 MongoDB
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+from window.database import (split_document, merge_blocks, make_operation, apply_operation, apply_operations,
+                             intern_palette)
+
+# 行块存储的编码：整表拆分为表头和行块再组装、增量操作的叠加（新样式表条目、已合并操作的跳过）
+# 只测试纯函数，不需要 MongoDB
+# 用法（在 front 目录下）: python -m unittest discover -s tests
+
+RED = {'color': '#ff0000', 'bold': False, 'size': 9, 'alignment': 0}
+GREEN = {'color': '#00ff00', 'bold': False, 'size': 9, 'alignment': 0}
+
+
+def sample_document(rows=5):
+    return {
+        'rows': rows, 'columns': 2,
+        'data': [[f'r{row}c0', f'r{row}c1'] for row in range(rows)],
+        'row_ids': list(range(10, 10 + rows)),
+        'next_row_id': 10 + rows,
+        'spans': [{'row': 0, 'column': 0, 'row_span': 1, 'column_span': 2}],
+        'style_palette': [RED],
+        'default_style': {'color': '#ffffff', 'bold': False, 'size': 9, 'alignment': 0},
+        'style_runs': [[1, 0, 2, 0], [3, 1, 1, 0]],
+        'row_height_runs': [[1, 3, 40]],
+        'col_widths': [{'col': 0, 'width': 80}, {'col': 0, 'width': 120}],
+    }
+
+
+class SplitMergeTest(unittest.TestCase):
+    def test_roundtrip(self):
+        document = sample_document()
+        header, blocks = split_document(document, block_size=2)
+        self.assertEqual(header['block_count'], 3)
+        self.assertEqual([block['data'] for block in blocks][2], [['r4c0', 'r4c1']])
+        self.assertEqual(blocks[1]['row_ids'], [12, 13])
+        merged = merge_blocks(header, blocks)
+        for field in ('data', 'row_ids', 'spans', 'style_palette', 'style_runs', 'next_row_id'):
+            self.assertEqual(merged[field], document[field], field)
+
+    def test_row_height_runs_split_at_block_boundary(self):
+        header, blocks = split_document(sample_document(), block_size=2)
+        self.assertEqual(blocks[0]['row_height_runs'], [[1, 1, 40]])
+        self.assertEqual(blocks[1]['row_height_runs'], [[2, 2, 40]])
+
+    def test_col_widths_keep_last_entry_per_column(self):
+        header, _ = split_document(sample_document())
+        self.assertEqual(header['col_widths'], [{'col': 0, 'width': 120}])
+
+    def test_missing_row_ids_are_padded(self):
+        # 旧数据的行块没有行标识
+        header, blocks = split_document(sample_document(4), block_size=2)
+        del blocks[0]['row_ids']
+        self.assertEqual(merge_blocks(header, blocks)['row_ids'], [None, None, 12, 13])
+
+
+class ApplyOperationTest(unittest.TestCase):
+    def setUp(self):
+        header, blocks = split_document(sample_document(), block_size=2)
+        self.header = header
+        self.blocks = {block['block']: block for block in blocks}
+
+    def test_sets_cells_and_header_fields(self):
+        operation = make_operation({'col_widths.0': {'col': 0, 'width': 60}}, {1: {'data.1.0': 'X'}})
+        apply_operation(self.header, self.blocks, operation)
+        self.assertEqual(self.blocks[1]['data'][1], ['X', 'r3c1'])
+        self.assertEqual(self.header['col_widths'][0]['width'], 60)
+
+    def test_path_beyond_end_pads_with_none(self):
+        operation = make_operation({}, {2: {'data.1.1': 'new'}})
+        apply_operation(self.header, self.blocks, operation)
+        self.assertEqual(self.blocks[2]['data'][1], [None, 'new'])
+
+    def test_palette_entries_are_resolved(self):
+        # 操作中新增的样式以负数编号引用，叠加时追加到表头的样式表；已有的样式沿用原编号
+        operation = make_operation({}, {0: {'style_runs': [[0, 0, 1, -1], [1, 0, 1, -2], [1, 1, 1, 0]]}},
+                                   palette=[GREEN, RED])
+        apply_operation(self.header, self.blocks, operation)
+        self.assertEqual(self.header['style_palette'], [RED, GREEN])
+        self.assertEqual(self.blocks[0]['style_runs'], [[0, 0, 1, 1], [1, 0, 1, 0], [1, 1, 1, 0]])
+
+    def test_palette_does_not_modify_caller_header(self):
+        palette = self.header['style_palette']
+        intern_palette(self.header, [GREEN])
+        self.assertEqual(palette, [RED])
+
+    def test_operations_already_in_block_are_skipped(self):
+        # 合并写入行块后、推进 compacted 之前读取：行块的 revision 不小于操作序号时不再叠加
+        self.blocks[0]['revision'] = 7
+        old = dict(make_operation({}, {0: {'data.0.0': 'old'}, 1: {'data.0.0': 'other'}}), seq=7)
+        new = dict(make_operation({}, {0: {'data.0.1': 'new'}}), seq=8)
+        apply_operation(self.header, self.blocks, old)
+        apply_operation(self.header, self.blocks, new)
+        self.assertEqual(self.blocks[0]['data'][0], ['r0c0', 'new'])
+        self.assertEqual(self.blocks[1]['data'][0][0], 'other')
+
+    def test_partial_skips_blocks_not_read(self):
+        del self.blocks[2]
+        apply_operation(self.header, self.blocks, make_operation({}, {2: {'data.0.0': 'x'}}), partial=True)
+        self.assertNotIn(2, self.blocks)
+
+    def test_apply_operations_on_document(self):
+        operations = [make_operation({}, {0: {'data.0.0': 'a'}}), make_operation({}, {2: {'data.0.0': 'b'}})]
+        document = apply_operations(dict(sample_document(), block_size=2), operations)
+        self.assertEqual([row[0] for row in document['data']], ['a', 'r1c0', 'r2c0', 'r3c0', 'b'])
+        self.assertEqual(document['row_ids'], [10, 11, 12, 13, 14])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from basic_function.span_index import SpanIndex
+
+# 合并单元格索引的查找、扩展合并和插入/删除行列后的调整（不挂表格，只维护索引）
+# 用法（在 front 目录下）: python -m unittest discover -s tests
+
+
+def spans(*items):
+    return [{'row': row, 'column': col, 'row_span': row_span, 'column_span': col_span}
+            for row, col, row_span, col_span in items]
+
+
+class SpanIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = SpanIndex()
+        self.index.reset(spans((0, 0, 1, 2), (2, 1, 3, 2), (8, 0, 1, 1)))
+
+    def test_single_cells_are_not_kept(self):
+        self.assertEqual(len(self.index), 2)
+
+    def test_overlapping(self):
+        self.assertEqual(self.index.overlapping(4, 2, 6, 5), [(2, 1, 3, 2)])  # 起始行在区域上方的合并也能找到
+        self.assertEqual(self.index.overlapping(5, 0, 7, 5), [])
+        self.assertEqual(self.index.span_at(0, 1), (0, 0, 1, 2))
+        self.assertIsNone(self.index.span_at(1, 0))
+
+    def test_merge_absorbs_overlapping_spans(self):
+        self.assertEqual(self.index.merge(0, 1, 2, 1), (0, 0, 4, 2))
+        self.assertEqual(self.index.to_list(), spans((0, 0, 5, 3)))
+
+    def test_unmerge(self):
+        self.assertEqual(self.index.unmerge(3, 2, 3, 2), [(2, 1, 3, 2)])
+        self.assertEqual(self.index.to_list(), spans((0, 0, 1, 2)))
+
+    def test_insert_rows_inside_span_grows_it(self):
+        self.index.insert_rows(3, 2)
+        self.assertEqual(self.index.to_list(), spans((0, 0, 1, 2), (2, 1, 5, 2)))
+        self.index.insert_rows(0)
+        self.assertEqual(self.index.to_list(), spans((1, 0, 1, 2), (3, 1, 5, 2)))
+
+    def test_remove_rows_shrinks_or_drops_spans(self):
+        self.index.remove_rows(3, 2)
+        self.assertEqual(self.index.to_list(), spans((0, 0, 1, 2), (2, 1, 1, 2)))
+        self.index.remove_rows(1, 2)
+        self.assertEqual(self.index.to_list(), spans((0, 0, 1, 2)))  # 整个被删除
+        self.index.reset(spans((2, 1, 3, 2)))
+        self.index.remove_rows(1, 2)
+        self.assertEqual(self.index.to_list(), spans((1, 1, 2, 2)))  # 删除区域跨过合并的顶行
+
+    def test_remove_columns(self):
+        self.index.remove_columns(1)
+        self.assertEqual(self.index.to_list(), spans((2, 1, 3, 1)))  # 第一行的合并只剩一列，被移除
+
+    def test_permute_rows_moves_single_row_spans(self):
+        self.index.reset(spans((1, 0, 1, 2)))
+        self.index.permute_rows(1, [2, 0, 1])
+        self.assertEqual(self.index.to_list(), spans((2, 0, 1, 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import pandas as pd
+from basic_function.typed_data import infer_kind, typed_column, typed_dataframe, value_labels
+
+# 列类型推断和转换的边界情况：超出 int64 的长编号、含空值的整数列、超过 2^53 的整数
+# 用法（在 front 目录下）: python -m unittest discover -s tests
+
+
+def labels(column):
+    # 与筛选引擎相同：按值排序的不重复值的显示文本
+    _, uniques = pd.factorize(column, sort=True)
+    return list(value_labels(uniques))
+
+
+class TypedDataTest(unittest.TestCase):
+    def test_int_with_blanks(self):
+        column = typed_column(['3', '', ' 1 ', '2'])
+        self.assertEqual(str(column.dtype), 'Int64')
+        self.assertTrue(column.isna()[1])
+        self.assertEqual(labels(column), ['1', '2', '3'])
+
+    def test_int_without_blanks(self):
+        self.assertEqual(str(typed_column(['3', '-1']).dtype), 'int64')
+
+    def test_long_ids_are_not_integers(self):
+        ids = ['12345678901234567890', '12345678901234567891', '']
+        self.assertEqual(infer_kind(ids), 'text')
+        self.assertEqual(labels(typed_column(ids)), ['', '12345678901234567890', '12345678901234567891'])
+
+    def test_repeated_long_ids_are_categories(self):
+        ids = ['12345678901234567890', '12345678901234567890', '12345678901234567891', '12345678901234567891']
+        self.assertEqual(infer_kind(ids), 'category')
+
+    def test_large_ints_with_blanks_stay_exact(self):
+        # 超过 2^53 的整数经过 float 会合并为同一个值
+        column = typed_column(['9007199254740993', '9007199254740992', ''])
+        self.assertEqual(labels(column), ['9007199254740992', '9007199254740993'])
+
+    def test_forced_int_drops_values_that_do_not_fit(self):
+        column = typed_column(['1.6', 'x', '99999999999999999999', ''], 'int')
+        self.assertEqual(column[0], 2)
+        self.assertTrue(column[1:].isna().all())
+
+    def test_dataframe_with_blank_long_ids(self):
+        df = typed_dataframe([['12345678901234567890', ''], ['5', '']], ['编号', '数量'])
+        self.assertEqual(df.shape, (2, 2))
+        self.assertEqual(str(df['数量'].dtype), 'Int64')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import unittest
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')  # 不需要显示器
+from PySide6.QtWidgets import QApplication, QTableWidget, QTableWidgetItem, QTableWidgetSelectionRange
+from basic_function.basic_operations import BasicOperations
+from basic_function.merge_operations import MergeOperations
+from basic_function.row_ids import RowIds
+from basic_function.span_index import SpanIndex
+from basic_function.undo_stack import UndoStack
+
+# 撤销/重做合并单元格、删除行和添加行，以及重新插入的行恢复原来的行标识（否则保存时引用它们的行会失去引用）
+# 用法（在 front 目录下）: python -m unittest discover -s tests
+
+app = QApplication.instance() or QApplication([])
+
+
+def make_table(rows=4, columns=2):
+    table = QTableWidget(rows, columns)
+    for row in range(rows):
+        for col in range(columns):
+            table.setItem(row, col, QTableWidgetItem(f'r{row}c{col}'))
+    return table
+
+
+def texts(table, col=0):
+    return [table.item(row, col).text() if table.item(row, col) else '' for row in range(table.rowCount())]
+
+
+def select(table, top, left, bottom, right):
+    table.clearSelection()
+    table.setRangeSelected(QTableWidgetSelectionRange(top, left, bottom, right), True)
+
+
+class RowIdsTest(unittest.TestCase):
+    def test_follows_inserted_and_removed_rows(self):
+        table = make_table()
+        row_ids = RowIds.for_table(table)
+        row_ids.reset([10, 11, 12, 13], 14)
+        table.insertRow(1)
+        table.removeRow(3)
+        self.assertEqual(row_ids.ids, [10, 14, 11, 13])
+
+    def test_reference_rows_do_not_get_ids(self):
+        table = make_table(2)
+        row_ids = RowIds.for_table(table, assign=False)
+        row_ids.reset([5], 0)
+        table.insertRow(0)
+        self.assertEqual(row_ids.ids, [None, 5, None])
+
+
+class UndoStackTest(unittest.TestCase):
+    def setUp(self):
+        self.table = make_table()
+        self.row_ids = RowIds.for_table(self.table)
+        self.row_ids.reset([10, 11, 12, 13], 14)
+        self.stack = UndoStack.for_table(self.table)
+
+    def test_undo_redo_delete_rows_restores_row_ids(self):
+        select(self.table, 1, 0, 2, 1)
+        BasicOperations(self.table).delete_rows()
+        self.assertEqual(texts(self.table), ['r0c0', 'r3c0'])
+        self.stack.undo()
+        self.assertEqual(texts(self.table), ['r0c0', 'r1c0', 'r2c0', 'r3c0'])
+        self.assertEqual(self.row_ids.ids, [10, 11, 12, 13])
+        self.stack.redo()
+        self.assertEqual(self.row_ids.ids, [10, 13])
+
+    def test_redo_add_rows_keeps_first_row_id(self):
+        select(self.table, 0, 0, 0, 1)
+        BasicOperations(self.table).add_rows(True)
+        added = self.row_ids.ids[0]
+        self.stack.undo()
+        self.assertEqual(self.row_ids.ids, [10, 11, 12, 13])
+        self.stack.redo()
+        self.assertEqual(self.row_ids.ids, [added, 10, 11, 12, 13])
+
+    def test_undo_delete_rows_restores_spans(self):
+        SpanIndex.for_table(self.table).merge(1, 0, 3, 0)
+        select(self.table, 2, 0, 2, 1)
+        BasicOperations(self.table).delete_rows()
+        self.assertEqual(self.table.rowSpan(1, 0), 2)
+        self.stack.undo()
+        self.assertEqual(SpanIndex.for_table(self.table).to_list(),
+                         [{'row': 1, 'column': 0, 'row_span': 3, 'column_span': 1}])
+        self.assertEqual(self.table.rowSpan(1, 0), 3)
+
+    def test_undo_redo_merge(self):
+        select(self.table, 0, 0, 1, 1)
+        MergeOperations(self.table).merge_cells()
+        self.assertEqual((self.table.rowSpan(0, 0), self.table.columnSpan(0, 0)), (2, 2))
+        self.assertEqual(texts(self.table, 1)[:2], ['', ''])
+        self.stack.undo()
+        self.assertEqual((self.table.rowSpan(0, 0), self.table.columnSpan(0, 0)), (1, 1))
+        self.assertEqual(texts(self.table, 1)[:2], ['r0c1', 'r1c1'])
+        self.assertEqual(len(SpanIndex.for_table(self.table)), 0)
+        self.stack.redo()
+        self.assertEqual(SpanIndex.for_table(self.table).span_at(1, 1), (0, 0, 2, 2))
+        self.assertEqual(self.table.item(0, 0).text(), 'r0c0')
+
+    def test_small_edits_merge_into_one_step(self):
+        for text in ('a', 'ab'):
+            with self.stack.record('编辑') as step:
+                step.watch_cells([(0, 0)])
+                self.table.item(0, 0).setText(text)
+        self.stack.undo()
+        self.assertEqual(self.table.item(0, 0).text(), 'r0c0')
+        self.assertFalse(self.stack.can_undo())
+
+
+if __name__ == '__main__':
+    unittest.main()
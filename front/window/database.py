@@ -1,15 +1,687 @@
+import os
+import threading
 import pymongo
+from pymongo import UpdateOne, ReturnDocument
+from window.sheet_cache import get_sheet_cache
+from window.snapshot_store import get_snapshot_store
+
+# 连接配置：可通过环境变量覆盖，也可以在首次连接前调用 configure_client 修改
+MONGO_URI = os.environ.get('KPI_MONGO_URI', 'mongodb://localhost:27017/')
+CLIENT_OPTIONS = {
+    'maxPoolSize': int(os.environ.get('KPI_MONGO_MAX_POOL_SIZE', 20)),  # 连接池最大连接数
+    'minPoolSize': int(os.environ.get('KPI_MONGO_MIN_POOL_SIZE', 1)),  # 连接池保持的最少连接数
+    'serverSelectionTimeoutMS': int(os.environ.get('KPI_MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    'connectTimeoutMS': int(os.environ.get('KPI_MONGO_CONNECT_TIMEOUT_MS', 5000)),
+    'socketTimeoutMS': int(os.environ.get('KPI_MONGO_SOCKET_TIMEOUT_MS', 30000)),
+}
+
+# 进程内共享的 MongoClient（自带连接池），所有 MongoDBClient 实例共用，首次使用时才创建
+_shared_client = None
+_shared_client_lock = threading.Lock()
+_indexed_collections = set()  # 已确认建立 (sheet, block) 索引的集合
+
+# 表格按行分块存储：一个表头文档（_id 为 'header'）保存行列数、表头、合并、列宽等小数据，
+# 每个行块文档保存 BLOCK_SIZE 行的数据、样式和行高，避免单个文档超过 16 MB 的限制。
+# 需要行标识的表格在行块中另有与 data 对应的 row_ids（源表格为每行固定的编号，引用表格为所引用的源表格行编号）。
+# 表头中的 revision 在每次保存时加一，用作缓存的版本号。
+# 整表保存写入一组新的行块（generation 为该次保存的版本号），写完后才切换表头中的 generation，再删除旧的行块，
+# 读取时只读表头所指的一组行块；合并在行块中记录其内容对应的版本号（revision），只覆盖版本号更小的行块，读取时跳过行块已包含的操作
+HEADER_ID = 'header'
+BLOCK_SIZE = 500
+STORAGE_FORMAT = 3  # 2: 行块存储；3: 行块存储 + 紧凑样式编码
+# 行块中按行号归属的条目列表：旧格式的 colors/fonts/alignments/row_heights 为 {'row': ...} 字典，
+# 紧凑格式的 style_runs/row_height_runs 为列表，第一个元素是行号
+BLOCK_ENTRY_FIELDS = ('colors', 'fonts', 'alignments', 'row_heights', 'style_runs', 'row_height_runs')
+# 直接复制到表头文档的字段
+HEADER_FIELDS = ('headers', 'spans', 'style_palette', 'default_style', 'default_row_height', 'column_types', 'next_row_id')
+
+# 增量保存以操作的形式追加到操作日志集合（每个库一个），序号即保存后的版本号。
+# 表头中的 compacted 记录已合并进行块的最后一个序号，读取时把之后的操作叠加到行块上；
+# 未合并的操作达到 COMPACT_EVERY 条时由保存它的客户端合并
+OPS_COLLECTION = 'sheet_ops'
+COMPACT_EVERY = int(os.environ.get('KPI_COMPACT_EVERY', 50))
+# 读取期间表头被切换（其他客户端整表保存或合并完成）时重新读取的最多次数
+LOAD_ATTEMPTS = 5
+
+
+def configure_client(uri=None, **options):
+    # 修改连接地址和连接池/超时参数，必须在首次连接前调用
+    global MONGO_URI
+    with _shared_client_lock:
+        if _shared_client is not None:
+            raise RuntimeError('MongoDB client already created; configure it before the first connection')
+        if uri:
+            MONGO_URI = uri
+        CLIENT_OPTIONS.update(options)
+
+
+def get_shared_client():
+    # 获取进程内共享的 MongoClient，不存在时创建
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = pymongo.MongoClient(MONGO_URI, **CLIENT_OPTIONS)
+    return _shared_client
+
+
+def ping_server():
+    # 建立连接并完成服务器发现，由登录窗口的预热线程调用（见 login.warm_up_connection），
+    # 这样打开第一个页面时无需再等待连接
+    try:
+        get_shared_client().admin.command('ping')
+    except Exception as e:
+        print(f"MongoDB warm-up failed: {e}")
+
+
+def entry_row(entry):
+    return entry['row'] if isinstance(entry, dict) else entry[0]
+
+
+def split_row_runs(runs, block_size):
+    # 行高段可能跨越行块边界，按边界切开
+    for start, count, height in runs:
+        end = start + count
+        while start < end:
+            block_end = min(end, (start // block_size + 1) * block_size)
+            yield [start, block_end - start, height]
+            start = block_end
+
+
+def split_document(document, block_size=BLOCK_SIZE):
+    # 把完整的表格文档拆分为表头文档和行块文档
+    # 数据行按数据行号分块，样式/行高条目按其行号（表格行号）分块
+    data = document.get('data', [])
+    entries = {field: [entry for entry in document.get(field, []) if entry] for field in BLOCK_ENTRY_FIELDS}
+    entries['row_height_runs'] = list(split_row_runs(entries['row_height_runs'], block_size))
+    block_count = max(1, (len(data) + block_size - 1) // block_size)
+    for field_entries in entries.values():
+        for entry in field_entries:
+            block_count = max(block_count, entry_row(entry) // block_size + 1)
+
+    blocks = [{'block': i, 'data': data[i * block_size:(i + 1) * block_size]} for i in range(block_count)]
+    if 'row_ids' in document:
+        for block in blocks:
+            start = block['block'] * block_size
+            block['row_ids'] = document['row_ids'][start:start + len(block['data'])]
+    for field, field_entries in entries.items():
+        for entry in field_entries:
+            blocks[entry_row(entry) // block_size].setdefault(field, []).append(entry)
+
+    # 旧格式中每个 (行, 列) 都有一条列宽记录，后出现的生效，这里只保留每列一条
+    col_widths = {}
+    for col_width in document.get('col_widths', []):
+        if col_width:
+            col_widths[col_width['col']] = col_width['width']
+
+    header = {
+        'format': STORAGE_FORMAT,
+        'rows': document.get('rows', len(data)),
+        'columns': document.get('columns', len(data[0]) if data else 0),
+        'col_widths': [{'col': col, 'width': width} for col, width in sorted(col_widths.items())],
+        'block_size': block_size,
+        'block_count': block_count,
+    }
+    for field in HEADER_FIELDS:
+        if field in document:
+            header[field] = document[field]
+    header.setdefault('headers', [])
+    header.setdefault('spans', [])
+    return header, blocks
+
+
+def merge_blocks(header, blocks):
+    # 把表头文档和行块文档重新组装为完整的表格文档
+    document = {key: value for key, value in header.items() if key != '_id'}
+    document['data'] = []
+    for field in BLOCK_ENTRY_FIELDS:
+        document[field] = []
+    has_row_ids = any('row_ids' in block for block in blocks)
+    if has_row_ids:
+        document['row_ids'] = []
+    for block in sorted(blocks, key=lambda block: block['block']):
+        document['data'].extend(block.get('data', []))
+        if has_row_ids:
+            # 行标识与数据行一一对应，缺少的（旧数据）补 None
+            row_ids = list(block.get('row_ids', []))[:len(block.get('data', []))]
+            document['row_ids'].extend(row_ids + [None] * (len(block.get('data', [])) - len(row_ids)))
+        for field in BLOCK_ENTRY_FIELDS:
+            document[field].extend(block.get(field, []))
+    return document
+
+
+def make_operation(header_fields, block_updates, palette=None):
+    # 增量修改的存储格式：字段路径和值成对保存在列表中（MongoDB 文档的键不能包含 '.'）
+    # block_updates: {块号: {字段路径: 值}}
+    # palette: 操作中新增的样式，style_runs 中以负数编号引用（见 style_codec.OperationPalette）
+    operation = {
+        'header': [[path, value] for path, value in header_fields.items()],
+        'blocks': [[block_id, [[path, value] for path, value in fields.items()]]
+                   for block_id, fields in sorted(block_updates.items())],
+    }
+    if palette:
+        operation['palette'] = palette
+    return operation
+
+
+def set_path(document, path, value):
+    # 在内存中的文档上按点路径赋值，与 MongoDB 的 $set 行为一致（数组长度不足时补 None）
+    keys = path.split('.')
+    target = document
+    for index, key in enumerate(keys):
+        if isinstance(target, list):
+            key = int(key)
+            while len(target) <= key:
+                target.append(None)
+        if index == len(keys) - 1:
+            target[key] = value
+        else:
+            child = target[key] if isinstance(target, list) else target.get(key)
+            if child is None:
+                child = [] if keys[index + 1].isdigit() else {}
+                target[key] = child
+            target = child
+
+
+def intern_palette(header, entries):
+    # 把操作中新增的样式追加到表头的样式表（已有相同样式时沿用），返回 {操作中的负数编号: 样式表中的编号}
+    # 样式表只追加不修改，所有客户端按操作顺序叠加，得到的编号相同；替换为新列表，不修改调用方传入的表头
+    palette = list(header.get('style_palette') or [])
+    style_ids = {}
+    for offset, entry in enumerate(entries):
+        if entry in palette:
+            style_id = palette.index(entry)
+        else:
+            style_id = len(palette)
+            palette.append(entry)
+        style_ids[-offset - 1] = style_id
+    header['style_palette'] = palette
+    return style_ids
+
+
+def apply_operation(header, blocks, operation, partial=False):
+    # 把一条操作叠加到表头和行块上；blocks 为 {块号: 行块}，partial 为 True 时跳过未读取的行块
+    # 行块的版本号不小于操作序号时，行块已包含这条操作（合并写入了行块、还没有推进表头中的 compacted），不再叠加
+    for path, value in operation['header']:
+        set_path(header, path, value)
+    style_ids = intern_palette(header, operation['palette']) if operation.get('palette') else None
+    seq = operation.get('seq')
+    for block_id, fields in operation['blocks']:
+        block = blocks.get(block_id)
+        if block is None:
+            if partial:
+                continue
+            block = blocks[block_id] = {'block': block_id, 'data': []}
+        if seq is not None and block.get('revision', 0) >= seq:
+            continue
+        for path, value in fields:
+            if style_ids and path == 'style_runs':
+                value = [[row, start, length, style_ids.get(style_id, style_id)] for row, start, length, style_id in value]
+            set_path(block, path, value)
+
+
+def guarded_block_update(fields, revision):
+    # 合并写入行块字段的更新管道：只有行块中记录的版本号小于 revision（或行块还不存在）时才写入并记录 revision，
+    # 否则保持不变，合并了较少操作的一方不会覆盖其他客户端已写入的较新行块
+    newer = {'$lt': [{'$ifNull': ['$revision', -1]}, revision]}
+    update = {field: {'$cond': [newer, {'$literal': value}, '$' + field]} for field, value in fields.items()}
+    update['revision'] = {'$cond': [newer, revision, '$revision']}
+    return [{'$set': update}]
+
+
+def sort_value(row, col):
+    # 本地排序的键，与 MongoDB 的排序一致：缺少的值最小，数字小于文本，文本按字符编码比较
+    value = row[col] if col < len(row) else None
+    if value is None:
+        return (0, 0, '')
+    if isinstance(value, (int, float)):
+        return (1, value, '')
+    return (2, 0, str(value))
+
+
+def apply_operations(document, operations):
+    # 把操作叠加到完整的表格文档上，返回新的文档（用于本地日志中尚未提交的修改）
+    header, blocks = split_document(document, document.get('block_size', BLOCK_SIZE))
+    header['revision'] = document.get('revision', 0)
+    blocks = {block['block']: block for block in blocks}
+    for operation in operations:
+        apply_operation(header, blocks, operation)
+    return merge_blocks(header, blocks.values())
+
 
 class MongoDBClient:
-    def __init__(self, db_name='test_db'):
-        self.client = pymongo.MongoClient('mongodb://localhost:27017/')
+    def __init__(self, db_name='test_db', cache=None, snapshots=None):
+        self.client = get_shared_client()  # 使用进程内共享的连接池，而不是每次新建连接
         self.db = self.client[db_name]
+        self.cache = cache if cache is not None else get_sheet_cache()  # Redis 快照缓存，不可用时自动回退
+        self.snapshots = snapshots if snapshots is not None else get_snapshot_store()  # 本地磁盘快照
+
+    def snapshot_key(self, collection_name):
+        return f'{self.db.name}/{collection_name}'
+
+    def load_snapshot(self, collection_name):
+        # 读取本地磁盘上最近一次加载的表格快照，不访问服务器；没有快照时返回 None
+        return self.snapshots.get(self.snapshot_key(collection_name))
 
     def insert_data(self, collection_name, data):
         collection = self.db[collection_name]
-        collection.delete_many({})  # 清空集合中的旧数据
-        collection.insert_one(data)  # 插入新数据
+        # 整体替换文档，替换过程是原子的，不会出现集合为空的时间窗口
+        collection.replace_one({}, data, upsert=True)
 
     def get_data(self, collection_name):
         collection = self.db[collection_name]
         return collection.find_one()
+
+    def ensure_indexes(self, collection_name):
+        # 为行块查询建立 (sheet, block) 索引，每个集合只检查一次
+        key = (self.db.name, collection_name)
+        if key not in _indexed_collections:
+            self.db[collection_name].create_index([('sheet', pymongo.ASCENDING), ('block', pymongo.ASCENDING)])
+            _indexed_collections.add(key)
+        key = (self.db.name, OPS_COLLECTION)
+        if key not in _indexed_collections:
+            # 同一表格的操作序号唯一
+            self.db[OPS_COLLECTION].create_index([('sheet', pymongo.ASCENDING), ('seq', pymongo.ASCENDING)], unique=True)
+            _indexed_collections.add(key)
+
+    def get_header(self, collection_name):
+        collection = self.db[collection_name]
+        header = collection.find_one({'_id': HEADER_ID})
+        if header is None:
+            header = self.migrate_legacy_sheet(collection_name)
+        return header
+
+    def get_revision(self, collection_name):
+        # 只读取表头中的版本号，没有表头时返回 None
+        header = self.db[collection_name].find_one({'_id': HEADER_ID}, {'revision': 1})
+        return header.get('revision', 0) if header else None
+
+    def get_row_count(self, collection_name):
+        # 只读取表头中的数据行数，没有表头时返回 None
+        header = self.db[collection_name].find_one({'_id': HEADER_ID}, {'rows': 1})
+        return header.get('rows', 0) if header else None
+
+    def get_blocks(self, collection_name, header, block_ids=None, progress=None, fields=None):
+        # 读取行块，block_ids 为 None 时读取全部；progress(已读块数, 总块数) 在每读完一块后调用；fields 为只读取的字段
+        self.ensure_indexes(collection_name)
+        query = {'sheet': collection_name, 'generation': header.get('generation'), 'block': {'$lt': header['block_count']}}
+        if block_ids is not None:
+            query['block'] = {'$in': [block_id for block_id in block_ids if block_id < header['block_count']]}
+        total = header['block_count'] if block_ids is None else len(query['block']['$in'])
+        blocks = []
+        projection = dict({'_id': 0, 'block': 1}, **{field: 1 for field in fields}) if fields else {'_id': 0}
+        for block in self.db[collection_name].find(query, projection).sort('block', pymongo.ASCENDING):
+            blocks.append(block)
+            if progress:
+                progress(len(blocks), total)
+        return blocks
+
+    def load_sheet(self, collection_name, block_ids=None, progress=None):
+        # 读取表格，返回与旧单文档格式相同的字典；没有数据时返回 None
+        # 读取整表时先查 Redis 缓存，未命中再读 MongoDB 并写入缓存
+        if block_ids is None:
+            document = self.cache.get(self.db.name, collection_name)
+            # 只比对表头中的版本号（很小的查询），防止 Redis 曾不可用时其他客户端的保存没有同步到缓存
+            if document is not None and document.get('revision', 0) == self.get_revision(collection_name):
+                if progress:
+                    progress(1, 1)
+                self.snapshots.put(self.snapshot_key(collection_name), document)
+                return document
+        for _ in range(LOAD_ATTEMPTS):
+            header = self.get_header(collection_name)
+            if header is None:
+                return None
+            blocks = {block['block']: block for block in self.get_blocks(collection_name, header, block_ids, progress)}
+            wanted = range(header['block_count']) if block_ids is None else [i for i in block_ids if i < header['block_count']]
+            missing = any(block_id not in blocks for block_id in wanted)
+            # 叠加尚未合并进行块的操作，文档的版本号为最后一个叠加的操作序号
+            operations = self.get_operations(collection_name, header)
+            for operation in operations:
+                apply_operation(header, blocks, operation, partial=block_ids is not None)
+            if 'compacted' in header:
+                header['revision'] = operations[-1]['seq'] if operations else header['compacted']
+            # 读表头之后其他客户端完成了合并（行块比文档的版本新）或整表保存（所读的一组行块已被删除），重新读取
+            if any(block.get('revision', 0) > header.get('revision', 0) for block in blocks.values()):
+                continue
+            if missing and self.db[collection_name].find_one({'_id': HEADER_ID}, {'generation': 1}).get('generation') != header.get('generation'):
+                continue
+            break
+        document = merge_blocks(header, blocks.values())
+        if block_ids is None:
+            self.cache.put(self.db.name, collection_name, document)
+            self.snapshots.put(self.snapshot_key(collection_name), document)
+        return document
+
+    def get_operations(self, collection_name, header):
+        # 读取尚未合并的操作，按序号排列；遇到缺号（其他客户端正在写入）时停止，缺号之后的操作下次读取时再叠加
+        compacted = header.get('compacted')
+        if compacted is None:
+            return []
+        operations = []
+        query = {'sheet': collection_name, 'seq': {'$gt': compacted, '$lte': header.get('revision', 0)}}
+        for operation in self.db[OPS_COLLECTION].find(query, {'_id': 0}).sort('seq', pymongo.ASCENDING):
+            if operation['seq'] != compacted + len(operations) + 1:
+                break
+            operations.append(operation)
+        return operations
+
+    def read_pending(self, collection_name):
+        # 只读地读取表头和尚未合并的操作涉及的行块，并在内存中叠加这些操作（不写数据库）。
+        # 返回 (表头, {块号: 叠加后的行块}, 涉及的块号)；没有表格时返回 None
+        header = self.get_header(collection_name)
+        if header is None:
+            return None
+        operations = self.get_operations(collection_name, header)
+        touched = sorted({block_id for operation in operations for block_id, _ in operation['blocks']})
+        pending = {block['block']: block for block in self.get_blocks(collection_name, header, touched)}
+        for operation in operations:
+            apply_operation(header, pending, operation)
+        if 'compacted' in header:
+            header['revision'] = operations[-1]['seq'] if operations else header['compacted']
+        return header, pending, touched
+
+    def row_pipeline(self, collection_name, header, touched, first_row):
+        # 把表头所指的一组行块（不含 touched 中的行块）展开为 {row: 数据行号, data: 数据行} 的聚合阶段
+        block_size = header.get('block_size', BLOCK_SIZE)
+        return [
+            {'$match': {'sheet': collection_name, 'generation': header.get('generation'),
+                        'block': {'$lt': header['block_count'], '$nin': touched}}},  # 使用 (sheet, block) 索引
+            {'$project': {'_id': 0, 'block': 1, 'data': 1}},
+            {'$unwind': {'path': '$data', 'includeArrayIndex': 'offset'}},
+            {'$project': {'row': {'$add': [{'$multiply': ['$block', block_size]}, '$offset']}, 'data': 1}},
+            {'$match': {'row': {'$gte': first_row, '$lt': header.get('rows', 0)}}},
+        ]
+
+    def pending_rows(self, header, pending, first_row):
+        # 本地叠加了操作的行块中的 (数据行号, 数据行)，范围与 row_pipeline 相同
+        block_size = header.get('block_size', BLOCK_SIZE)
+        for block_id, block in pending.items():
+            for offset, row in enumerate(block.get('data') or []):
+                row_number = block_id * block_size + offset
+                if first_row <= row_number < header.get('rows', 0):
+                    yield row_number, row or []
+
+    def query_rows(self, collection_name, filter_conditions, sort_conditions, first_row=0, skip=0, limit=200):
+        # 在服务器端筛选和排序：把行块展开为数据行，只返回一页匹配的行；只读，不合并操作日志。
+        # filter_conditions: {列号: [允许的值]}；sort_conditions: [(列号, 是否升序)]，第一个为主排序键，相同时保持原有行顺序。
+        # 尚未合并的操作涉及的行块在本地叠加操作后筛选，再与服务器端的结果按同样的顺序归并。
+        # 返回 (文档, 匹配总数)：文档包含表头中的字段、这一页的数据行（row_numbers 为它们的数据行号）及其样式
+        # （样式的行号为页内序号），header_row 为第一个数据行（用户视图的表头）；没有表格时返回 (None, 0)
+        result = self.read_pending(collection_name)
+        if result is None:
+            return None, 0
+        header, pending, touched = result
+        # 空文本也匹配缺少的值（较短的行）
+        conditions = {col: list(values) + [None] if '' in values else list(values)
+                      for col, values in filter_conditions.items() if values}
+        pipeline = self.row_pipeline(collection_name, header, touched, first_row)
+        if conditions:
+            pipeline.append({'$match': {'$expr': {'$and': [{'$in': [{'$arrayElemAt': ['$data', col]}, values]}
+                                                           for col, values in conditions.items()]}}})
+        sort = {}
+        if sort_conditions:
+            pipeline.append({'$addFields': {f'sort_{col}': {'$arrayElemAt': ['$data', col]} for col, _ in sort_conditions}})
+            for col, ascending in sort_conditions:
+                sort[f'sort_{col}'] = pymongo.ASCENDING if ascending else pymongo.DESCENDING
+        sort['row'] = pymongo.ASCENDING  # 相同值保持原有行顺序
+        pipeline.append({'$sort': sort})
+        local = [(row_number, row) for row_number, row in self.pending_rows(header, pending, first_row)
+                 if all((row[col] if col < len(row) else None) in values for col, values in conditions.items())]
+        # 有本地的行时服务器端返回前 skip + limit 行，归并后再取这一页
+        server_skip = 0 if local else skip
+        pipeline.append({'$facet': {
+            'rows': [{'$skip': server_skip}, {'$limit': skip + limit - server_skip}, {'$project': {'row': 1, 'data': 1}}],
+            'total': [{'$count': 'count'}],
+        }})
+        result = next(self.db[collection_name].aggregate(pipeline, allowDiskUse=True))
+        total = (result['total'][0]['count'] if result['total'] else 0) + len(local)
+        rows = [(row['row'], row['data']) for row in result['rows']]
+        if local:
+            rows.extend(local)
+            rows.sort(key=lambda item: item[0])
+            for col, ascending in reversed(sort_conditions):
+                rows.sort(key=lambda item: sort_value(item[1], col), reverse=not ascending)  # 稳定排序，与服务器端的顺序相同
+            rows = rows[skip:skip + limit]
+        return self.page_document(collection_name, header, pending, rows, first_row), total
+
+    def page_document(self, collection_name, header, pending, rows, first_row):
+        # 组装一页查询结果：只读取这一页的行所在行块中的样式字段，样式的行号换成页内序号
+        block_size = header.get('block_size', BLOCK_SIZE)
+        positions = {row_number: index for index, (row_number, _) in enumerate(rows)}
+        block_ids = sorted({row_number // block_size for row_number in positions} - set(pending))
+        blocks = list(pending.values()) + self.get_blocks(collection_name, header, block_ids,
+                                                          fields=('colors', 'fonts', 'alignments', 'style_runs'))
+        document = {key: value for key, value in header.items() if key != '_id'}
+        document['data'] = [row for _, row in rows]
+        document['row_numbers'] = list(positions)
+        for field in ('colors', 'fonts', 'alignments'):
+            document[field] = [dict(entry, row=positions[entry['row']]) for block in blocks for entry in block.get(field, [])
+                               if entry and entry.get('row') in positions]
+        document['style_runs'] = [[positions[run[0]]] + list(run[1:]) for block in blocks for run in block.get('style_runs', [])
+                                  if run[0] in positions]
+        header_row = []
+        if first_row > 0:
+            if 0 in pending:
+                header_row = (pending[0].get('data') or [[]])[0]
+            else:
+                block = self.db[collection_name].find_one({'sheet': collection_name, 'generation': header.get('generation'), 'block': 0},
+                                                          {'_id': 0, 'data': {'$slice': 1}})
+                header_row = (block.get('data') or [[]])[0] if block else []
+        document['header_row'] = header_row or []
+        return document
+
+    def query_values(self, collection_name, col, first_row=0):
+        # 在服务器端统计一列中每个不重复值出现的行数（分页显示时的筛选对话框），只读；
+        # 返回按值排序的 (值列表, 计数列表)，缺少的值记为空文本
+        result = self.read_pending(collection_name)
+        if result is None:
+            return [], []
+        header, pending, touched = result
+        pipeline = self.row_pipeline(collection_name, header, touched, first_row)
+        pipeline.append({'$group': {'_id': {'$arrayElemAt': ['$data', col]}, 'count': {'$sum': 1}}})
+        counts = {}
+        for group in self.db[collection_name].aggregate(pipeline, allowDiskUse=True):
+            value = '' if group['_id'] is None else group['_id']
+            counts[value] = counts.get(value, 0) + group['count']
+        for _, row in self.pending_rows(header, pending, first_row):
+            value = row[col] if col < len(row) and row[col] is not None else ''
+            counts[value] = counts.get(value, 0) + 1
+        values = sorted(counts, key=lambda value: sort_value([value], 0))
+        return values, [counts[value] for value in values]
+
+    def save_sheet(self, collection_name, document, block_size=BLOCK_SIZE):
+        # 整表保存：先在表头中预留版本号（saving），以它为 generation 写入一组新的行块，再切换表头（同一次原子操作），
+        # 最后删除旧的行块和已作废的操作。预留的版本号没有对应的操作，切换表头之前其他客户端读到的仍是旧表格
+        self.ensure_indexes(collection_name)
+        collection = self.db[collection_name]
+        header, blocks = split_document(document, block_size)
+        header['sheet'] = collection_name
+        reserved = collection.find_one_and_update(
+            {'_id': HEADER_ID},
+            [{'$set': {'compacted': {'$ifNull': ['$compacted', {'$ifNull': ['$revision', 0]}]}}},
+             {'$set': {'revision': {'$add': [{'$ifNull': ['$revision', 0]}, 1]}}},
+             {'$set': {'saving': '$revision'}}],
+            {'revision': 1}, return_document=ReturnDocument.AFTER)
+        generation = header['generation'] = reserved['revision'] if reserved else 1
+        collection.insert_many([dict(block, sheet=collection_name, generation=generation) for block in blocks])
+        # 用更新管道在同一次原子操作中把 compacted 设为当前版本号，之前的操作不再叠加（$literal 防止值被当作字段路径）
+        fields = {key: {'$literal': value} for key, value in header.items()}
+        if reserved is None:
+            # 表格第一次保存，还没有表头
+            fields['revision'] = {'$add': [{'$ifNull': ['$revision', 0]}, 1]}
+            query = {'_id': HEADER_ID}
+        else:
+            # 之后有其他客户端预留了新的整表保存时不切换，以它为准
+            query = {'_id': HEADER_ID, 'saving': generation}
+        header = collection.find_one_and_update(query, [{'$set': fields}, {'$set': {'compacted': '$revision'}}],
+                                                upsert=reserved is None, return_document=ReturnDocument.AFTER)
+        if header is None:
+            # 本次保存已被取代：删除本次写入的行块，返回预留的版本号（与服务器上的版本不同，调用方下次刷新时重新读取）
+            collection.delete_many({'sheet': collection_name, 'block': {'$gte': 0}, 'generation': generation})
+            return dict(collection.find_one({'_id': HEADER_ID}), revision=generation)
+        # 表头的 generation 只会增大，比它小的行块（包括没有 generation 的旧行块）不会再被读取
+        collection.delete_many({'sheet': collection_name, 'block': {'$gte': 0}, 'generation': {'$not': {'$gte': generation}}})
+        self.db[OPS_COLLECTION].delete_many({'sheet': collection_name, 'seq': {'$lte': header['revision']}})
+        # 整表保存后直接把新快照写入缓存和本地磁盘
+        document = merge_blocks(header, blocks)
+        self.cache.put(self.db.name, collection_name, document)
+        self.snapshots.put(self.snapshot_key(collection_name), document)
+        return header
+
+    def append_operation(self, collection_name, operation):
+        # 增量保存：把修改作为一条操作追加到操作日志，不改写行块；版本号加一并作为操作序号
+        # 第一次追加时把 compacted 初始化为当前版本号（之前的保存都已在行块中）
+        self.ensure_indexes(collection_name)
+        header = self.db[collection_name].find_one_and_update(
+            {'_id': HEADER_ID},
+            [{'$set': {'compacted': {'$ifNull': ['$compacted', {'$ifNull': ['$revision', 0]}]}}},
+             {'$set': {'revision': {'$add': [{'$ifNull': ['$revision', 0]}, 1]}}}],
+            {'revision': 1, 'compacted': 1}, return_document=ReturnDocument.AFTER)
+        if header is None:
+            raise RuntimeError(f'Sheet {collection_name} has no header document')
+        self.db[OPS_COLLECTION].insert_one({
+            'sheet': collection_name,
+            'seq': header['revision'],
+            'header': operation['header'],
+            'blocks': operation['blocks'],
+            'palette': operation.get('palette', []),
+        })
+        # 缓存中的快照已过期，只更新版本号，下次读取时回源
+        self.cache.mark_revision(self.db.name, collection_name, header['revision'])
+        self.compact_if_needed(collection_name, header)
+        return header
+
+    def append_rows(self, collection_name, rows, row_ids=None):
+        # 在表格末尾追加数据行：在表头中原子地预留行号（多个客户端同时追加时得到不重叠的行号）并把版本号加一，
+        # 新行作为一条操作写入操作日志，不读取也不改写已有的行块；row_ids 为新行的行标识。返回 (第一个新行的数据行号, 表头)
+        self.ensure_indexes(collection_name)
+        count = len(rows)
+        width = max((len(row) for row in rows), default=0)
+        header = self.db[collection_name].find_one_and_update(
+            {'_id': HEADER_ID},
+            [{'$set': {'compacted': {'$ifNull': ['$compacted', {'$ifNull': ['$revision', 0]}]}}},
+             {'$set': {'revision': {'$add': [{'$ifNull': ['$revision', 0]}, 1]},
+                       'rows': {'$add': [{'$ifNull': ['$rows', 0]}, count]},
+                       'columns': {'$max': [{'$ifNull': ['$columns', 0]}, width]}}},
+             {'$set': {'block_count': {'$max': ['$block_count', {'$toInt': {'$ceil': {
+                 '$divide': ['$rows', {'$ifNull': ['$block_size', BLOCK_SIZE]}]}}}]}}}],
+            {'revision': 1, 'compacted': 1, 'rows': 1, 'block_size': 1}, return_document=ReturnDocument.AFTER)
+        if header is None:
+            if self.get_header(collection_name) is not None:
+                return self.append_rows(collection_name, rows, row_ids)  # 旧格式的表格刚刚迁移完成
+            # 表格还没有保存过：这些行就是整张表格
+            document = {'rows': count, 'columns': width, 'data': rows}
+            if row_ids is not None:
+                document['row_ids'] = list(row_ids)
+            return 0, self.save_sheet(collection_name, document)
+        first_row = header['rows'] - count
+        block_size = header.get('block_size', BLOCK_SIZE)
+        block_updates = {}
+        for index, row in enumerate(rows):
+            data_row = first_row + index
+            block_updates.setdefault(data_row // block_size, {})[f'data.{data_row % block_size}'] = row
+            if row_ids is not None:
+                block_updates[data_row // block_size][f'row_ids.{data_row % block_size}'] = row_ids[index]
+        operation = make_operation({}, block_updates)
+        self.db[OPS_COLLECTION].insert_one({
+            'sheet': collection_name,
+            'seq': header['revision'],
+            'header': operation['header'],
+            'blocks': operation['blocks'],
+        })
+        self.cache.mark_revision(self.db.name, collection_name, header['revision'])
+        self.compact_if_needed(collection_name, header)
+        return first_row, header
+
+    def update_references(self, collection_name, changes):
+        # 引用表格的物化：changes 为 {源表格行编号: 整行数据列表 或 {列号: 文本}}，
+        # 把引用了这些行、且内容与源表格不同的数据行更新为新值（作为一条操作写入）；没有需要更新的行时不写入，返回 None
+        header = self.get_header(collection_name)
+        if header is None or not changes:
+            return None
+        blocks = {block['block']: block for block in self.get_blocks(collection_name, header, fields=('row_ids', 'data', 'revision'))}
+        for operation in self.get_operations(collection_name, header):
+            apply_operation(dict(header), blocks, operation)
+        block_updates = {}
+        for block_id, block in blocks.items():
+            data = block.get('data') or []
+            for index, row_id in enumerate(block.get('row_ids') or []):
+                change = changes.get(row_id) if row_id is not None else None
+                if change is None:
+                    continue
+                row = (data[index] if index < len(data) else None) or []
+                if isinstance(change, dict):
+                    for col, text in change.items():
+                        if col >= len(row) or row[col] != text:
+                            block_updates.setdefault(block_id, {})[f'data.{index}.{col}'] = text
+                elif row != change:
+                    block_updates.setdefault(block_id, {})[f'data.{index}'] = change
+        if not block_updates:
+            return None
+        return self.append_operation(collection_name, make_operation({}, block_updates))
+
+    def compact_if_needed(self, collection_name, header):
+        # 未合并的操作达到 COMPACT_EVERY 条时合并；操作已经写入，合并失败不影响这次保存，下次追加操作时重试
+        if header['revision'] - header['compacted'] < COMPACT_EVERY:
+            return
+        try:
+            self.compact_operations(collection_name)
+        except pymongo.errors.PyMongoError as e:
+            print(f"Compaction of {collection_name} failed: {e}")
+
+    def compact_operations(self, collection_name):
+        # 把操作日志合并进行块：读取涉及的表头和行块，按顺序叠加操作（与读取表格时 apply_operation 的结果相同），
+        # 只写回被修改的顶层字段并在行块中记录最后一个操作序号；写完后推进 compacted 并删除已合并的操作。
+        # 只写表头所指的一组行块，且只覆盖版本号更小的行块；表头只在 compacted 未变时更新，与其他合并或整表保存同时进行时不会覆盖较新的内容。
+        # 不能把各操作的字段路径直接合并成一个 $set：整行路径 data.5 与之后的单元格路径 data.5.2 同时出现时
+        # MongoDB 拒绝更新，缺少中间层时 $set 创建的是嵌入文档而不是数组
+        collection = self.db[collection_name]
+        header = collection.find_one({'_id': HEADER_ID})
+        if header is None or 'compacted' not in header:
+            return
+        compacted = header['compacted']
+        operations = self.get_operations(collection_name, header)
+        if not operations:
+            return
+        block_ids = sorted({block_id for operation in operations for block_id, _ in operation['blocks']})
+        generation = header.get('generation')
+        blocks = {block['block']: block for block in collection.find({'sheet': collection_name, 'generation': generation,
+                                                                      'block': {'$in': block_ids}},
+                                                                     {'_id': 0})}
+        stored = set(blocks)
+        last_seq = operations[-1]['seq']
+        header_fields = set()
+        block_fields = {}
+        for operation in operations:
+            apply_operation(header, blocks, operation)
+            header_fields.update(path.split('.')[0] for path, _ in operation['header'])
+            if operation.get('palette'):
+                header_fields.add('style_palette')
+            for block_id, fields in operation['blocks']:
+                block_fields.setdefault(block_id, set()).update(path.split('.')[0] for path, _ in fields)
+        requests = []
+        for block_id, fields in block_fields.items():
+            if block_id not in stored:
+                fields.add('data')  # 追加的行落在还不存在的新行块中
+            update = guarded_block_update({field: blocks[block_id][field] for field in fields}, last_seq)
+            requests.append(UpdateOne({'sheet': collection_name, 'generation': generation, 'block': block_id}, update, upsert=True))
+        if requests:
+            collection.bulk_write(requests, ordered=True)
+        update = {'$set': dict({field: header[field] for field in header_fields}, compacted=last_seq)}
+        # 只有 compacted 未被其他客户端（合并或整表保存）推进时才更新表头；没有更新时保留操作，由推进了表头的一方删除
+        result = collection.update_one({'_id': HEADER_ID, 'compacted': compacted}, update)
+        if result.matched_count:
+            self.db[OPS_COLLECTION].delete_many({'sheet': collection_name, 'seq': {'$lte': last_seq}})
+        elif collection.find_one({'_id': HEADER_ID}, {'generation': 1}).get('generation') != generation:
+            # 期间有整表保存切换了表头，删除写到旧的一组行块中的内容
+            collection.delete_many({'sheet': collection_name, 'block': {'$gte': 0}, 'generation': generation})
+
+    def migrate_legacy_sheet(self, collection_name):
+        # 一次性迁移：把旧的单文档格式拆分为表头 + 行块，迁移完成后删除旧文档
+        collection = self.db[collection_name]
+        legacy = collection.find_one({'_id': {'$ne': HEADER_ID}, 'block': {'$exists': False}})
+        if legacy is None:
+            return None
+        header = self.save_sheet(collection_name, legacy)
+        collection.delete_one({'_id': legacy['_id']})
+        return header
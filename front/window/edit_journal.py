@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+from urllib.parse import quote
+from window.snapshot_store import default_cache_dir
+
+# 本地预写日志：表格的修改在提交到服务器之前先追加到本地文件（每行一条 JSON），
+# 程序崩溃或未保存就关闭时，下次打开表格会把日志中的修改重新叠加到数据上；提交成功后从日志中删除
+#   {'id': 序号, 'kind': 'update', 'payload': 增量操作}   见 database.make_operation
+#   {'id': 序号, 'kind': 'replace', 'payload': 完整文档}  行列结构改变后的整表写入
+
+
+class EditJournal:
+    def __init__(self, key, directory=None):
+        directory = directory or os.path.join(default_cache_dir(), 'journal')
+        self.path = os.path.join(directory, quote(key, safe='') + '.jsonl')
+        self.lock = threading.Lock()  # 界面线程追加，保存线程提交后删除
+        self.pending = self.read()
+        self.last_id = self.pending[-1]['id'] if self.pending else 0
+
+    def read(self):
+        # 读取日志；最后一行可能在写入时中断（程序崩溃），从第一条无法解析的行开始丢弃并重写文件
+        entries = []
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                lines = file.read().split('\n')
+        except OSError:
+            return entries
+        for line in lines:
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                print(f"Edit journal is truncated, dropping the incomplete tail: {self.path}")
+                self.rewrite(entries)
+                break
+        return entries
+
+    def rewrite(self, entries):
+        # 先写临时文件再替换，替换是原子的，不会留下写了一半的日志
+        if not entries:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            for entry in entries:
+                file.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+    def append(self, kind, payload):
+        # 追加一条修改，写入磁盘后才返回
+        with self.lock:
+            self.last_id += 1
+            entry = {'id': self.last_id, 'kind': kind, 'payload': payload}
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+            self.pending.append(entry)
+            return entry
+
+    def entries(self):
+        with self.lock:
+            return list(self.pending)
+
+    def has_pending(self):
+        return bool(self.pending)
+
+    def discard(self, entry_id):
+        # 删除序号不大于 entry_id 的条目（已提交到服务器）
+        with self.lock:
+            self.pending = [entry for entry in self.pending if entry['id'] > entry_id]
+            self.rewrite(self.pending)
+
+    def clear(self):
+        # 放弃所有未提交的修改
+        with self.lock:
+            self.pending = []
+            self.rewrite(self.pending)
+
+
+_shared_journals = {}
+_shared_journals_lock = threading.Lock()
+
+
+def get_edit_journal(key):
+    # 进程内每个表格共享一个日志对象：打开同一表格的各个窗口看到相同的未提交修改，提交或放弃后都不再叠加
+    with _shared_journals_lock:
+        journal = _shared_journals.get(key)
+        if journal is None:
+            journal = _shared_journals[key] = EditJournal(key)
+        return journal
@@ -2,8 +2,12 @@ from PySide6.QtWidgets import QWidget, QVBoxLayout, QTableWidget, QTableWidgetIt
 from PySide6.QtGui import QColor
 from PySide6.QtCore import Qt
 from basic_function.menu_operations import MenuOperations
+from basic_function.change_tracker import ChangeTracker
+from window.sheet_model import SheetTableView
 
 class ExcelEditor(QWidget):
+    track_changes = True  # 是否跟踪用户修改（只读编辑器不需要）
+
     def __init__(self, parent=None, data=None, columns=11, headers=None, enable_context_menu=True, locked_rows=None):
         super().__init__(parent)
         self.data = data if data else []  # 初始化数据
@@ -15,7 +19,7 @@ class ExcelEditor(QWidget):
 
     def init_ui(self):
         layout = QVBoxLayout()
-        self.table = QTableWidget(10, self.columns)  # 设置表格列数
+        self.table = self.create_table(10, self.columns)  # 设置表格列数
         layout.addWidget(self.table)
         self.setLayout(layout)
 
@@ -25,6 +29,13 @@ class ExcelEditor(QWidget):
         # 设置表头
         self.table.setHorizontalHeaderLabels(self.headers)
 
+        # 跟踪用户修改，保存时只写入变化的部分
+        self.change_tracker = ChangeTracker.for_table(self.table)
+        if self.track_changes:
+            self.table.itemChanged.connect(lambda item: self.change_tracker.mark_item(item.row(), item.column()))
+            self.table.verticalHeader().sectionResized.connect(lambda row, old, new: self.change_tracker.mark_row_height(row))
+            self.table.horizontalHeader().sectionResized.connect(lambda col, old, new: self.change_tracker.mark_col_width(col))
+
         if self.enable_context_menu:
             # 初始化 MenuOperations 仅当允许右键菜单时
             self.menu_operations = MenuOperations(self.table)
@@ -36,6 +47,9 @@ class ExcelEditor(QWidget):
         if self.data:
             self.load_data(self.data)
 
+    def create_table(self, rows, columns):
+        return QTableWidget(rows, columns)
+
     def initialize_table_background(self):
         for row in range(self.table.rowCount()):
             for column in range(self.table.columnCount()):
@@ -69,15 +83,21 @@ class ExcelEditor(QWidget):
             data.append(row_data)
         return data
 
-class ReadOnlyExcelEditor(ExcelEditor):
+class ModelExcelEditor(ExcelEditor):
+    # 基于 SheetTableView（按列存储的模型）的编辑器，不为每个单元格创建 QTableWidgetItem，适合很大的表格
+    def create_table(self, rows, columns):
+        return SheetTableView(rows, columns)
+
+    def initialize_table_background(self):
+        pass  # 模型中的单元格默认就是白色背景
+
+class ReadOnlyExcelEditor(ModelExcelEditor):
+    track_changes = False  # 表格不可编辑，加载和调整尺寸都不是需要保存的修改
+
     def __init__(self, parent=None, data=None, columns=11, headers=None):
         super().__init__(parent, data, columns, headers, enable_context_menu=False)  # 禁用右键菜单
         self.set_table_read_only()
 
     def set_table_read_only(self):
-        for row in range(self.table.rowCount()):
-            for column in range(self.table.columnCount()):
-                item = self.table.item(row, column)
-                if item:
-                    item.setFlags(item.flags() & ~Qt.ItemIsEditable)
+        self.table.sheet_model.read_only = True  # 所有单元格（包括之后加载的）都不可编辑
         self.table.setEditTriggers(QTableWidget.NoEditTriggers)  # 禁止编辑
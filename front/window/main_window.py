@@ -1,17 +1,45 @@
+import os
+import sys
+import time
+import importlib
+from collections import OrderedDict
 from PySide6.QtWidgets import QMainWindow, QVBoxLayout, QLabel, QPushButton, QWidget, QFrame, QHBoxLayout, QTextEdit
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, Signal
 from PySide6.QtGui import QFont
 from pages.kpi_rules import KPI_RULES_TEXT
-from pages.kpi_process_plan import KPIProcessPlan, ReadOnlyKPIProcessPlan
-from pages.second_page import SecondPage, ReadOnlySecondPage
-from pages.page3_admin import AdminPage3  # 添加此行
-from pages.page3_user import ReadOnlyPage3  # 添加此行
 from functools import partial
 
+# 页面模块（以及它们依赖的 pandas、数据库读写等）在第一次打开页面时才导入，登录窗口和主窗口显示前不需要加载
+# 页面号 -> (模块, 管理员使用的页面类, 普通用户使用的页面类)
+PAGE_CLASSES = {
+    1: ('pages.kpi_process_plan', 'KPIProcessPlan', 'ReadOnlyKPIProcessPlan'),
+    2: ('pages.second_page', 'SecondPage', 'ReadOnlySecondPage'),
+    3: ('pages.page3_admin', 'AdminPage3', 'AdminPage3'),
+}
+PROFILE_IMPORTS = bool(os.environ.get('KPI_PROFILE_IMPORTS'))  # 设置后打印每个页面模块第一次导入的耗时
+# 页面窗口在本次登录中复用：关闭的页面只是隐藏，最多保留这么多个，再次打开时直接显示并在后台比对数据版本
+PAGE_CACHE_SIZE = int(os.environ.get('KPI_PAGE_CACHE_SIZE', 3))
+
+
+def load_page_class(page_number, is_admin):
+    # 导入页面模块并返回页面类；模块已导入时直接返回
+    module_name, admin_class, user_class = PAGE_CLASSES[page_number]
+    first_import = module_name not in sys.modules
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if PROFILE_IMPORTS and first_import:
+        print(f"[startup] import {module_name}: {(time.perf_counter() - start) * 1000:.0f} ms")
+    return getattr(module, admin_class if is_admin else user_class)
+
+
 class MainWindow(QMainWindow):
+    logged_out = Signal()  # 用户注销，登录窗口重新显示
+
     def __init__(self, is_admin=False):
         super().__init__()
         self.is_admin = is_admin
+        self.pages = OrderedDict()  # 页面号 -> 页面窗口，按最近打开的顺序排列（最后为最近）
+        self.prefetcher = None  # 登录后在后台预取表格
         self.init_ui()
 
     def init_ui(self):
@@ -55,26 +83,68 @@ class MainWindow(QMainWindow):
             button.setFixedSize(100, 40)
             button.clicked.connect(partial(self.show_page, i))
             button_layout.addWidget(button)
+        logout_button = QPushButton('注销')
+        logout_button.setFont(font)
+        logout_button.setFixedSize(100, 40)
+        logout_button.clicked.connect(self.logout)
+        button_layout.addWidget(logout_button)
         main_layout.addLayout(button_layout)
 
+    def start_prefetch(self):
+        # 登录后在后台预取各页面的表格，第一次打开页面时直接显示（普通用户的 KPI 页面按需加载，不预取）
+        from basic_function.background_tasks import start_prefetch, PREFETCH_SHEETS
+        sheets = [sheet for sheet in PREFETCH_SHEETS if self.is_admin or sheet[0] != 'kpi_process_plan']
+        self.prefetcher = start_prefetch(sheets)
+
+    def logout(self):
+        # 先通知登录窗口显示（避免关闭最后一个窗口时退出程序），再关闭页面并取消预取
+        self.logged_out.emit()
+        self.close()
+
     def show_page(self, page_number):
-        if page_number == 1:
-            if self.is_admin:
-                self.page = KPIProcessPlan()
-            else:
-                self.page = ReadOnlyKPIProcessPlan()
-        elif page_number == 2:
-            if self.is_admin:
-                self.page = SecondPage()
-            else:
-                self.page = ReadOnlySecondPage()
-        elif page_number == 3:
-                self.page = AdminPage3(is_admin=self.is_admin) 
-        else:
-            read_only = not self.is_admin and page_number > 2
-            self.page = self.create_text_page(page_number, read_only)
-
-        self.page.show()
+        # 已打开的页面直接激活；缓存中关闭的页面重新显示，只在后台比对数据版本；否则创建新页面
+        page = self.pages.pop(page_number, None)
+        if page is None:
+            page = self.create_page(page_number)
+        elif not page.isVisible():
+            reopen_page = getattr(page, 'reopen_page', None)
+            if reopen_page is not None:
+                reopen_page()
+        self.pages[page_number] = page
+        self.page = page
+        page.show()
+        page.raise_()
+        page.activateWindow()
+        self.trim_page_cache()
+
+    def create_page(self, page_number):
+        if page_number in (1, 2):
+            return load_page_class(page_number, self.is_admin)()
+        if page_number == 3:
+            return load_page_class(page_number, self.is_admin)(is_admin=self.is_admin)
+        read_only = not self.is_admin and page_number > 2
+        return self.create_text_page(page_number, read_only)
+
+    def trim_page_cache(self):
+        # 关闭（隐藏）的页面超过 PAGE_CACHE_SIZE 个时，释放最久没有打开的页面
+        closed = [number for number, page in self.pages.items() if not page.isVisible()]
+        for number in closed[:max(len(closed) - PAGE_CACHE_SIZE, 0)]:
+            self.pages.pop(number).deleteLater()
+
+    def close_pages(self):
+        # 关闭并释放本次登录打开的所有页面（关闭时写入未保存的修改、取消尚未完成的加载）
+        for page in self.pages.values():
+            page.close()
+            page.deleteLater()
+        self.pages.clear()
+        self.page = None
+
+    def closeEvent(self, event):
+        if self.prefetcher is not None:
+            self.prefetcher.stop()  # 取消尚未完成的预取，释放预取的数据
+            self.prefetcher = None
+        self.close_pages()
+        super().closeEvent(event)
 
     @staticmethod
     def create_text_page(page_number, read_only):
@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import time
+import zlib
+
+try:
+    import redis
+except ImportError:  # 未安装 redis 库时缓存不可用，直接读取 MongoDB
+    redis = None
+
+# Redis 读穿透缓存：按版本号保存完整的表格快照
+#   kpi:sheet:<库名>:<集合名>:revision        当前版本号
+#   kpi:sheet:<库名>:<集合名>:<版本号>         压缩后的 JSON 快照
+REDIS_URL = os.environ.get('KPI_REDIS_URL', 'redis://localhost:6379/0')
+SNAPSHOT_TTL = int(os.environ.get('KPI_REDIS_SNAPSHOT_TTL', 3600))  # 快照过期时间（秒）
+RETRY_INTERVAL = 30  # Redis 不可用后，间隔多少秒再尝试
+
+
+def encode_snapshot(document):
+    # 快照序列化：JSON + zlib 压缩（zlib 自带校验和，损坏的数据解压时会报错）
+    return zlib.compress(json.dumps(document, ensure_ascii=False, default=str).encode())
+
+
+def decode_snapshot(value):
+    # 快照反序列化，数据损坏时返回 None
+    try:
+        return json.loads(zlib.decompress(value))
+    except (zlib.error, ValueError):
+        return None
+
+
+class InMemoryRedis:
+    # 进程内的简易 Redis 替代品，只实现缓存用到的命令，可用于测试或没有 redis-server 的环境
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            expire_at = self.expires.get(key)
+            if expire_at is not None and expire_at <= time.monotonic():
+                self.values.pop(key, None)
+                self.expires.pop(key, None)
+            return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        with self.lock:
+            self.values[key] = value if isinstance(value, bytes) else str(value).encode()
+            if ex:
+                self.expires[key] = time.monotonic() + ex
+            else:
+                self.expires.pop(key, None)
+            return True
+
+    def delete(self, *keys):
+        with self.lock:
+            removed = 0
+            for key in keys:
+                if self.values.pop(key, None) is not None:
+                    removed += 1
+                self.expires.pop(key, None)
+            return removed
+
+
+class SheetCache:
+    def __init__(self, client=None, url=REDIS_URL, ttl=SNAPSHOT_TTL):
+        self.ttl = ttl
+        self.client = client
+        if client is None and redis is not None and url:
+            self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.unavailable_until = 0  # Redis 出错后暂停使用到此时间
+
+    def available(self):
+        return self.client is not None and time.monotonic() >= self.unavailable_until
+
+    def call(self, method, *args, **kwargs):
+        # 执行 Redis 命令，出错时暂时停用缓存并返回 None，调用方回退到 MongoDB
+        if not self.available():
+            return None
+        try:
+            return getattr(self.client, method)(*args, **kwargs)
+        except Exception as e:
+            print(f"Redis cache unavailable, falling back to MongoDB: {e}")
+            self.unavailable_until = time.monotonic() + RETRY_INTERVAL
+            return None
+
+    @staticmethod
+    def key(db_name, collection_name, suffix):
+        return f'kpi:sheet:{db_name}:{collection_name}:{suffix}'
+
+    def current_revision(self, db_name, collection_name):
+        value = self.call('get', self.key(db_name, collection_name, 'revision'))
+        return int(value) if value is not None else None
+
+    def get(self, db_name, collection_name):
+        # 读取当前版本的快照，未命中时返回 None
+        revision = self.current_revision(db_name, collection_name)
+        if revision is None:
+            return None
+        value = self.call('get', self.key(db_name, collection_name, revision))
+        if value is None:
+            return None
+        return decode_snapshot(value)
+
+    def put(self, db_name, collection_name, document):
+        # 写入快照并把版本号指向它；缓存中已有更新的版本时不覆盖
+        revision = document.get('revision', 0)
+        current = self.current_revision(db_name, collection_name)
+        if current is not None and current > revision:
+            return
+        value = encode_snapshot(document)
+        if self.call('set', self.key(db_name, collection_name, revision), value, ex=self.ttl):
+            self.call('set', self.key(db_name, collection_name, 'revision'), revision, ex=self.ttl)
+
+    def mark_revision(self, db_name, collection_name, revision):
+        # 增量保存后只更新版本号：新版本还没有快照，下次读取时回源到 MongoDB 并写入快照，
+        # 同时阻止仍在读取旧版本的客户端把旧快照写回
+        self.call('set', self.key(db_name, collection_name, 'revision'), revision, ex=self.ttl)
+
+    def invalidate(self, db_name, collection_name):
+        # 删除版本号，下次读取时回源到 MongoDB
+        self.call('delete', self.key(db_name, collection_name, 'revision'))
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_sheet_cache():
+    # 进程内共享的缓存实例，首次使用时创建
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                _shared_cache = SheetCache()
+    return _shared_cache
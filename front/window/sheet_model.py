@@ -0,0 +1,485 @@
+from array import array
+from collections import OrderedDict
+from PySide6.QtWidgets import QTableView, QTableWidgetItem, QTableWidgetSelectionRange
+from PySide6.QtGui import QBrush, QColor, QFont
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, Signal
+from basic_function.style_codec import DEFAULT_COLOR, alignment_value
+
+# 按列存储的表格模型：每列一个文本列表和一个样式编号数组，样式通过共享的样式表解析，
+# 不再为每个单元格创建 QTableWidgetItem（以及各自的 QFont/QColor），百万单元格的表格也能流畅滚动。
+# SheetTableView 提供页面、菜单操作和筛选代码使用的 QTableWidget 接口（item/setItem/rowCount 等），
+# item() 返回按需创建的 SheetCell 代理，读写直接作用于模型
+
+EDITABLE_FLAGS = Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
+
+
+class SheetModel(QAbstractTableModel):
+    def __init__(self, rows=0, columns=0, default_style=None, parent=None):
+        super().__init__(parent)
+        self.row_count = rows
+        self.texts = [[''] * rows for _ in range(columns)]  # 每列的文本
+        self.styles = [array('I', bytes(4 * rows)) for _ in range(columns)]  # 每列的样式编号，0 为默认样式
+        self.palette = [default_style or (DEFAULT_COLOR, False, 9, 0)]  # 样式编号 -> (颜色, 加粗, 字号, 对齐)
+        self.palette_index = {self.palette[0]: 0}
+        self.brushes = [None]  # 样式编号 -> 共享的 QBrush / QFont，默认样式使用视图的设置
+        self.fonts = [None]
+        self.headers = {}  # 列号 -> 表头文本
+        self.locked = set()  # 不可编辑的单元格 (row, col)
+        self.read_only = False
+
+    # ---- QAbstractTableModel 接口 ----
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.row_count
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.texts)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, col = index.row(), index.column()
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return self.cell_text(row, col)
+        style_id = self.style_id(row, col)
+        if style_id == 0:
+            return None
+        if role == Qt.BackgroundRole:
+            return self.brushes[style_id]
+        if role == Qt.FontRole:
+            return self.fonts[style_id]
+        if role == Qt.TextAlignmentRole:
+            return self.palette[style_id][3] or None
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or role != Qt.EditRole:
+            return False
+        self.set_text(index.row(), index.column(), '' if value is None else str(value))
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        if self.read_only or (index.row(), index.column()) in self.locked:
+            return Qt.ItemIsSelectable | Qt.ItemIsEnabled
+        return EDITABLE_FLAGS
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.headers.get(section, str(section + 1))
+        return str(section + 1)
+
+    def setHeaderData(self, section, orientation, value, role=Qt.EditRole):
+        if orientation != Qt.Horizontal:
+            return False
+        self.headers[section] = value
+        self.headerDataChanged.emit(orientation, section, section)
+        return True
+
+    def insertRows(self, row, count, parent=QModelIndex()):
+        self.beginInsertRows(parent, row, row + count - 1)
+        for texts, styles in zip(self.texts, self.styles):
+            texts[row:row] = [''] * count
+            styles[row:row] = array('I', bytes(4 * count))
+        self.row_count += count
+        self.locked = {(r + count if r >= row else r, c) for r, c in self.locked}
+        self.endInsertRows()
+        return True
+
+    def removeRows(self, row, count, parent=QModelIndex()):
+        self.beginRemoveRows(parent, row, row + count - 1)
+        for texts, styles in zip(self.texts, self.styles):
+            del texts[row:row + count]
+            del styles[row:row + count]
+        self.row_count -= count
+        self.locked = {(r - count if r >= row + count else r, c) for r, c in self.locked if not row <= r < row + count}
+        self.endRemoveRows()
+        return True
+
+    def insertColumns(self, col, count, parent=QModelIndex()):
+        self.beginInsertColumns(parent, col, col + count - 1)
+        self.texts[col:col] = [[''] * self.row_count for _ in range(count)]
+        self.styles[col:col] = [array('I', bytes(4 * self.row_count)) for _ in range(count)]
+        self.headers = {c + count if c >= col else c: text for c, text in self.headers.items()}
+        self.locked = {(r, c + count if c >= col else c) for r, c in self.locked}
+        self.endInsertColumns()
+        return True
+
+    def removeColumns(self, col, count, parent=QModelIndex()):
+        self.beginRemoveColumns(parent, col, col + count - 1)
+        del self.texts[col:col + count]
+        del self.styles[col:col + count]
+        self.headers = {c - count if c >= col + count else c: text for c, text in self.headers.items() if not col <= c < col + count}
+        self.locked = {(r, c - count if c >= col + count else c) for r, c in self.locked if not col <= c < col + count}
+        self.endRemoveColumns()
+        return True
+
+    # ---- 单元格读写 ----
+
+    def notify(self, row, col):
+        index = self.index(row, col)
+        self.dataChanged.emit(index, index)
+
+    def cell_text(self, row, col):
+        return self.texts[col][row]
+
+    def style_id(self, row, col):
+        return self.styles[col][row]
+
+    def set_text(self, row, col, text, notify=True):
+        self.texts[col][row] = text
+        if notify:
+            self.notify(row, col)
+
+    def style(self, row, col):
+        return self.palette[self.style_id(row, col)]
+
+    def intern_style(self, style_key):
+        # 返回样式编号，新样式追加到样式表并创建共享的 QBrush/QFont
+        style_id = self.palette_index.get(style_key)
+        if style_id is None:
+            color, bold, size, alignment = style_key
+            font = QFont()
+            font.setBold(bold)
+            if size > 0:
+                font.setPointSize(size)
+            style_id = len(self.palette)
+            self.palette.append(style_key)
+            self.palette_index[style_key] = style_id
+            self.brushes.append(QBrush(QColor(color)))
+            self.fonts.append(font)
+        return style_id
+
+    def set_style(self, row, col, style_key, notify=True):
+        self.styles[col][row] = self.intern_style(style_key)
+        if notify:
+            self.notify(row, col)
+
+    def set_cell(self, row, col, text, style_key, editable=True):
+        # 一次写入文本、样式和可编辑状态，只发出一次修改通知
+        self.texts[col][row] = text
+        self.styles[col][row] = self.intern_style(style_key)
+        if editable:
+            self.locked.discard((row, col))
+        else:
+            self.locked.add((row, col))
+        self.notify(row, col)
+
+    def resize(self, rows, columns):
+        # 调整行列数，新增的单元格为空白默认样式
+        if columns < len(self.texts):
+            self.removeColumns(columns, len(self.texts) - columns)
+        if rows < self.row_count:
+            self.removeRows(rows, self.row_count - rows)
+        if rows > self.row_count:
+            self.insertRows(self.row_count, rows - self.row_count)
+        if columns > len(self.texts):
+            self.insertColumns(len(self.texts), columns - len(self.texts))
+
+    def set_rows(self, rows, first_row=0, styles=None):
+        # 批量写入多行文本并把这些行恢复为默认样式，只重置一次模型而不是逐个单元格通知；
+        # styles 为 {(行, 列): 样式}，在同一次重置中应用
+        self.beginResetModel()
+        last_row = first_row + len(rows)
+        if last_row > self.row_count:
+            for column_texts, column_styles in zip(self.texts, self.styles):
+                column_texts.extend([''] * (last_row - self.row_count))
+                column_styles.extend(array('I', bytes(4 * (last_row - self.row_count))))
+            self.row_count = last_row
+        for col, (column_texts, column_styles) in enumerate(zip(self.texts, self.styles)):
+            column_texts[first_row:last_row] = [row[col] if col < len(row) else '' for row in rows]
+            column_styles[first_row:last_row] = array('I', bytes(4 * len(rows)))
+        for (row, col), style_key in (styles or {}).items():
+            if row < self.row_count and col < len(self.styles):
+                self.styles[col][row] = self.intern_style(style_key)
+        self.endResetModel()
+
+    def permute_rows(self, first_row, moves):
+        # 重新排列 first_row 开始的行：新的第 i 行为原来的第 moves[i] 行（文本、样式和可编辑状态一起移动）
+        self.beginResetModel()
+        last_row = first_row + len(moves)
+        for column_texts, column_styles in zip(self.texts, self.styles):
+            column_texts[first_row:last_row] = [column_texts[first_row + row] for row in moves]
+            column_styles[first_row:last_row] = array('I', [column_styles[first_row + row] for row in moves])
+        if self.locked:
+            new_row = {first_row + row: first_row + index for index, row in enumerate(moves)}
+            self.locked = {(new_row.get(row, row), col) for row, col in self.locked}
+        self.endResetModel()
+
+    def clear_contents(self):
+        self.beginResetModel()
+        self.texts = [[''] * self.row_count for _ in self.texts]
+        self.styles = [array('I', bytes(4 * self.row_count)) for _ in self.styles]
+        self.locked = set()
+        self.endResetModel()
+
+
+class SheetCell:
+    # 模拟 QTableWidgetItem 的单元格代理：不保存状态，每次读写都直接访问模型
+    __slots__ = ('model', 'row_index', 'column_index')
+
+    def __init__(self, model, row, col):
+        self.model = model
+        self.row_index = row
+        self.column_index = col
+
+    def row(self):
+        return self.row_index
+
+    def column(self):
+        return self.column_index
+
+    def text(self):
+        return self.model.cell_text(self.row_index, self.column_index)
+
+    def setText(self, text):
+        self.model.set_text(self.row_index, self.column_index, text)
+
+    def background(self):
+        return QBrush(QColor(self.model.style(self.row_index, self.column_index)[0]))
+
+    def setBackground(self, value):
+        color = value.color() if isinstance(value, QBrush) else QColor(value)
+        style = self.model.style(self.row_index, self.column_index)
+        self.model.set_style(self.row_index, self.column_index, (color.name(),) + style[1:])
+
+    def font(self):
+        style_id = self.model.style_id(self.row_index, self.column_index)
+        return QFont(self.model.fonts[style_id]) if style_id else QFont()
+
+    def setFont(self, font):
+        color, bold, size, alignment = self.model.style(self.row_index, self.column_index)
+        self.model.set_style(self.row_index, self.column_index, (color, font.bold(), font.pointSize(), alignment))
+
+    def textAlignment(self):
+        return self.model.style(self.row_index, self.column_index)[3]
+
+    def setTextAlignment(self, alignment):
+        color, bold, size, _ = self.model.style(self.row_index, self.column_index)
+        self.model.set_style(self.row_index, self.column_index, (color, bold, size, alignment_value(alignment)))
+
+    def flags(self):
+        return self.model.flags(self.model.index(self.row_index, self.column_index))
+
+    def setFlags(self, flags):
+        if flags & Qt.ItemIsEditable:
+            self.model.locked.discard((self.row_index, self.column_index))
+        else:
+            self.model.locked.add((self.row_index, self.column_index))
+
+
+def item_style(item, default_style):
+    # 读取 QTableWidgetItem（或 SheetCell）的样式，没有设置背景时使用默认颜色
+    background = item.background()
+    color = background.color().name() if background.style() != Qt.NoBrush else default_style[0]
+    font = item.font()
+    return (color, font.bold(), font.pointSize(), alignment_value(item.textAlignment()))
+
+
+class SheetTableView(QTableView):
+    itemChanged = Signal(object)  # 与 QTableWidget 相同：参数为被修改的单元格
+    rangeChanged = Signal(int, int, int, int)  # 一次更新了多个单元格（例如按需加载的行块到达）：首行、首列、末行、末列
+    cellDoubleClicked = Signal(int, int)
+
+    def __init__(self, rows=0, columns=0, parent=None):
+        super().__init__(parent)
+        font = self.font()
+        default_style = (DEFAULT_COLOR, font.bold(), font.pointSize(), alignment_value(QTableWidgetItem().textAlignment()))
+        self.sheet_model = None
+        self.use_model(SheetModel(rows, columns, default_style, self))
+        self.doubleClicked.connect(lambda index: self.cellDoubleClicked.emit(index.row(), index.column()))
+
+    def default_style(self):
+        return self.sheet_model.palette[0]
+
+    def use_model(self, model):
+        # 换用另一个模型（例如按需加载的 LazySheetModel），原有的只读状态保持不变
+        if self.sheet_model is not None:
+            self.sheet_model.dataChanged.disconnect(self.on_data_changed)
+            model.read_only = model.read_only or self.sheet_model.read_only
+            self.sheet_model.deleteLater()
+        self.sheet_model = model
+        self.setModel(model)
+        model.dataChanged.connect(self.on_data_changed)
+
+    def on_data_changed(self, top_left, bottom_right, roles=None):
+        # 单个单元格的修改按 QTableWidget 的方式发出 itemChanged；多个单元格的更新只发出一次 rangeChanged，
+        # 不为每个单元格各调用一次 Python 槽函数
+        if top_left == bottom_right:
+            self.itemChanged.emit(SheetCell(self.sheet_model, top_left.row(), top_left.column()))
+        else:
+            self.rangeChanged.emit(top_left.row(), top_left.column(), bottom_right.row(), bottom_right.column())
+
+    # ---- QTableWidget 兼容接口 ----
+
+    def rowCount(self):
+        return self.sheet_model.rowCount()
+
+    def columnCount(self):
+        return self.sheet_model.columnCount()
+
+    def setRowCount(self, rows):
+        self.sheet_model.resize(rows, self.columnCount())
+
+    def setColumnCount(self, columns):
+        self.sheet_model.resize(self.rowCount(), columns)
+
+    def insertRow(self, row):
+        self.sheet_model.insertRows(row, 1)
+
+    def removeRow(self, row):
+        self.sheet_model.removeRows(row, 1)
+
+    def insertColumn(self, col):
+        self.sheet_model.insertColumns(col, 1)
+
+    def removeColumn(self, col):
+        self.sheet_model.removeColumns(col, 1)
+
+    def item(self, row, col):
+        if 0 <= row < self.rowCount() and 0 <= col < self.columnCount():
+            return SheetCell(self.sheet_model, row, col)
+        return None
+
+    def setItem(self, row, col, item):
+        # 复制 QTableWidgetItem 的文本、样式和可编辑状态到模型中，不保留 item 本身
+        if 0 <= row < self.rowCount() and 0 <= col < self.columnCount():
+            style = item_style(item, self.sheet_model.palette[0])
+            self.sheet_model.set_cell(row, col, item.text(), style, bool(item.flags() & Qt.ItemIsEditable))
+
+    def set_rows(self, rows, first_row=0, styles=None):
+        self.sheet_model.set_rows(rows, first_row, styles)
+
+    def permute_rows(self, first_row, moves):
+        self.sheet_model.permute_rows(first_row, moves)
+
+    def clear(self):
+        # 与 QTableWidget.clear 相同：清空单元格和表头
+        self.sheet_model.headers = {}
+        self.sheet_model.clear_contents()
+
+    def clearContents(self):
+        self.sheet_model.clear_contents()
+
+    def setHorizontalHeaderLabels(self, labels):
+        for col, label in enumerate(labels):
+            self.sheet_model.setHeaderData(col, Qt.Horizontal, label)
+
+    def horizontalHeaderItem(self, col):
+        text = self.sheet_model.headers.get(col)
+        return QTableWidgetItem(text) if text is not None else None
+
+    def setHorizontalHeaderItem(self, col, item):
+        self.sheet_model.setHeaderData(col, Qt.Horizontal, item.text())
+
+    def currentRow(self):
+        return self.currentIndex().row()
+
+    def currentColumn(self):
+        return self.currentIndex().column()
+
+    def selectedIndexes(self):
+        return self.selectionModel().selectedIndexes()
+
+    def selectedItems(self):
+        return [SheetCell(self.sheet_model, index.row(), index.column()) for index in self.selectedIndexes()]
+
+    def selectedRanges(self):
+        return [QTableWidgetSelectionRange(selection.top(), selection.left(), selection.bottom(), selection.right())
+                for selection in self.selectionModel().selection()]
+
+    def setCellWidget(self, row, col, widget):
+        self.setIndexWidget(self.sheet_model.index(row, col), widget)
+
+    def cellWidget(self, row, col):
+        return self.indexWidget(self.sheet_model.index(row, col))
+
+    def removeCellWidget(self, row, col):
+        self.setIndexWidget(self.sheet_model.index(row, col), None)
+
+
+MAX_CACHED_BLOCKS = 20  # 按需加载时内存中最多保留的行块数
+
+
+class BlockCache:
+    # 最近最少使用（LRU）的行块缓存，超过容量时丢弃最久未访问的行块
+    def __init__(self, capacity=MAX_CACHED_BLOCKS):
+        self.capacity = capacity
+        self.blocks = OrderedDict()
+
+    def get(self, block_id):
+        block = self.blocks.get(block_id)
+        if block is not None:
+            self.blocks.move_to_end(block_id)
+        return block
+
+    def put(self, block_id, block):
+        self.blocks[block_id] = block
+        self.blocks.move_to_end(block_id)
+        while len(self.blocks) > self.capacity:
+            self.blocks.popitem(last=False)
+
+    def clear(self):
+        self.blocks.clear()
+
+
+class LazySheetModel(SheetModel):
+    # 按需加载的只读模型：先只显示第一屏，滚动时通过 canFetchMore/fetchMore 逐块增加行数；
+    # 行块数据保存在有界的 LRU 缓存中，显示到未缓存（或已被淘汰）的行块时调用 request_block(块号) 在后台读取，
+    # 读取完成后由 add_block 放入缓存并刷新这些行
+    def __init__(self, total_rows, columns, block_size, request_block, default_style=None, header_row=False, parent=None):
+        super().__init__(0, columns, default_style, parent)
+        self.total_rows = total_rows
+        self.block_size = block_size
+        self.request_block = request_block
+        self.header_row = header_row  # 用户视图：首行数据用作表头，表格第 0 行留空
+        self.row_count = min(block_size, total_rows)
+        self.blocks = BlockCache()
+        self.pending = set()  # 已请求但还没有返回的行块
+        self.read_only = True
+
+    def block(self, row):
+        block_id = row // self.block_size
+        block = self.blocks.get(block_id)
+        if block is None and block_id not in self.pending:
+            self.pending.add(block_id)
+            self.request_block(block_id)
+        return block
+
+    def cell_text(self, row, col):
+        if self.header_row and row == 0:
+            return ''
+        block = self.block(row)
+        if block is None:
+            return ''
+        texts = block[0]
+        offset = row % self.block_size
+        return texts[offset][col] if offset < len(texts) and col < len(texts[offset]) else ''
+
+    def style_id(self, row, col):
+        block = self.blocks.get(row // self.block_size)
+        return block[1].get((row, col), 0) if block is not None else 0
+
+    def add_block(self, block_id, rows, styles):
+        # rows: 行块中的数据行；styles: {(行, 列): 样式}，只包含与默认样式不同的单元格
+        self.pending.discard(block_id)
+        style_ids = {cell: self.intern_style(style) for cell, style in styles.items()}
+        self.blocks.put(block_id, (rows, style_ids))
+        first_row = block_id * self.block_size
+        last_row = min(first_row + self.block_size, self.row_count) - 1
+        if first_row <= last_row:
+            self.dataChanged.emit(self.index(first_row, 0), self.index(last_row, self.columnCount() - 1))
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.row_count < self.total_rows
+
+    def fetchMore(self, parent=QModelIndex()):
+        count = min(self.block_size, self.total_rows - self.row_count)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.row_count, self.row_count + count - 1)
+        self.row_count += count
+        self.endInsertRows()
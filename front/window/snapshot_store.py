@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import threading
+import time
+from window.sheet_cache import encode_snapshot, decode_snapshot
+
+# 本地磁盘快照：保存每个集合最近一次加载的完整表格，启动时先从本地显示，再在后台与服务器同步
+# 使用 SQLite 保存，每次写入都在事务中完成，程序崩溃或断电不会留下写了一半的快照
+MAX_CACHE_BYTES = int(os.environ.get('KPI_SNAPSHOT_CACHE_MB', 256)) * 1024 * 1024  # 缓存总大小上限
+
+
+def default_cache_dir():
+    # 用户缓存目录：Windows 下为 %LOCALAPPDATA%，其他系统为 $XDG_CACHE_HOME 或 ~/.cache
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'kpi_client')
+
+
+class SnapshotStore:
+    def __init__(self, path=None, max_bytes=MAX_CACHE_BYTES):
+        self.path = path or os.path.join(default_cache_dir(), 'snapshots.sqlite3')
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()  # 连接在多个后台线程间共享，串行访问
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS snapshots ('
+                'key TEXT PRIMARY KEY, revision INTEGER, data BLOB, size INTEGER, accessed REAL)')
+            self.connection.commit()
+        return self.connection
+
+    def reset(self):
+        # 缓存文件损坏时删除并重新创建
+        print(f"Snapshot cache is corrupt, recreating: {self.path}")
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        if self.path != ':memory:':
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(self.path + suffix)
+                except OSError:
+                    pass
+
+    def get(self, key):
+        # 读取快照，不存在或已损坏时返回 None
+        with self.lock:
+            try:
+                connection = self.connect()
+                row = connection.execute('SELECT data FROM snapshots WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    return None
+                document = decode_snapshot(row[0])
+                if document is None:
+                    connection.execute('DELETE FROM snapshots WHERE key = ?', (key,))
+                else:
+                    connection.execute('UPDATE snapshots SET accessed = ? WHERE key = ?', (time.time(), key))
+                connection.commit()
+                return document
+            except sqlite3.DatabaseError:
+                self.reset()
+                return None
+
+    def put(self, key, document):
+        # 写入快照，超出大小上限时按最近访问时间淘汰旧快照
+        with self.lock:
+            try:
+                connection = self.connect()
+                with connection:
+                    row = connection.execute('SELECT revision FROM snapshots WHERE key = ?', (key,)).fetchone()
+                    if row is not None and row[0] == document.get('revision', 0):
+                        # 同一版本已保存过，只更新访问时间
+                        connection.execute('UPDATE snapshots SET accessed = ? WHERE key = ?', (time.time(), key))
+                        return
+                    data = encode_snapshot(document)
+                    connection.execute(
+                        'INSERT OR REPLACE INTO snapshots (key, revision, data, size, accessed) VALUES (?, ?, ?, ?, ?)',
+                        (key, document.get('revision', 0), data, len(data), time.time()))
+                    self.evict(connection, key)
+            except sqlite3.DatabaseError:
+                self.reset()
+
+    def evict(self, connection, keep_key):
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM snapshots').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in connection.execute(
+                'SELECT key, size FROM snapshots WHERE key != ? ORDER BY accessed', (keep_key,)).fetchall():
+            connection.execute('DELETE FROM snapshots WHERE key = ?', (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+
+def get_snapshot_store():
+    # 进程内共享的本地快照库，首次使用时创建
+    global _shared_store
+    if _shared_store is None:
+        with _shared_store_lock:
+            if _shared_store is None:
+                _shared_store = SnapshotStore()
+    return _shared_store